@@ -0,0 +1,215 @@
+import os
+import math
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Dict, Any, Optional
+from starlette.responses import JSONResponse
+
+from app.api.metrics import ADMISSION_REJECTED, observe_stage_seconds
+
+logger = logging.getLogger(__name__)
+
+# Requests on these paths are limited by the lane's controller. Everything
+# else, notably /health and /documents/count, is a priority lane that never
+# waits behind chat or ingestion traffic.
+ADMISSION_LANE_PATHS = {
+    "/chat": "chat",
+    "/chat/stream": "chat",
+    "/documents": "documents",
+    "/documents/bulk": "documents",
+}
+
+class AdmissionRejected(Exception):
+    """A request was shed instead of queued"""
+
+    def __init__(self, status_code: int, reason: str, retry_after: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.reason = reason
+        self.retry_after = retry_after
+        self.detail = detail
+
+class AdmissionController:
+    """
+    Concurrency limit with a bounded FIFO wait queue in front of one backend.
+
+    Up to max_concurrency requests run at once and up to max_queue wait for a
+    slot. A request that finds the queue full is rejected at once with 429,
+    and one that cannot start within queue_timeout seconds (or is predicted
+    not to, from the recent service time) gets 503. Both carry a Retry-After
+    estimate, so clients back off instead of piling up until they time out.
+    """
+
+    def __init__(self, name: str, max_concurrency: int, max_queue: int, queue_timeout: float):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+
+        self._active = 0
+        self._waiters: deque = deque()
+        # Moving average of the time a request holds a slot
+        self._service_time: Optional[float] = None
+        self.admitted = 0
+        self.rejected: Dict[str, int] = {"queue_full": 0, "queue_timeout": 0, "predicted_timeout": 0}
+        logger.info(
+            f"Admission control for {name}: max_concurrency={max_concurrency}, "
+            f"max_queue={max_queue}, queue_timeout={queue_timeout}s"
+        )
+
+    def _expected_wait(self, position: int) -> Optional[float]:
+        # With max_concurrency requests in service, a slot frees up every
+        # service_time / max_concurrency seconds on average
+        if self._service_time is None:
+            return None
+        return position / self.max_concurrency * self._service_time
+
+    def retry_after(self) -> int:
+        """Seconds until the current queue is expected to drain"""
+        expected = self._expected_wait(len(self._waiters) + 1)
+        return min(max(math.ceil(expected), 1), 60) if expected is not None else 1
+
+    def _reject(self, status_code: int, reason: str, detail: str) -> AdmissionRejected:
+        self.rejected[reason] += 1
+        ADMISSION_REJECTED.labels(self.name, reason).inc()
+        return AdmissionRejected(status_code, reason, self.retry_after(), detail)
+
+    async def acquire(self):
+        """
+        Wait for a slot.
+
+        Raises:
+            AdmissionRejected: If the request should be shed
+        """
+        if self._active < self.max_concurrency and not self._waiters:
+            self._active += 1
+            self.admitted += 1
+            return
+
+        if len(self._waiters) >= self.max_queue:
+            raise self._reject(429, "queue_full", f"Too many {self.name} requests queued, retry later")
+
+        expected = self._expected_wait(len(self._waiters) + 1)
+        if expected is not None and expected > self.queue_timeout:
+            raise self._reject(503, "predicted_timeout", f"The {self.name} backend is overloaded, retry later")
+
+        waiter = asyncio.get_event_loop().create_future()
+        self._waiters.append(waiter)
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            if waiter.done():
+                # Granted just as the deadline passed; the slot is ours
+                pass
+            else:
+                waiter.cancel()
+                raise self._reject(503, "queue_timeout", f"The {self.name} backend is overloaded, retry later")
+        except asyncio.CancelledError:
+            # The client went away; hand a slot granted meanwhile to the next request
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            else:
+                waiter.cancel()
+            raise
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+        self.admitted += 1
+        observe_stage_seconds(f"{self.name}_admission_wait", time.perf_counter() - start)
+
+    def release(self, service_time: Optional[float] = None):
+        """Free a slot, handing it directly to the oldest waiting request"""
+        if service_time is not None:
+            self._service_time = service_time if self._service_time is None else (
+                0.8 * self._service_time + 0.2 * service_time
+            )
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self._active -= 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return the queue state"""
+        return {
+            "active": self._active,
+            "queued": len(self._waiters),
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "queue_timeout": self.queue_timeout,
+            "service_time": self._service_time,
+            "admitted": self.admitted,
+            "rejected": dict(self.rejected),
+        }
+
+def create_admission_lanes(chat_max_concurrency: int) -> Dict[str, AdmissionController]:
+    """
+    Create one admission controller per backend: the LLM for chat requests
+    and the vector database for document writes.
+
+    Args:
+        chat_max_concurrency: Default chat concurrency of the serving backend
+    """
+    if os.environ.get("ADMISSION_ENABLED", "true").lower() != "true":
+        return {}
+
+    chat_concurrency = int(os.environ.get("CHAT_MAX_CONCURRENCY", str(chat_max_concurrency)))
+    documents_concurrency = int(os.environ.get("DOCUMENTS_MAX_CONCURRENCY", "4"))
+    return {
+        "chat": AdmissionController(
+            "chat",
+            max_concurrency=chat_concurrency,
+            max_queue=int(os.environ.get("CHAT_MAX_QUEUE", str(chat_concurrency * 4))),
+            queue_timeout=float(os.environ.get("CHAT_QUEUE_TIMEOUT", "10"))
+        ),
+        "documents": AdmissionController(
+            "documents",
+            max_concurrency=documents_concurrency,
+            max_queue=int(os.environ.get("DOCUMENTS_MAX_QUEUE", "16")),
+            queue_timeout=float(os.environ.get("DOCUMENTS_QUEUE_TIMEOUT", "30"))
+        ),
+    }
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware admitting requests through their lane's controller
+    (app.state.admission) before the request body is even read. The slot is
+    held until the response, including a streamed one, is complete.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        # CORS preflights are answered without touching a backend
+        if scope["type"] != "http" or scope["method"] == "OPTIONS":
+            await self.app(scope, receive, send)
+            return
+
+        lane = ADMISSION_LANE_PATHS.get(scope["path"].rstrip("/") or "/")
+        lanes = getattr(scope["app"].state, "admission", None) or {}
+        controller = lanes.get(lane)
+        if controller is None:
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            await controller.acquire()
+        except AdmissionRejected as e:
+            response = JSONResponse(
+                {"detail": e.detail},
+                status_code=e.status_code,
+                headers={"Retry-After": str(e.retry_after)}
+            )
+            await response(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            controller.release(time.perf_counter() - start)
@@ -0,0 +1,137 @@
+import time
+import logging
+import asyncio
+from typing import List, Dict, Any, Callable, Awaitable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+class MicroBatcher:
+    """
+    Coalesces concurrent calls into batches.
+
+    Items submitted within max_wait seconds of the first pending item are
+    handed to process_batch together (earlier if max_batch_size items are
+    pending), and every caller receives the result for its own item.
+
+    With max_concurrency set, no more than that many batches run at once;
+    items arriving while the limit is reached keep queueing and go out as
+    the next batch as soon as a running one completes.
+    """
+
+    def __init__(
+        self,
+        process_batch: Callable[[List[Any]], Awaitable[List[Any]]],
+        max_batch_size: int = 16,
+        max_wait: float = 0.005,
+        name: str = "batcher",
+        max_concurrency: Optional[int] = None,
+        wait_observer: Optional[Callable[[float], None]] = None
+    ):
+        self.process_batch = process_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait)
+        self.name = name
+        self.max_concurrency = max_concurrency
+        # Called with each item's queueing time when its batch is dispatched
+        self.wait_observer = wait_observer
+        self._running = 0
+        self._pending: List[Tuple[Any, asyncio.Future, float]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks = set()
+        
+        # Metrics
+        self.batches = 0
+        self.items = 0
+        self.max_observed_batch_size = 0
+        self.total_wait_seconds = 0.0
+        self.batch_sizes: Dict[int, int] = {}
+        logger.info(
+            f"Micro-batcher '{name}' initialized "
+            f"(max_batch_size={self.max_batch_size}, max_wait={self.max_wait * 1000:.1f}ms)"
+        )
+
+    async def submit(self, item: Any) -> Any:
+        """
+        Queue an item for the next batch and wait for its result.
+        
+        Args:
+            item: The item to process
+            
+        Returns:
+            The result produced for this item by process_batch
+        """
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        self._pending.append((item, future, time.monotonic()))
+        
+        if len(self._pending) >= self.max_batch_size or self.max_wait == 0:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+        
+        return await future
+
+    def _flush(self):
+        """Dispatch all pending items as one batch"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+        if self.max_concurrency is not None and self._running >= self.max_concurrency:
+            # Dispatched by _run_batch when a running batch completes
+            return
+        
+        batch, self._pending = self._pending[:self.max_batch_size], self._pending[self.max_batch_size:]
+        if self._pending:
+            # Overflow goes out with the next timer tick
+            self._timer = asyncio.get_event_loop().call_later(self.max_wait, self._flush)
+        
+        now = time.monotonic()
+        self.batches += 1
+        self.items += len(batch)
+        self.max_observed_batch_size = max(self.max_observed_batch_size, len(batch))
+        self.total_wait_seconds += sum(now - enqueued_at for _, _, enqueued_at in batch)
+        if self.wait_observer is not None:
+            for _, _, enqueued_at in batch:
+                self.wait_observer(now - enqueued_at)
+        self.batch_sizes[len(batch)] = self.batch_sizes.get(len(batch), 0) + 1
+        
+        self._running += 1
+        task = asyncio.ensure_future(self._run_batch(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run_batch(self, batch: List[Tuple[Any, asyncio.Future, float]]):
+        """Process a batch and fan the results back to the waiting callers"""
+        try:
+            results = await self.process_batch([item for item, _, _ in batch])
+            if len(results) != len(batch):
+                raise RuntimeError(
+                    f"Batcher '{self.name}' got {len(results)} results for {len(batch)} items"
+                )
+            for (_, future, _), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+        except Exception as e:
+            logger.error(f"Error processing batch in '{self.name}': {str(e)}", exc_info=True)
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            self._running -= 1
+            if self.max_concurrency is not None and self._pending:
+                self._flush()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return batch size and added wait time metrics"""
+        return {
+            "pending": len(self._pending),
+            "running": self._running,
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch_size": self.items / self.batches if self.batches else 0.0,
+            "max_batch_size": self.max_observed_batch_size,
+            "avg_wait_ms": self.total_wait_seconds * 1000 / self.items if self.items else 0.0,
+            "batch_sizes": dict(sorted(self.batch_sizes.items())),
+        }
@@ -0,0 +1,120 @@
+import re
+import math
+import heapq
+import logging
+import threading
+from typing import List, Dict, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Identifiers such as "ERR-1042", "v2.3.1" or "max_tokens" are kept as one token
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[-_.][a-z0-9]+)*")
+PART_PATTERN = re.compile(r"[a-z0-9]+")
+
+STOPWORDS = frozenset("""
+a an and are as at be but by for from has have how i in is it its of on or
+that the this to was what when where which who why will with you your
+""".split())
+
+class BM25Index:
+    """
+    In-process BM25 inverted index over document ids.
+
+    Only postings and document lengths are kept; the document texts stay in
+    the vector store and are fetched by id for the hits.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings: Dict[str, Dict[str, int]] = {}
+        self._doc_terms: Dict[str, Dict[str, int]] = {}
+        self._doc_lengths: Dict[str, int] = {}
+        self._total_length = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def tokenize(text: str) -> List[str]:
+        """Lowercase word tokens; compound identifiers also index their parts"""
+        tokens = []
+        for token in TOKEN_PATTERN.findall(text.lower()):
+            if token in STOPWORDS:
+                continue
+            tokens.append(token)
+            parts = PART_PATTERN.findall(token)
+            if len(parts) > 1:
+                tokens.extend(part for part in parts if part not in STOPWORDS)
+        return tokens
+
+    def __len__(self) -> int:
+        return len(self._doc_terms)
+
+    def _remove(self, doc_id: str):
+        terms = self._doc_terms.pop(doc_id, None)
+        if terms is None:
+            return
+        for term in terms:
+            postings = self._postings[term]
+            del postings[doc_id]
+            if not postings:
+                del self._postings[term]
+        self._total_length -= self._doc_lengths.pop(doc_id)
+
+    def add(self, ids: List[str], texts: List[str]):
+        """Index documents, replacing any existing entries with the same ids"""
+        tokenized = [self.tokenize(text) for text in texts]
+        with self._lock:
+            for doc_id, tokens in zip(ids, tokenized):
+                self._remove(doc_id)
+                terms: Dict[str, int] = {}
+                for token in tokens:
+                    terms[token] = terms.get(token, 0) + 1
+                self._doc_terms[doc_id] = terms
+                self._doc_lengths[doc_id] = len(tokens)
+                self._total_length += len(tokens)
+                for term, tf in terms.items():
+                    self._postings.setdefault(term, {})[doc_id] = tf
+
+    def delete(self, ids: List[str]):
+        """Remove documents from the index"""
+        with self._lock:
+            for doc_id in ids:
+                self._remove(doc_id)
+
+    def clear(self):
+        """Remove every document from the index"""
+        with self._lock:
+            self._postings.clear()
+            self._doc_terms.clear()
+            self._doc_lengths.clear()
+            self._total_length = 0
+
+    def search(self, query: str, n_results: int = 10) -> List[Tuple[str, float]]:
+        """
+        Score documents against a query.
+
+        Args:
+            query: The query text
+            n_results: Number of results to return
+
+        Returns:
+            List of (document_id, score) pairs, best first
+        """
+        terms = set(self.tokenize(query))
+        with self._lock:
+            n_docs = len(self._doc_terms)
+            if n_docs == 0 or not terms:
+                return []
+            avg_length = self._total_length / n_docs
+
+            scores: Dict[str, float] = {}
+            for term in terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc_id, tf in postings.items():
+                    norm = self.k1 * (1 - self.b + self.b * self._doc_lengths[doc_id] / avg_length)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+
+        return heapq.nlargest(n_results, scores.items(), key=lambda item: item[1])
@@ -0,0 +1,154 @@
+import os
+import logging
+from typing import List, Dict, Any, Callable, Tuple, Optional
+
+logger = logging.getLogger(__name__)
+
+def approximate_token_count(text: str) -> int:
+    """Rough token count (about four characters per token) for backends without a tokenizer"""
+    return len(text) // 4 + 1
+
+def document_score(doc: Dict[str, Any]) -> float:
+    """Relevance of a retrieved document, higher is better, whichever retriever produced it"""
+    for key in ("rerank_score", "rrf_score", "bm25_score"):
+        if doc.get(key) is not None:
+            return float(doc[key])
+    distance = doc.get("distance")
+    return -float(distance) if distance is not None else 0.0
+
+def format_context_entry(index: int, doc: Dict[str, Any], text: str) -> str:
+    """Format one document of the context block"""
+    metadata = doc.get("metadata") or {}
+    source = metadata.get("source", f"Document {index}")
+    return f"[Document {index}] {source}:\n{text}\n"
+
+def overlap_length(first: str, second: str, min_overlap: int) -> int:
+    """
+    Length of the longest suffix of first that is also a prefix of second.
+
+    Overlaps shorter than min_overlap characters are ignored (returns 0).
+    """
+    if len(first) < min_overlap or len(second) < min_overlap:
+        return 0
+    probe = second[:min_overlap]
+    # The earliest match in first is the longest overlap
+    index = first.find(probe, max(0, len(first) - len(second)))
+    while index != -1:
+        if second.startswith(first[index:]):
+            return len(first) - index
+        index = first.find(probe, index + 1)
+    return 0
+
+class ContextPacker:
+    """
+    Assembles retrieved chunks into a context block that fits a token budget.
+
+    Chunks are taken best score first. Text already present in a selected
+    chunk (duplicates, and the overlap the splitter leaves between adjacent
+    chunks) is removed before counting, and the last chunk that fits only
+    partially is cut at a word boundary.
+    """
+
+    def __init__(self, count_tokens: Optional[Callable[[str], int]] = None):
+        self.count_tokens = count_tokens or approximate_token_count
+        self.min_overlap = int(os.environ.get("CONTEXT_MIN_OVERLAP_CHARS", "40"))
+        # Don't bother adding a chunk cut down to fewer tokens than this
+        self.min_chunk_tokens = int(os.environ.get("CONTEXT_MIN_CHUNK_TOKENS", "32"))
+
+        # Metrics
+        self.packs = 0
+        self.tokens_packed = 0
+        self.chunks_packed = 0
+        self.chunks_dropped = 0
+        self.chunks_truncated = 0
+        self.overlap_chars_removed = 0
+        logger.info(f"Context packer initialized (min_overlap={self.min_overlap} chars)")
+
+    def _remove_overlap(self, text: str, selected: List[str]) -> Optional[str]:
+        """Strip text that selected chunks already contain; None if nothing new is left"""
+        original_length = len(text)
+        for other in selected:
+            if text in other:
+                self.overlap_chars_removed += original_length
+                return None
+            # The other chunk precedes this one in the source...
+            cut = overlap_length(other, text, self.min_overlap)
+            if cut:
+                text = text[cut:]
+            # ...or follows it
+            cut = overlap_length(text, other, self.min_overlap)
+            if cut:
+                text = text[:-cut]
+
+        text = text.strip()
+        self.overlap_chars_removed += original_length - len(text)
+        return text or None
+
+    def _truncate(self, index: int, doc: Dict[str, Any], text: str, budget: int) -> Tuple[Optional[str], int]:
+        """Cut text at a word boundary so its entry fits the budget"""
+        entry = format_context_entry(index, doc, text)
+        tokens = self.count_tokens(entry)
+        length = len(text)
+        while tokens > budget:
+            length = int(length * budget / tokens * 0.9)
+            cut = text[:length].rsplit(" ", 1)[0]
+            if not cut or self.count_tokens(cut) < self.min_chunk_tokens:
+                return None, 0
+            entry = format_context_entry(index, doc, f"{cut} ...")
+            tokens = self.count_tokens(entry)
+        return entry, tokens
+
+    def pack(self, documents: List[Dict[str, Any]], budget: int) -> Tuple[str, List[Dict[str, Any]]]:
+        """
+        Pack documents into a context string.
+
+        Args:
+            documents: Retrieved documents, each with 'text' and optional 'metadata'
+            budget: Maximum number of context tokens
+
+        Returns:
+            Tuple of (context, documents included in the context, best first)
+        """
+        entries: List[str] = []
+        included: List[Dict[str, Any]] = []
+        selected_texts: List[str] = []
+        remaining = budget
+
+        for doc in sorted(documents, key=document_score, reverse=True):
+            if remaining < self.min_chunk_tokens:
+                break
+
+            text = self._remove_overlap(doc["text"], selected_texts)
+            if text is None:
+                continue
+
+            index = len(entries) + 1
+            entry = format_context_entry(index, doc, text)
+            tokens = self.count_tokens(entry)
+            if tokens > remaining:
+                entry, tokens = self._truncate(index, doc, text, remaining)
+                if entry is None:
+                    break
+                self.chunks_truncated += 1
+
+            entries.append(entry)
+            included.append(doc)
+            selected_texts.append(doc["text"])
+            remaining -= tokens
+
+        self.packs += 1
+        self.tokens_packed += budget - remaining
+        self.chunks_packed += len(included)
+        self.chunks_dropped += len(documents) - len(included)
+        return "\n".join(entries), included
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return packing metrics"""
+        return {
+            "packs": self.packs,
+            "avg_context_tokens": self.tokens_packed / self.packs if self.packs else 0.0,
+            "chunks_packed": self.chunks_packed,
+            "chunks_dropped": self.chunks_dropped,
+            "chunks_truncated": self.chunks_truncated,
+            "overlap_chars_removed": self.overlap_chars_removed,
+        }
@@ -1,7 +1,12 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Request
 from pydantic import BaseModel
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
+import os
+import json
+import base64
+import asyncio
 import logging
+import numpy as np
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -15,6 +20,9 @@ class Document(BaseModel):
 class DocumentBatch(BaseModel):
     documents: List[Document]
 
+class DocumentIds(BaseModel):
+    ids: List[str]
+
 class DocumentResponse(BaseModel):
     success: bool
     count: int
@@ -23,10 +31,14 @@ class DocumentResponse(BaseModel):
 # Router
 router = APIRouter()
 
+# Dependency to get the vector DB service from app state
+def get_vector_db_service(request: Request):
+    return getattr(request.app.state, "vector_db", None)
+
 @router.post("/documents", response_model=DocumentResponse)
 async def add_documents(
     batch: DocumentBatch,
-    vector_db=Depends(lambda: None)  # This will be injected by FastAPI from app state
+    vector_db=Depends(get_vector_db_service)
 ):
     """
     Add documents to the vector database.
@@ -52,9 +64,131 @@ async def add_documents(
         logger.error(f"Error adding documents: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Error adding documents: {str(e)}")
 
+def _parse_bulk_line(line: bytes, line_number: int) -> Tuple[Dict[str, Any], Optional[np.ndarray]]:
+    """
+    Parse one NDJSON document without building a Pydantic model.
+    
+    Each line is {"id": str, "text": str, "metadata": {...}} with an optional
+    precomputed embedding as "embedding" (list of floats) or "embedding_b64"
+    (base64 of little-endian float32 values).
+    """
+    try:
+        record = json.loads(line)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Line {line_number}: invalid JSON ({str(e)})")
+    
+    if not isinstance(record, dict) or not isinstance(record.get("id"), str) or not isinstance(record.get("text"), str):
+        raise HTTPException(status_code=400, detail=f"Line {line_number}: 'id' and 'text' must be strings")
+    metadata = record.get("metadata") or {}
+    if not isinstance(metadata, dict):
+        raise HTTPException(status_code=400, detail=f"Line {line_number}: 'metadata' must be an object")
+    
+    embedding = None
+    try:
+        if "embedding_b64" in record:
+            embedding = np.frombuffer(base64.b64decode(record["embedding_b64"], validate=True), dtype="<f4")
+        elif "embedding" in record:
+            embedding = np.asarray(record["embedding"], dtype=np.float32)
+    except (ValueError, TypeError) as e:
+        raise HTTPException(status_code=400, detail=f"Line {line_number}: invalid embedding ({str(e)})")
+    
+    return {"id": record["id"], "text": record["text"], "metadata": metadata}, embedding
+
+async def _ingest_bulk_batch(vector_db, batch: List[Tuple[Dict[str, Any], Optional[np.ndarray]]]):
+    """Add a parsed batch, embedding only the documents that came without a vector"""
+    with_vectors = [(doc, vector) for doc, vector in batch if vector is not None]
+    without_vectors = [doc for doc, vector in batch if vector is None]
+    if with_vectors:
+        dimension = vector_db.embedding_service.dimension
+        for doc, vector in with_vectors:
+            if vector.shape != (dimension,):
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Document {doc['id']}: expected an embedding of dimension {dimension}, got {vector.size}"
+                )
+        await vector_db.add_documents(
+            [doc for doc, _ in with_vectors],
+            embeddings=np.stack([vector for _, vector in with_vectors])
+        )
+    if without_vectors:
+        await vector_db.add_documents(without_vectors)
+
+@router.post("/documents/bulk", response_model=DocumentResponse)
+async def add_documents_bulk(
+    request: Request,
+    vector_db=Depends(get_vector_db_service)
+):
+    """
+    Add documents from a streamed NDJSON body (application/x-ndjson).
+    
+    Documents are written to the vector store in batches while the upload is
+    still arriving. Batches written before a malformed line stay ingested.
+    """
+    try:
+        # Get the vector DB service from app state
+        if not vector_db:
+            raise HTTPException(status_code=500, detail="Vector database not initialized")
+        
+        batch_size = int(os.environ.get("BULK_BATCH_SIZE", "256"))
+        max_in_flight = int(os.environ.get("BULK_MAX_IN_FLIGHT", "2"))
+        in_flight = set()
+        batch = []
+        count = 0
+        line_number = 0
+        buffer = b""
+        
+        async def flush(batch):
+            # Backpressure: stop reading the body while enough batches are being written
+            while len(in_flight) >= max_in_flight:
+                done, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    in_flight.discard(task)
+                    task.result()
+            in_flight.add(asyncio.ensure_future(_ingest_bulk_batch(vector_db, batch)))
+        
+        try:
+            async for chunk in request.stream():
+                buffer += chunk
+                lines = buffer.split(b"\n")
+                buffer = lines.pop()
+                for line in lines:
+                    line_number += 1
+                    if not line.strip():
+                        continue
+                    batch.append(_parse_bulk_line(line, line_number))
+                    if len(batch) >= batch_size:
+                        await flush(batch)
+                        count += len(batch)
+                        batch = []
+            
+            if buffer.strip():
+                batch.append(_parse_bulk_line(buffer, line_number + 1))
+            if batch:
+                await flush(batch)
+                count += len(batch)
+        finally:
+            # Never leave writes running past the response
+            if in_flight:
+                results = await asyncio.gather(*in_flight, return_exceptions=True)
+                errors = [result for result in results if isinstance(result, Exception)]
+                if errors:
+                    raise errors[0]
+        
+        return DocumentResponse(
+            success=True,
+            count=count,
+            message=f"Successfully added {count} documents to vector database"
+        )
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error adding documents in bulk: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Error adding documents: {str(e)}")
+
 @router.get("/documents/count")
 async def get_document_count(
-    vector_db=Depends(lambda: None)
+    vector_db=Depends(get_vector_db_service)
 ):
     """
     Get the number of documents in the vector database.
@@ -65,7 +199,7 @@ async def get_document_count(
             raise HTTPException(status_code=500, detail="Vector database not initialized")
         
         # Get count from collection
-        count = vector_db.collection.count()
+        count = await vector_db.count()
         
         return {"count": count}
         
@@ -73,9 +207,34 @@ async def get_document_count(
         logger.error(f"Error getting document count: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Error getting document count: {str(e)}")
 
+@router.post("/documents/delete", response_model=DocumentResponse)
+async def delete_documents(
+    request: DocumentIds,
+    vector_db=Depends(get_vector_db_service)
+):
+    """
+    Delete documents from the vector database by ID.
+    """
+    try:
+        # Get the vector DB service from app state
+        if not vector_db:
+            raise HTTPException(status_code=500, detail="Vector database not initialized")
+        
+        await vector_db.delete_documents(request.ids)
+        
+        return DocumentResponse(
+            success=True,
+            count=len(request.ids),
+            message=f"Successfully deleted {len(request.ids)} documents from vector database"
+        )
+        
+    except Exception as e:
+        logger.error(f"Error deleting documents: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Error deleting documents: {str(e)}")
+
 @router.delete("/documents")
 async def delete_all_documents(
-    vector_db=Depends(lambda: None)
+    vector_db=Depends(get_vector_db_service)
 ):
     """
     Delete all documents from the vector database.
@@ -86,7 +245,7 @@ async def delete_all_documents(
             raise HTTPException(status_code=500, detail="Vector database not initialized")
         
         # Delete all documents
-        vector_db.collection.delete(where={})
+        await vector_db.delete_all_documents()
         
         return {"success": True, "message": "All documents deleted"}
         
@@ -0,0 +1,155 @@
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Tuple
+import numpy as np
+from sentence_transformers import SentenceTransformer
+
+logger = logging.getLogger(__name__)
+
+class EmbeddingService:
+    """
+    Single embedding engine shared by document ingestion and querying.
+
+    Vectors are computed here in configurable batches and handed to the vector
+    store explicitly, so only one copy of the model is loaded per process.
+    """
+
+    def __init__(self, model_name: Optional[str] = None):
+        self.model_name = model_name or os.environ.get(
+            "EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2"
+        )
+        self.batch_size = int(os.environ.get("EMBEDDING_BATCH_SIZE", "64"))
+        self.normalize = os.environ.get("EMBEDDING_NORMALIZE", "true").lower() == "true"
+        self.dtype = os.environ.get("EMBEDDING_DTYPE", "float32").lower()
+        self.device = os.environ.get("EMBEDDING_DEVICE") or None
+        self.model = self._load_model()
+        self.dimension = self.model.get_sentence_embedding_dimension()
+        logger.info(
+            f"Embedding Service initialized with model: {self.model_name} "
+            f"(batch_size={self.batch_size}, dtype={self.dtype}, normalize={self.normalize})"
+        )
+
+    def _load_model(self):
+        """Load the embedding model for text embeddings"""
+        try:
+            logger.info(f"Loading embedding model: {self.model_name}")
+            model = SentenceTransformer(self.model_name, device=self.device)
+            
+            # Reduced precision trades a little accuracy for throughput and memory
+            if self.dtype in ("float16", "half"):
+                model = model.half()
+            elif self.dtype == "bfloat16":
+                import torch
+                model = model.to(dtype=torch.bfloat16)
+            
+            return model
+        except Exception as e:
+            logger.error(f"Failed to load embedding model: {str(e)}", exc_info=True)
+            raise
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """
+        Embed a list of texts. This call is blocking and should be run off the event loop.
+        
+        Args:
+            texts: Texts to embed
+            
+        Returns:
+            float32 array of shape (len(texts), dimension)
+        """
+        if not texts:
+            return np.zeros((0, self.dimension), dtype=np.float32)
+        
+        embeddings = self.model.encode(
+            texts,
+            batch_size=self.batch_size,
+            convert_to_numpy=True,
+            normalize_embeddings=self.normalize,
+            show_progress_bar=False
+        )
+        return np.asarray(embeddings, dtype=np.float32)
+
+    def __call__(self, input: List[str]) -> List[List[float]]:
+        """Chroma embedding function interface, so a collection never loads its own model"""
+        return self.embed(list(input)).tolist()
+
+class EmbeddingCache:
+    """
+    Bounded in-memory cache of normalized query text -> embedding vector.
+
+    Entries are evicted least-recently-used once max_size is reached and
+    expire after ttl_seconds. Vectors are stored as read-only float32 arrays.
+    """
+
+    def __init__(self, max_size: Optional[int] = None, ttl_seconds: Optional[float] = None):
+        self.max_size = max_size if max_size is not None else int(
+            os.environ.get("QUERY_EMBEDDING_CACHE_SIZE", "10000")
+        )
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else float(
+            os.environ.get("QUERY_EMBEDDING_CACHE_TTL", "3600")
+        )
+        self._entries: "OrderedDict[str, Tuple[float, np.ndarray]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        """Normalize query text so trivially different spellings share an entry"""
+        # The default MiniLM model is uncased, so lowercasing does not change the vector
+        return " ".join(text.lower().split())
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        """Return the cached vector for a normalized key, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            
+            expires_at, vector = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self.evictions += 1
+                self.misses += 1
+                return None
+            
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return vector
+
+    def put(self, key: str, vector: np.ndarray):
+        """Store a vector for a normalized key"""
+        if self.max_size <= 0:
+            return
+        
+        vector = np.array(vector, dtype=np.float32)
+        vector.setflags(write=False)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, vector)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """Drop all cached vectors"""
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return size and hit/miss counters"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
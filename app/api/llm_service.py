@@ -1,17 +1,84 @@
 import os
+import uuid
+import hashlib
 import logging
-from typing import Optional, Dict, Any, List
+import dataclasses
+from typing import Optional, Dict, Any, List, AsyncIterator
 import asyncio
+from transformers import AutoTokenizer
 from vllm import AsyncLLMEngine, AsyncEngineArgs, SamplingParams
 
+from app.api.metrics import observe_stage_seconds
+
 logger = logging.getLogger(__name__)
 
 class LLMService:
-    def __init__(self, engine: AsyncLLMEngine):
+    def __init__(self, engine: AsyncLLMEngine, prefix_caching: bool = False):
         self.engine = engine
         self.model_id = os.environ.get("MODEL_ID", "mistralai/Mistral-7B-v0.1")
+        self.prefix_caching = prefix_caching
+        # Same tokenizer the engine uses, for sizing prompts before they are sent
+        self.tokenizer = AutoTokenizer.from_pretrained(self.model_id, trust_remote_code=True)
+        
+        # The engine keeps the KV blocks; these count how often a request's
+        # system prompt prefix had already been sent, i.e. was reusable
+        self._seen_prefixes = set()
+        self.prefix_requests = 0
+        self.repeated_prefix_requests = 0
         logger.info(f"LLM Service initialized with model: {self.model_id}")
 
+    def _format_prompt(self, prompt: str, system_prompt: Optional[str] = None) -> str:
+        """Format prompt with system prompt if provided"""
+        if system_prompt:
+            # The system prompt goes first so every RAG request shares the same prefix
+            return f"<s>[INST] {system_prompt} [/INST]</s>[INST] {prompt} [/INST]"
+        return f"<s>[INST] {prompt} [/INST]"
+
+    def _record_prefix(self, system_prompt: str):
+        """Track how often requests repeat an already-seen prompt prefix"""
+        key = hashlib.sha256(system_prompt.encode("utf-8")).digest()
+        self.prefix_requests += 1
+        if key in self._seen_prefixes:
+            self.repeated_prefix_requests += 1
+        elif len(self._seen_prefixes) < 1024:
+            self._seen_prefixes.add(key)
+
+    @staticmethod
+    def _observe_queue_wait(result):
+        """Record how long the request waited for the scheduler, when the engine reports it"""
+        metrics = getattr(result, "metrics", None)
+        time_in_queue = getattr(metrics, "time_in_queue", None)
+        if time_in_queue is not None:
+            observe_stage_seconds("llm_queue_wait", time_in_queue)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return prefix caching metrics"""
+        return {
+            "prefix_cache": {
+                "enabled": self.prefix_caching,
+                "prefix_requests": self.prefix_requests,
+                "repeated_prefix_requests": self.repeated_prefix_requests,
+                # Share of requests whose prefix was sent before; an upper bound
+                # on engine cache hits, since blocks can be evicted meanwhile
+                "repeated_prefix_ratio": (
+                    self.repeated_prefix_requests / self.prefix_requests
+                    if self.prefix_caching and self.prefix_requests else 0.0
+                ),
+            }
+        }
+
+    def count_tokens(self, text: str) -> int:
+        """Number of tokens the model's tokenizer produces for text"""
+        return len(self.tokenizer(text, add_special_tokens=False)["input_ids"])
+
+    def _sampling_params(self, temperature: float, max_tokens: int) -> SamplingParams:
+        """Set sampling parameters"""
+        return SamplingParams(
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stop=["</s>", "[/INST]"]
+        )
+
     async def generate(
         self, 
         prompt: str, 
@@ -23,22 +90,17 @@ class LLMService:
         Generate a response from the LLM based on the input prompt.
         """
         try:
-            # Format prompt with system prompt if provided
             if system_prompt:
-                formatted_prompt = f"<s>[INST] {system_prompt} [/INST]</s>[INST] {prompt} [/INST]"
-            else:
-                formatted_prompt = f"<s>[INST] {prompt} [/INST]"
-            
-            # Set sampling parameters
-            sampling_params = SamplingParams(
-                temperature=temperature,
-                max_tokens=max_tokens,
-                stop=["</s>", "[/INST]"]
-            )
+                self._record_prefix(system_prompt)
+            formatted_prompt = self._format_prompt(prompt, system_prompt)
+            sampling_params = self._sampling_params(temperature, max_tokens)
             
-            # Generate response
+            # Generate response; the engine yields cumulative outputs, keep the last one
             logger.debug(f"Generating response for prompt: {prompt[:50]}...")
-            result = await self.engine.generate(formatted_prompt, sampling_params)
+            result = None
+            async for result in self.engine.generate(formatted_prompt, sampling_params, uuid.uuid4().hex):
+                pass
+            self._observe_queue_wait(result)
             
             # Extract and return the generated text
             if result and result.outputs:
@@ -53,6 +115,48 @@ class LLMService:
             logger.error(f"Error generating response: {str(e)}", exc_info=True)
             raise
 
+    async def generate_stream(
+        self, 
+        prompt: str, 
+        temperature: float = 0.7, 
+        max_tokens: int = 1024,
+        system_prompt: Optional[str] = None
+    ) -> AsyncIterator[str]:
+        """
+        Stream a response from the LLM as text chunks, as soon as the engine produces them.
+        """
+        if system_prompt:
+            self._record_prefix(system_prompt)
+        formatted_prompt = self._format_prompt(prompt, system_prompt)
+        sampling_params = self._sampling_params(temperature, max_tokens)
+        request_id = uuid.uuid4().hex
+        finished = False
+        
+        try:
+            logger.debug(f"Streaming response for prompt: {prompt[:50]}...")
+            previous_text = ""
+            async for result in self.engine.generate(formatted_prompt, sampling_params, request_id):
+                if not result.outputs:
+                    continue
+                
+                # Outputs are cumulative, so only emit the new suffix
+                if not previous_text:
+                    self._observe_queue_wait(result)
+                text = result.outputs[0].text
+                delta = text[len(previous_text):]
+                previous_text = text
+                if delta:
+                    yield delta
+            finished = True
+            
+        except Exception as e:
+            logger.error(f"Error streaming response: {str(e)}", exc_info=True)
+            raise
+        finally:
+            # Free the engine slot if the client went away mid-stream
+            if not finished:
+                await self.engine.abort(request_id)
+
     async def shutdown(self):
         """
         Clean up resources used by the LLM service.
@@ -69,20 +173,31 @@ async def get_llm_engine():
         logger.info(f"Initializing LLM engine with model: {model_id}")
         
         # Configure vLLM engine
-        engine_args = AsyncEngineArgs(
+        engine_kwargs = dict(
             model=model_id,
             dtype="half",  # Use half precision (float16) to reduce memory usage
             tensor_parallel_size=1,  # Adjust based on available GPUs
             gpu_memory_utilization=0.85,
-            max_model_len=8192,
+            max_model_len=int(os.environ.get("MAX_MODEL_LEN", "8192")),
             trust_remote_code=True
         )
         
+        # Reuse KV blocks of the shared system prompt across requests when the
+        # installed vLLM supports automatic prefix caching
+        prefix_caching = os.environ.get("ENABLE_PREFIX_CACHING", "true").lower() == "true"
+        if prefix_caching:
+            if "enable_prefix_caching" in {field.name for field in dataclasses.fields(AsyncEngineArgs)}:
+                engine_kwargs["enable_prefix_caching"] = True
+            else:
+                logger.warning("Installed vLLM does not support prefix caching; running without it")
+                prefix_caching = False
+        engine_args = AsyncEngineArgs(**engine_kwargs)
+        
         # Initialize the engine
         engine = AsyncLLMEngine.from_engine_args(engine_args)
-        logger.info("LLM engine initialized successfully")
+        logger.info(f"LLM engine initialized successfully (prefix caching: {prefix_caching})")
         
-        return LLMService(engine)
+        return LLMService(engine, prefix_caching=prefix_caching)
         
     except Exception as e:
         logger.error(f"Failed to initialize LLM engine: {str(e)}", exc_info=True)
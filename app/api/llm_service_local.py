@@ -1,12 +1,184 @@
 import os
 import logging
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, AsyncIterator, Tuple
 import asyncio
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import torch
-from transformers import AutoModelForCausalLM, AutoTokenizer, pipeline
+from transformers import (
+    AutoModelForCausalLM,
+    AutoTokenizer,
+    LogitsProcessor,
+    LogitsProcessorList,
+    TextStreamer,
+    pipeline,
+)
+from transformers.generation.streamers import BaseStreamer
+
+from app.api.batching import MicroBatcher
+from app.api.metrics import observe_stage_seconds
 
 logger = logging.getLogger(__name__)
 
+class AsyncTextStreamer(TextStreamer):
+    """
+    TextStreamer that hands decoded text from the generation thread to an asyncio queue.
+    A None item marks the end of the stream.
+    """
+
+    def __init__(self, tokenizer, loop: asyncio.AbstractEventLoop, **decode_kwargs):
+        super().__init__(tokenizer, skip_prompt=True, **decode_kwargs)
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.cancelled = False
+
+    def on_finalized_text(self, text: str, stream_end: bool = False):
+        if text:
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, text)
+        if stream_end:
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, None)
+
+# (formatted_prompt, prefix, temperature, max_tokens, streamer) of one generation request
+GenerationRequest = Tuple[str, Optional[str], float, int, Optional[AsyncTextStreamer]]
+
+class BatchStreamer(BaseStreamer):
+    """
+    Fans the tokens of one batched generate call out to per-row streamers
+    (None for rows nobody streams). A row's stream ends as soon as the row
+    emits EOS, not when the whole batch is done.
+    """
+
+    def __init__(self, streamers: List[Optional[AsyncTextStreamer]], eos_token_id: int):
+        self.streamers = streamers
+        self.eos_token_id = eos_token_id
+        self.finished = [streamer is None for streamer in streamers]
+        self.next_tokens_are_prompt = True
+
+    def put(self, value):
+        if self.next_tokens_are_prompt:
+            # Each row streamer skips its own prompt row
+            self.next_tokens_are_prompt = False
+            for row, streamer in enumerate(self.streamers):
+                if streamer is not None:
+                    streamer.put(value[row:row + 1])
+            return
+
+        for row, streamer in enumerate(self.streamers):
+            if self.finished[row]:
+                continue
+            if int(value[row]) == self.eos_token_id:
+                self.finished[row] = True
+                streamer.end()
+            else:
+                streamer.put(value[row:row + 1])
+
+    def end(self):
+        for row, streamer in enumerate(self.streamers):
+            if not self.finished[row]:
+                self.finished[row] = True
+                streamer.end()
+
+class BatchSamplingLogitsProcessor(LogitsProcessor):
+    """
+    Applies per-row sampling parameters inside one batched generate call.
+
+    Each row is scaled by its own temperature, and rows that have produced
+    their own max_tokens, or whose stream consumer has gone away, are forced
+    to emit EOS so they finish early instead of running to the longest
+    request in the batch.
+    """
+
+    def __init__(
+        self,
+        temperatures: List[float],
+        max_new_tokens: List[int],
+        prompt_length: int,
+        eos_token_id: int,
+        streamers: Optional[List[Optional[AsyncTextStreamer]]] = None
+    ):
+        self.temperatures = torch.tensor([max(t, 1e-5) for t in temperatures]).unsqueeze(1)
+        self.max_new_tokens = torch.tensor(max_new_tokens)
+        self.prompt_length = prompt_length
+        self.eos_token_id = eos_token_id
+        self.streamers = streamers
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        scores = scores / self.temperatures.to(device=scores.device, dtype=scores.dtype)
+        generated = input_ids.shape[1] - self.prompt_length
+        done = self.max_new_tokens <= generated
+        if self.streamers is not None:
+            done |= torch.tensor([streamer is not None and streamer.cancelled for streamer in self.streamers])
+        done = done.to(scores.device)
+        if done.any():
+            scores[done] = -float("inf")
+            scores[done, self.eos_token_id] = 0.0
+        return scores
+
+class PrefixKVCache:
+    """
+    LRU cache of key/value tensors for shared prompt prefixes.
+
+    RAG requests all start with the same system prompt wrapped in the chat
+    template, so its prefill is computed once and reused by every request
+    whose tokens start with it.
+    """
+
+    def __init__(self, max_entries: int = 4):
+        self.max_entries = max(1, max_entries)
+        self._entries: "OrderedDict[Tuple[int, ...], Any]" = OrderedDict()
+        
+        # Metrics, counted per request
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.tokens_reused = 0
+
+    def get(self, prefix_ids: Tuple[int, ...], n_requests: int, compute) -> Any:
+        """
+        Return the cached key/values for a prefix, computing them on a miss.
+        
+        Args:
+            prefix_ids: Token ids of the prefix
+            n_requests: Number of requests in the batch sharing the prefix
+            compute: Callable returning past_key_values for the prefix
+            
+        Returns:
+            The past_key_values for the prefix
+        """
+        past = self._entries.get(prefix_ids)
+        if past is not None:
+            self._entries.move_to_end(prefix_ids)
+            self.hits += n_requests
+            self.tokens_reused += n_requests * len(prefix_ids)
+            return past
+        
+        past = compute()
+        self._entries[prefix_ids] = past
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        # The first request pays for the prefill, the rest of the batch reuses it
+        self.misses += 1
+        self.hits += n_requests - 1
+        self.tokens_reused += (n_requests - 1) * len(prefix_ids)
+        return past
+
+    def clear(self):
+        """Drop all cached prefixes"""
+        self._entries.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return prefix cache hit-rate metrics"""
+        lookups = self.hits + self.misses
+        return {
+            "enabled": True,
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "prefill_tokens_reused": self.tokens_reused,
+        }
+
 class LLMService:
     def __init__(self):
         # Use a different model that doesn't require authentication
@@ -20,10 +192,31 @@ class LLMService:
         
         # Load model and tokenizer
         self.tokenizer = AutoTokenizer.from_pretrained(self.model_id)
+        # Batched prompts are left-padded so every row generates from the same position
+        self.tokenizer.padding_side = "left"
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
         
         # For local development on M3 Mac, use 8-bit quantization to reduce memory usage
         self.model = None
         self.pipe = None
+        
+        # Concurrent generate() and generate_stream() calls are queued and run as padded
+        # batches, one batch at a time
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="llm-generate")
+        self.batcher = MicroBatcher(
+            self._generate_batch,
+            max_batch_size=int(os.environ.get("LLM_BATCH_MAX_SIZE", "8")),
+            max_wait=float(os.environ.get("LLM_BATCH_WINDOW_MS", "20")) / 1000,
+            name="generation",
+            max_concurrency=1,
+            wait_observer=lambda seconds: observe_stage_seconds("llm_queue_wait", seconds)
+        )
+        
+        # Key/values of the system prompt + template prefix, reused across requests
+        self.prefix_cache = None
+        if os.environ.get("PREFIX_CACHE_ENABLED", "true").lower() == "true":
+            self.prefix_cache = PrefixKVCache(int(os.environ.get("PREFIX_CACHE_SIZE", "4")))
         logger.info(f"LLM Service initialized with model: {self.model_id}")
 
     async def _load_model_if_needed(self):
@@ -39,8 +232,42 @@ class LLMService:
                 torch_dtype=torch.float16,
                 device_map=self.device,
             )
+            self.model = self.pipe.model
             logger.info("Model loaded successfully")
 
+    def _prompt_template(self, system_prompt: Optional[str] = None) -> Tuple[str, str]:
+        """Return the text that goes before and after the user prompt"""
+        if system_prompt:
+            if "TinyLlama" in self.model_id:
+                # TinyLlama format
+                return f"<|system|>\n{system_prompt}\n<|user|>\n", "\n<|assistant|>"
+            # Llama 2 format
+            return f"<s>[INST] <<SYS>>\n{system_prompt}\n<</SYS>>\n\n", " [/INST]"
+        
+        if "TinyLlama" in self.model_id:
+            return "<|user|>\n", "\n<|assistant|>"
+        return "<s>[INST] ", " [/INST]"
+
+    def _format_prompt(self, prompt: str, system_prompt: Optional[str] = None) -> str:
+        """Format prompt with system prompt if provided"""
+        prefix, suffix = self._prompt_template(system_prompt)
+        return f"{prefix}{prompt}{suffix}"
+
+    def count_tokens(self, text: str) -> int:
+        """Number of tokens the model's tokenizer produces for text"""
+        return len(self.tokenizer(text, add_special_tokens=False)["input_ids"])
+
+    def _generation_kwargs(self, temperature: float, max_tokens: int) -> Dict[str, Any]:
+        """Sampling parameters passed to the pipeline"""
+        return {
+            "max_new_tokens": max_tokens,
+            "temperature": temperature,
+            "do_sample": True,
+            "top_p": 0.95,
+            "top_k": 50,
+            "pad_token_id": self.tokenizer.eos_token_id,
+        }
+
     async def generate(
         self, 
         prompt: str, 
@@ -55,53 +282,232 @@ class LLMService:
             # Load model if not already loaded
             await self._load_model_if_needed()
             
-            # Format prompt with system prompt if provided
-            if system_prompt:
-                if "TinyLlama" in self.model_id:
-                    # TinyLlama format
-                    formatted_prompt = f"<|system|>\n{system_prompt}\n<|user|>\n{prompt}\n<|assistant|>"
-                else:
-                    # Llama 2 format
-                    formatted_prompt = f"<s>[INST] <<SYS>>\n{system_prompt}\n<</SYS>>\n\n{prompt} [/INST]"
-            else:
-                if "TinyLlama" in self.model_id:
-                    formatted_prompt = f"<|user|>\n{prompt}\n<|assistant|>"
-                else:
-                    formatted_prompt = f"<s>[INST] {prompt} [/INST]"
+            formatted_prompt = self._format_prompt(prompt, system_prompt)
+            # Only the system prompt + template is long and shared enough to be worth caching
+            prefix = self._prompt_template(system_prompt)[0] if system_prompt else None
             
             # Generate response
             logger.debug(f"Generating response for prompt: {prompt[:50]}...")
             
-            # Run generation in a separate thread to avoid blocking the event loop
-            loop = asyncio.get_event_loop()
-            result = await loop.run_in_executor(
-                None,
-                lambda: self.pipe(
-                    formatted_prompt,
-                    max_new_tokens=max_tokens,
-                    temperature=temperature,
-                    do_sample=True,
-                    top_p=0.95,
-                    top_k=50,
-                    pad_token_id=self.tokenizer.eos_token_id
-                )
-            )
-            
-            # Extract generated text
-            if result and len(result) > 0:
-                # Extract the generated text and remove the prompt
-                generated_text = result[0]['generated_text']
-                response = generated_text[len(formatted_prompt):].strip()
-                logger.debug(f"Generated response: {response[:50]}...")
-                return response
-            else:
+            # Queue the prompt for the next batch; the batch runs in the generation thread
+            response = await self.batcher.submit((formatted_prompt, prefix, temperature, max_tokens, None))
+            if not response:
                 logger.warning("Empty response from LLM")
-                return ""
+            logger.debug(f"Generated response: {response[:50]}...")
+            return response
                 
         except Exception as e:
             logger.error(f"Error generating response: {str(e)}", exc_info=True)
             raise
 
+    async def _generate_batch(self, requests: List[GenerationRequest]) -> List[str]:
+        """Run a batch of (formatted_prompt, prefix, temperature, max_tokens, streamer) requests off the event loop"""
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.executor, self._generate_batch_sync, requests)
+
+    def _generate_batch_sync(self, requests: List[GenerationRequest]) -> List[str]:
+        """
+        Generate completions for a batch of prompts in one padded forward pass per step.
+        
+        Args:
+            requests: (formatted_prompt, prefix, temperature, max_tokens, streamer) per request;
+                the streamer, if any, receives the request's text as it is decoded
+            
+        Returns:
+            The generated text for each request, in order
+        """
+        # Requests sharing a cacheable prefix are generated together
+        groups: Dict[Optional[str], List[int]] = {}
+        for index, (_, prefix, _, _, streamer) in enumerate(requests):
+            # Streams whose client went away while queued are not generated
+            if streamer is not None and streamer.cancelled:
+                continue
+            groups.setdefault(prefix, []).append(index)
+        
+        results: List[str] = [""] * len(requests)
+        with torch.inference_mode():
+            for prefix, indices in groups.items():
+                group = [requests[i] for i in indices]
+                for index, text in zip(indices, self._generate_group(prefix, group)):
+                    results[index] = text
+        return results
+
+    def _generate_group(self, prefix: Optional[str], requests: List[GenerationRequest]) -> List[str]:
+        """Generate a group of requests, reusing the cached prefix key/values when possible"""
+        prompts = [prompt for prompt, _, _, _, _ in requests]
+        temperatures = [temperature for _, _, temperature, _, _ in requests]
+        max_new_tokens = [max_tokens for _, _, _, max_tokens, _ in requests]
+        streamers = [streamer for _, _, _, _, streamer in requests]
+        
+        if prefix is not None and self.prefix_cache is not None:
+            prefix_ids = self.tokenizer(prefix)["input_ids"]
+            prompt_ids = self.tokenizer(prompts)["input_ids"]
+            # Only valid when the prefix tokenizes the same inside the full prompt
+            if all(len(ids) > len(prefix_ids) and ids[:len(prefix_ids)] == prefix_ids for ids in prompt_ids):
+                return self._generate_with_prefix(
+                    prefix_ids,
+                    [ids[len(prefix_ids):] for ids in prompt_ids],
+                    temperatures,
+                    max_new_tokens,
+                    streamers
+                )
+            self.prefix_cache.bypassed += len(requests)
+        
+        inputs = self.tokenizer(prompts, return_tensors="pt", padding=True).to(self.model.device)
+        return self._sample(inputs["input_ids"], inputs["attention_mask"], temperatures, max_new_tokens, streamers)
+
+    def _generate_with_prefix(
+        self,
+        prefix_ids: List[int],
+        suffixes: List[List[int]],
+        temperatures: List[float],
+        max_new_tokens: List[int],
+        streamers: List[Optional[AsyncTextStreamer]]
+    ) -> List[str]:
+        """
+        Generate from a cached prefix, running prefill only on each request's own tokens.
+        
+        Suffixes are left-padded after the shared prefix; the attention mask hides
+        the padding and position ids are derived from the mask, so every row sees
+        contiguous positions.
+        """
+        device = self.model.device
+        batch_size = len(suffixes)
+        prefix_length = len(prefix_ids)
+        suffix_length = max(len(ids) for ids in suffixes)
+        
+        # Step 1: Get the prefix key/values, computing them once per prefix
+        prefix_past = self.prefix_cache.get(
+            tuple(prefix_ids),
+            batch_size,
+            lambda: self.model(
+                input_ids=torch.tensor([prefix_ids], device=device), use_cache=True
+            ).past_key_values
+        )
+        past = tuple(
+            tuple(tensor.expand(batch_size, *tensor.shape[1:]) for tensor in layer)
+            for layer in prefix_past
+        )
+        
+        # Step 2: Build [prefix | padding | suffix] rows and their attention mask
+        pad_id = self.tokenizer.pad_token_id
+        input_ids = torch.tensor(
+            [prefix_ids + [pad_id] * (suffix_length - len(ids)) + ids for ids in suffixes],
+            device=device
+        )
+        attention_mask = torch.tensor(
+            [[1] * prefix_length + [0] * (suffix_length - len(ids)) + [1] * len(ids) for ids in suffixes],
+            device=device
+        )
+        
+        # Step 3: Prefill everything but the last token; generate() feeds only the
+        # last input token when past_key_values are given
+        if suffix_length > 1:
+            position_ids = (attention_mask.cumsum(-1) - 1).clamp(min=0)
+            past = self.model(
+                input_ids=input_ids[:, prefix_length:-1],
+                attention_mask=attention_mask[:, :-1],
+                position_ids=position_ids[:, prefix_length:-1],
+                past_key_values=past,
+                use_cache=True
+            ).past_key_values
+        
+        return self._sample(input_ids, attention_mask, temperatures, max_new_tokens, streamers, past_key_values=past)
+
+    def _sample(
+        self,
+        input_ids: torch.Tensor,
+        attention_mask: torch.Tensor,
+        temperatures: List[float],
+        max_new_tokens: List[int],
+        streamers: List[Optional[AsyncTextStreamer]],
+        **model_kwargs
+    ) -> List[str]:
+        """Run generate() with per-row sampling parameters and decode the new tokens"""
+        prompt_length = input_ids.shape[1]
+        processor = BatchSamplingLogitsProcessor(
+            temperatures, max_new_tokens, prompt_length, self.tokenizer.eos_token_id, streamers
+        )
+        
+        # Temperature is applied per row by the processor, top-k/top-p by the sampler
+        kwargs = self._generation_kwargs(1.0, max(max_new_tokens))
+        kwargs["eos_token_id"] = self.tokenizer.eos_token_id
+        if any(streamer is not None for streamer in streamers):
+            kwargs["streamer"] = BatchStreamer(streamers, self.tokenizer.eos_token_id)
+        outputs = self.model.generate(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            logits_processor=LogitsProcessorList([processor]),
+            **kwargs,
+            **model_kwargs
+        )
+        
+        # Drop the (padded) prompt and decode only the new tokens of each row
+        return [
+            text.strip()
+            for text in self.tokenizer.batch_decode(outputs[:, prompt_length:], skip_special_tokens=True)
+        ]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return generation batching metrics"""
+        return {
+            "generation_batcher": self.batcher.get_stats(),
+            "prefix_cache": self.prefix_cache.get_stats() if self.prefix_cache else {"enabled": False},
+        }
+
+    async def generate_stream(
+        self, 
+        prompt: str, 
+        temperature: float = 0.7, 
+        max_tokens: int = 1024,
+        system_prompt: Optional[str] = None
+    ) -> AsyncIterator[str]:
+        """
+        Stream a response from the LLM as text chunks, as soon as they are decoded.
+        """
+        loop = asyncio.get_event_loop()
+        streamer = AsyncTextStreamer(self.tokenizer, loop, skip_special_tokens=True)
+        
+        try:
+            # Load model if not already loaded
+            await self._load_model_if_needed()
+            
+            formatted_prompt = self._format_prompt(prompt, system_prompt)
+            prefix = self._prompt_template(system_prompt)[0] if system_prompt else None
+            
+            # The request is batched with concurrent ones like generate(); the batch
+            # pushes this request's text through the streamer as it is decoded
+            logger.debug(f"Streaming response for prompt: {prompt[:50]}...")
+            generation = asyncio.ensure_future(
+                self.batcher.submit((formatted_prompt, prefix, temperature, max_tokens, streamer))
+            )
+            
+            def on_generation_done(future: asyncio.Future):
+                # Make sure the stream terminates even if generation fails early, and
+                # retrieve errors of batches that outlive an already finished stream
+                streamer.queue.put_nowait(None)
+                if not future.cancelled():
+                    future.exception()
+            
+            generation.add_done_callback(on_generation_done)
+            
+            while True:
+                text = await streamer.queue.get()
+                if text is None:
+                    break
+                yield text
+            
+            # Surface generation errors; a stream that ended does not wait for the rest of its batch
+            if generation.done():
+                generation.result()
+            
+        except Exception as e:
+            logger.error(f"Error streaming response: {str(e)}", exc_info=True)
+            raise
+        finally:
+            # Stop the worker thread if the client went away mid-stream
+            streamer.cancelled = True
+
     async def shutdown(self):
         """
         Clean up resources used by the LLM service.
@@ -112,6 +518,9 @@ class LLMService:
             del self.model
         if self.pipe is not None:
             del self.pipe
+        if self.prefix_cache is not None:
+            self.prefix_cache.clear()
+        self.executor.shutdown(wait=False)
         torch.cuda.empty_cache() if torch.cuda.is_available() else None
 
 async def get_llm_engine():
@@ -0,0 +1,211 @@
+import os
+import re
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import List, Dict, Any, Optional, Iterator, Tuple, AsyncIterator
+
+from app.api.context_packing import approximate_token_count
+from app.api.llm_service_simple import RESPONSES
+from app.api.metrics import observe_stage_seconds
+
+logger = logging.getLogger(__name__)
+
+FALLBACK_RESPONSE = (
+    "I don't have specific information about that, but I can help with information "
+    "about LLMs, RAG, or Kubernetes. Please ask me about these topics."
+)
+
+class AhoCorasick:
+    """
+    Multi-pattern substring matcher.
+
+    Finds every occurrence of every pattern in a single pass over the text,
+    however many patterns there are, instead of one scan per pattern.
+    """
+
+    def __init__(self, patterns: List[str]):
+        self.patterns = patterns
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[List[int]] = [[]]
+
+        for index, pattern in enumerate(patterns):
+            node = 0
+            for char in pattern:
+                if char not in self._goto[node]:
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append([])
+                    self._goto[node][char] = len(self._goto) - 1
+                node = self._goto[node][char]
+            self._output[node].append(index)
+
+        # Breadth-first, so the failure target of every node is already final
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fallback = self._fail[node]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[child] = self._goto[fallback].get(char, 0)
+                self._output[child] = self._output[child] + self._output[self._fail[child]]
+
+    def find_all(self, text: str) -> Iterator[Tuple[int, int]]:
+        """Yield (end position, pattern index) for every match"""
+        node = 0
+        for position, char in enumerate(text):
+            while node and char not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(char, 0)
+            for index in self._output[node]:
+                yield position, index
+
+    def first_pattern(self, text: str) -> Optional[int]:
+        """Index of the earliest-listed pattern that occurs in text, if any"""
+        best = None
+        for _, index in self.find_all(text):
+            if best is None or index < best:
+                best = index
+                if best == 0:
+                    break
+        return best
+
+class SimulatedLLMService:
+    """
+    Simulated LLM backend following a latency model of a batched GPU server.
+
+    A request waits for one of a fixed number of batch slots, then pays a
+    prefill cost proportional to its prompt tokens and streams its answer at
+    a per-token decode rate that slows down as more sequences share the
+    batch. Answers come from the canned responses of the Simple LLM service.
+    """
+
+    def __init__(self):
+        self.slots = int(os.environ.get("SIM_BATCH_SLOTS", "8"))
+        self.prefill_ms_per_token = float(os.environ.get("SIM_PREFILL_MS_PER_TOKEN", "0.2"))
+        self.decode_tokens_per_second = float(os.environ.get("SIM_DECODE_TOKENS_PER_SECOND", "40"))
+        # Relative decode slowdown for each additional sequence in the batch
+        self.batch_slowdown = float(os.environ.get("SIM_BATCH_SLOWDOWN", "0.05"))
+        # Tokens per answer (canned answers are repeated to reach it); the answer's own length when unset
+        output_tokens = os.environ.get("SIM_OUTPUT_TOKENS")
+        self.output_tokens = int(output_tokens) if output_tokens else None
+
+        self.patterns = list(RESPONSES)
+        self.matcher = AhoCorasick(self.patterns)
+        self._slots = asyncio.Semaphore(self.slots)
+        self._active = 0
+        self._queued = 0
+        self.started = 0
+        self.completed = 0
+        self.prompt_tokens = 0
+        self.generated_tokens = 0
+        self.queue_wait_seconds = 0.0
+        logger.info(
+            f"Simulated LLM service initialized (slots={self.slots}, "
+            f"prefill={self.prefill_ms_per_token}ms/token, decode={self.decode_tokens_per_second} tokens/s)"
+        )
+
+    def count_tokens(self, text: str) -> int:
+        return approximate_token_count(text)
+
+    def _match_response(self, prompt: str) -> str:
+        """Return the pre-defined answer for a prompt, or a generic response"""
+        index = self.matcher.first_pattern(prompt.lower())
+        return RESPONSES[self.patterns[index]] if index is not None else FALLBACK_RESPONSE
+
+    def _answer_tokens(self, prompt: str, max_tokens: int) -> List[str]:
+        """The streamed pieces of the answer, one word per token"""
+        words = re.findall(r"\S+\s*", self._match_response(prompt))
+        length = min(self.output_tokens or len(words), max_tokens)
+        return [words[i % len(words)] for i in range(length)]
+
+    def _step_seconds(self) -> float:
+        """Time of one decode step at the current batch size"""
+        return (1 + self.batch_slowdown * max(self._active - 1, 0)) / self.decode_tokens_per_second
+
+    async def generate_stream(
+        self,
+        prompt: str,
+        temperature: float = 0.7,
+        max_tokens: int = 1024,
+        system_prompt: Optional[str] = None
+    ) -> AsyncIterator[str]:
+        """Stream the answer on the simulated timeline"""
+        full_prompt = f"{system_prompt}\n{prompt}" if system_prompt else prompt
+        tokens = self._answer_tokens(prompt, max_tokens)
+
+        # Step 1: Wait for a batch slot
+        start = time.perf_counter()
+        self._queued += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self._queued -= 1
+        wait = time.perf_counter() - start
+        self.started += 1
+        self.queue_wait_seconds += wait
+        observe_stage_seconds("llm_queue_wait", wait)
+
+        self._active += 1
+        try:
+            # Step 2: Prefill the prompt
+            prompt_tokens = self.count_tokens(full_prompt)
+            self.prompt_tokens += prompt_tokens
+            await asyncio.sleep(prompt_tokens * self.prefill_ms_per_token / 1000)
+
+            # Step 3: Decode, scheduled on an absolute timeline so sleeps do not drift
+            deadline = time.perf_counter()
+            for i, token in enumerate(tokens):
+                deadline += self._step_seconds()
+                await asyncio.sleep(max(deadline - time.perf_counter(), 0))
+                self.generated_tokens += 1
+                yield token if i < len(tokens) - 1 else token.rstrip()
+            self.completed += 1
+        finally:
+            self._active -= 1
+            self._slots.release()
+
+    async def generate(
+        self,
+        prompt: str,
+        temperature: float = 0.7,
+        max_tokens: int = 1024,
+        system_prompt: Optional[str] = None
+    ) -> str:
+        """Generate the full answer on the simulated timeline"""
+        chunks = []
+        async for chunk in self.generate_stream(prompt, temperature, max_tokens, system_prompt):
+            chunks.append(chunk)
+        return "".join(chunks)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return batch slot and throughput metrics"""
+        return {
+            "generation_queue": {
+                "slots": self.slots,
+                "active": self._active,
+                "pending": self._queued,
+                "avg_wait": self.queue_wait_seconds / self.started if self.started else 0.0,
+            },
+            "completed": self.completed,
+            "prompt_tokens": self.prompt_tokens,
+            "generated_tokens": self.generated_tokens,
+        }
+
+    async def shutdown(self):
+        """Clean up resources."""
+        logger.info("Shutting down Simulated LLM service")
+
+async def get_llm_engine():
+    """Initialize and return the Simulated LLM engine."""
+    try:
+        logger.info("Initializing Simulated LLM engine")
+        return SimulatedLLMService()
+
+    except Exception as e:
+        logger.error(f"Failed to initialize Simulated LLM engine: {str(e)}", exc_info=True)
+        raise
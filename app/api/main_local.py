@@ -1,16 +1,31 @@
 import os
-from typing import List, Dict, Any, Optional
-from fastapi import FastAPI, HTTPException, Depends
+from typing import List, Dict, Any, Optional, Tuple
+from fastapi import FastAPI, HTTPException, Depends, Response
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 import uvicorn
 import logging
 from contextlib import asynccontextmanager
 
-from app.api.llm_service_simple import get_llm_engine
+# LLM_BACKEND=simulated follows a latency model of a batched GPU server, for capacity tests
+if os.environ.get("LLM_BACKEND", "simple").lower() == "simulated":
+    from app.api.llm_service_simulated import get_llm_engine
+else:
+    from app.api.llm_service_simple import get_llm_engine
 from app.api.vector_db import get_vector_db
 from app.api.rag_pipeline import RAGPipeline
+from app.api.reranker import get_reranker
 from app.api.documents import router as documents_router
+from app.api.streaming import direct_llm_events, ndjson_events, NDJSON_MEDIA_TYPE
+from app.api.sessions import SessionStore, record_streamed_turn
+from app.api.metrics import router as metrics_router, MetricsMiddleware, InstrumentedLLMService
+from app.api.admission import AdmissionMiddleware, create_admission_lanes
+from app.api.singleflight import SingleFlight
+from app.api.profiling import router as profiling_router
+from app.api.timing import (
+    SERVER_TIMING_ENABLED, current_timing, timed_events, timed_request, timed_step
+)
 
 # Configure logging
 logging.basicConfig(
@@ -29,23 +44,31 @@ class ChatRequest(BaseModel):
     use_rag: bool = True
     temperature: float = 0.7
     max_tokens: int = 1024
+    # With a session id the server keeps the history, so only new messages need to be sent
+    session_id: Optional[str] = None
+    # Return per-step durations (ms) in the response and a Server-Timing header
+    include_timing: bool = False
 
 class ChatResponse(BaseModel):
     response: str
     retrieved_documents: Optional[List[Dict[str, Any]]] = None
-
-# Dependency to get vector DB from app state
-async def get_vector_db_dependency():
-    return app.state.vector_db
+    session_id: Optional[str] = None
+    timing: Optional[Dict[str, float]] = None
 
 # Startup and shutdown events
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup: Load the LLM model and vector DB
     logger.info("Starting up the application...")
-    app.state.llm_engine = await get_llm_engine()
+    app.state.llm_engine = InstrumentedLLMService(await get_llm_engine())
     app.state.vector_db = await get_vector_db()
-    app.state.rag_pipeline = RAGPipeline(app.state.llm_engine, app.state.vector_db)
+    app.state.reranker = await get_reranker()
+    app.state.rag_pipeline = RAGPipeline(
+        app.state.llm_engine, app.state.vector_db, reranker=app.state.reranker
+    )
+    app.state.sessions = SessionStore()
+    app.state.singleflight = SingleFlight()
+    app.state.admission = create_admission_lanes(chat_max_concurrency=32)
     logger.info("Application startup complete")
     
     yield
@@ -56,6 +79,10 @@ async def lifespan(app: FastAPI):
         await app.state.llm_engine.shutdown()
     if hasattr(app.state, "vector_db"):
         await app.state.vector_db.shutdown()
+    if getattr(app.state, "reranker", None) is not None:
+        app.state.reranker.shutdown()
+    if hasattr(app.state, "rag_pipeline"):
+        app.state.rag_pipeline.shutdown()
     logger.info("Application shutdown complete")
 
 # Create FastAPI app
@@ -66,6 +93,10 @@ app = FastAPI(
     lifespan=lifespan,
 )
 
+# Shed chat and ingestion requests the backends cannot serve in time
+# (added before CORS, so shed responses still carry the CORS headers)
+app.add_middleware(AdmissionMiddleware)
+
 # Add CORS middleware to allow cross-origin requests from the frontend
 app.add_middleware(
     CORSMiddleware,
@@ -76,17 +107,68 @@ app.add_middleware(
     expose_headers=["*"]  # Expose all headers
 )
 
+# Track in-flight requests and latency per route (added last, so shed requests are counted)
+app.add_middleware(MetricsMiddleware)
+
 # Include routers
 app.include_router(documents_router, tags=["documents"])
+app.include_router(metrics_router, tags=["metrics"])
+app.include_router(profiling_router, tags=["admin"])
 
 # Health check endpoint
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy", "environment": "local"}
+    return {
+        "status": "healthy",
+        "environment": "local",
+        "vector_db": app.state.vector_db.get_stats(),
+        "response_cache": app.state.rag_pipeline.response_cache.get_stats(),
+        "context_packing": app.state.rag_pipeline.context_packer.get_stats(),
+        "sessions": app.state.sessions.get_stats(),
+        "singleflight": app.state.singleflight.get_stats(),
+        "admission": {lane: controller.get_stats() for lane, controller in app.state.admission.items()},
+        "reranker": app.state.reranker.get_stats() if app.state.reranker else {"enabled": False},
+        "llm": app.state.llm_engine.get_stats() if hasattr(app.state.llm_engine, "get_stats") else {}
+    }
+
+def _conversation(request: ChatRequest) -> Tuple[List[Dict[str, str]], List[Dict[str, str]]]:
+    """
+    Split a chat request into (earlier turns, messages of this request).
+    
+    Earlier turns are the session's stored history followed by anything the
+    request sent before its last user message.
+    """
+    messages = [{"role": msg.role.lower(), "content": msg.content} for msg in request.messages]
+    last_user = max(i for i, message in enumerate(messages) if message["role"] == "user")
+    history = app.state.sessions.get_history(request.session_id) if request.session_id else []
+    return history + messages[:last_user], messages
+
+def _record_turn(request: ChatRequest, new_messages: List[Dict[str, str]], response: str):
+    """Store the request's messages and the answer in its session, if it has one"""
+    if request.session_id:
+        app.state.sessions.append(
+            request.session_id, new_messages + [{"role": "assistant", "content": response}]
+        )
+
+def _flight_key(request: ChatRequest, mode: str, user_message: str, history: List[Dict[str, str]]):
+    """Key under which identical in-flight requests share one computation"""
+    return app.state.singleflight.key(
+        mode, user_message, request.temperature, request.max_tokens, history,
+        app.state.vector_db.corpus_version
+    )
+
+def _timing(request: ChatRequest, http_response: Response) -> Optional[Dict[str, float]]:
+    """Set the Server-Timing header and return the timing block, when enabled"""
+    timing = current_timing()
+    if timing is None or not (request.include_timing or SERVER_TIMING_ENABLED):
+        return None
+    http_response.headers["Server-Timing"] = timing.server_timing_header()
+    return timing.as_dict() if request.include_timing else None
 
 # Chat endpoint
 @app.post("/chat", response_model=ChatResponse)
-async def chat(request: ChatRequest):
+@timed_request
+async def chat(request: ChatRequest, http_response: Response):
     try:
         logger.info(f"Received chat request with {len(request.messages)} messages")
         
@@ -100,37 +182,112 @@ async def chat(request: ChatRequest):
         if not user_message:
             raise HTTPException(status_code=400, detail="No user message found")
         
+        history, new_messages = _conversation(request)
+        
         # Log the user message for debugging
         logger.info(f"Processing user message: {user_message}")
         
         # Process with RAG pipeline
         if request.use_rag:
-            response, retrieved_docs = await app.state.rag_pipeline.generate_response(
-                user_message, 
-                request.temperature,
-                request.max_tokens
+            response, retrieved_docs = await app.state.singleflight.do(
+                _flight_key(request, "rag", user_message, history),
+                lambda: app.state.rag_pipeline.generate_response(
+                    user_message, 
+                    request.temperature,
+                    request.max_tokens,
+                    history=history
+                )
             )
             logger.info(f"Generated RAG response: {response[:50]}...")
+            _record_turn(request, new_messages, response)
             return ChatResponse(
                 response=response,
-                retrieved_documents=retrieved_docs
+                retrieved_documents=retrieved_docs,
+                session_id=request.session_id,
+                timing=_timing(request, http_response)
             )
         else:
             # Direct LLM response without RAG
-            response = await app.state.llm_engine.generate(
-                user_message,
-                temperature=request.temperature,
-                max_tokens=request.max_tokens
+            async def generate():
+                with timed_step("generation"):
+                    return await app.state.llm_engine.generate(
+                        app.state.rag_pipeline.direct_prompt(user_message, history),
+                        temperature=request.temperature,
+                        max_tokens=request.max_tokens
+                    )
+            response = await app.state.singleflight.do(
+                _flight_key(request, "direct", user_message, history), generate
             )
             logger.info(f"Generated direct response: {response[:50]}...")
-            return ChatResponse(response=response)
+            _record_turn(request, new_messages, response)
+            return ChatResponse(
+                response=response,
+                session_id=request.session_id,
+                timing=_timing(request, http_response)
+            )
             
     except Exception as e:
         logger.error(f"Error processing chat request: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Error processing request: {str(e)}")
 
-# Override the dependency in the documents router
-app.dependency_overrides[lambda: None] = get_vector_db_dependency
+# Streaming chat endpoint
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """
+    Stream the chat response as newline-delimited JSON events: retrieved
+    documents first, then text chunks as they are generated. With
+    include_timing the done event carries the per-step timing block.
+    """
+    logger.info(f"Received streaming chat request with {len(request.messages)} messages")
+    
+    if not request.messages:
+        raise HTTPException(status_code=400, detail="No messages provided")
+    
+    # Get the last user message
+    user_message = next((msg.content for msg in reversed(request.messages) 
+                        if msg.role.lower() == "user"), None)
+    
+    if not user_message:
+        raise HTTPException(status_code=400, detail="No user message found")
+    
+    history, new_messages = _conversation(request)
+    
+    # Log the user message for debugging
+    logger.info(f"Processing user message: {user_message}")
+    
+    # Process with RAG pipeline
+    if request.use_rag:
+        events = lambda: app.state.rag_pipeline.generate_response_stream(
+            user_message,
+            request.temperature,
+            request.max_tokens,
+            history=history
+        )
+    else:
+        # Direct LLM response without RAG
+        events = lambda: direct_llm_events(
+            app.state.llm_engine,
+            app.state.rag_pipeline.direct_prompt(user_message, history),
+            temperature=request.temperature,
+            max_tokens=request.max_tokens
+        )
+    # Identical in-flight streams share one token stream
+    events = app.state.singleflight.stream(
+        _flight_key(request, "rag" if request.use_rag else "direct", user_message, history), events
+    )
+    
+    if request.session_id:
+        events = record_streamed_turn(events, app.state.sessions, request.session_id, new_messages)
+    events = timed_events(events, request.include_timing)
+    
+    return StreamingResponse(ndjson_events(events), media_type=NDJSON_MEDIA_TYPE)
+
+# Forget a conversation
+@app.delete("/sessions/{session_id}")
+async def delete_session(session_id: str):
+    if not app.state.sessions.delete(session_id):
+        raise HTTPException(status_code=404, detail="Session not found")
+    return {"success": True, "session_id": session_id}
 
 if __name__ == "__main__":
     uvicorn.run("app.api.main_local:app", host="0.0.0.0", port=8000, reload=True) 
\ No newline at end of file
@@ -0,0 +1,187 @@
+import time
+import logging
+from contextlib import contextmanager
+from typing import Dict, Any, Optional, AsyncIterator
+from fastapi import APIRouter, Request, Response
+from prometheus_client import Counter, Gauge, Histogram, generate_latest, CONTENT_TYPE_LATEST
+from starlette.routing import Match
+
+from app.api.context_packing import approximate_token_count
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0
+)
+
+STAGE_SECONDS = Histogram(
+    "rag_stage_duration_seconds",
+    "Time spent in each stage of a chat request",
+    ["stage"],
+    buckets=LATENCY_BUCKETS
+)
+TOKENS_PER_SECOND = Histogram(
+    "rag_llm_tokens_per_second",
+    "Generated tokens per second of each LLM call",
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+)
+GENERATED_TOKENS = Counter("rag_llm_generated_tokens_total", "Tokens generated by the LLM")
+REQUESTS_IN_FLIGHT = Gauge("rag_http_requests_in_flight", "HTTP requests being served", ["endpoint"])
+REQUEST_SECONDS = Histogram(
+    "rag_http_request_duration_seconds",
+    "HTTP request latency, until the last byte of the response",
+    ["endpoint", "method", "status"],
+    buckets=LATENCY_BUCKETS
+)
+DOCUMENT_COUNT = Gauge("rag_vector_db_documents", "Documents in the vector database")
+CACHE_HIT_RATIO = Gauge("rag_cache_hit_ratio", "Hit ratio since startup", ["cache"])
+CACHE_ENTRIES = Gauge("rag_cache_entries", "Entries held by the cache", ["cache"])
+BATCHER_PENDING = Gauge("rag_batcher_pending", "Items waiting for the next batch", ["batcher"])
+ADMISSION_ACTIVE = Gauge("rag_admission_active", "Requests holding an admission slot", ["lane"])
+ADMISSION_QUEUED = Gauge("rag_admission_queued", "Requests waiting for an admission slot", ["lane"])
+ADMISSION_REJECTED = Counter(
+    "rag_admission_rejected_total", "Requests shed by admission control", ["lane", "reason"]
+)
+SINGLEFLIGHT_REQUESTS = Counter(
+    "rag_singleflight_requests_total",
+    "Coalescable chat requests; followers shared a leader's computation",
+    ["mode", "role"]
+)
+
+def observe_stage_seconds(stage: str, seconds: float, count: int = 1):
+    """Record a stage duration, once per request that waited on it"""
+    histogram = STAGE_SECONDS.labels(stage)
+    for _ in range(count):
+        histogram.observe(seconds)
+
+@contextmanager
+def observe_stage(stage: str, count: int = 1):
+    """Time the enclosed block as one stage of a chat request"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage_seconds(stage, time.perf_counter() - start, count)
+
+class InstrumentedLLMService:
+    """
+    Wraps an LLM service to record generation time, time to first token and
+    throughput. Everything else is passed through to the wrapped service.
+    """
+
+    def __init__(self, service):
+        self._service = service
+        self._count_tokens = getattr(service, "count_tokens", None) or approximate_token_count
+
+    def __getattr__(self, name: str):
+        return getattr(self._service, name)
+
+    def _observe(self, start: float, text: str):
+        seconds = time.perf_counter() - start
+        tokens = self._count_tokens(text) if text else 0
+        observe_stage_seconds("generation", seconds)
+        GENERATED_TOKENS.inc(tokens)
+        if seconds > 0 and tokens:
+            TOKENS_PER_SECOND.observe(tokens / seconds)
+
+    async def generate(self, prompt: str, *args, **kwargs) -> str:
+        start = time.perf_counter()
+        response = await self._service.generate(prompt, *args, **kwargs)
+        self._observe(start, response)
+        return response
+
+    async def generate_stream(self, prompt: str, *args, **kwargs) -> AsyncIterator[str]:
+        start = time.perf_counter()
+        chunks = []
+        async for chunk in self._service.generate_stream(prompt, *args, **kwargs):
+            if not chunks:
+                observe_stage_seconds("time_to_first_token", time.perf_counter() - start)
+            chunks.append(chunk)
+            yield chunk
+        self._observe(start, "".join(chunks))
+
+class MetricsMiddleware:
+    """ASGI middleware tracking in-flight requests and latency per route"""
+
+    def __init__(self, app):
+        self.app = app
+
+    @staticmethod
+    def _endpoint(scope) -> str:
+        # Route templates keep label cardinality bounded (/sessions/{session_id})
+        for route in scope["app"].routes:
+            match, child_scope = route.matches(scope)
+            if match == Match.FULL:
+                path = scope["path"]
+                for name, value in child_scope.get("path_params", {}).items():
+                    path = path.replace(str(value), "{" + name + "}")
+                return path
+        return "other"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        endpoint = self._endpoint(scope)
+        status = {"code": 500}
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        REQUESTS_IN_FLIGHT.labels(endpoint).inc()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            REQUESTS_IN_FLIGHT.labels(endpoint).dec()
+            REQUEST_SECONDS.labels(endpoint, scope["method"], str(status["code"])).observe(
+                time.perf_counter() - start
+            )
+
+def _set_cache(name: str, stats: Optional[Dict[str, Any]], entries_key: str):
+    if not stats:
+        return
+    CACHE_HIT_RATIO.labels(name).set(stats.get("hit_ratio", stats.get("hit_rate", 0.0)))
+    if entries_key in stats:
+        CACHE_ENTRIES.labels(name).set(stats[entries_key])
+
+async def _update_gauges(state):
+    """Refresh the gauges that mirror service stats"""
+    DOCUMENT_COUNT.set(await state.vector_db.count())
+
+    vector_db_stats = state.vector_db.get_stats()
+    _set_cache("query_embedding", vector_db_stats["query_cache"], "size")
+    BATCHER_PENDING.labels("retrieval").set(vector_db_stats["retrieval_batcher"]["pending"])
+    _set_cache("response", state.rag_pipeline.response_cache.get_stats(), "size")
+    _set_cache("sessions", state.sessions.get_stats(), "sessions")
+    if state.reranker is not None:
+        _set_cache("rerank", state.reranker.get_stats(), "cache_size")
+
+    llm_stats = state.llm_engine.get_stats() if hasattr(state.llm_engine, "get_stats") else {}
+    prefix_cache = llm_stats.get("prefix_cache", {})
+    # Only caches that observe their own hits report a hit rate
+    if prefix_cache.get("enabled") and "hit_rate" in prefix_cache:
+        _set_cache("llm_prefix", prefix_cache, "entries")
+    generation_queue = llm_stats.get("generation_batcher") or llm_stats.get("generation_queue")
+    if generation_queue:
+        BATCHER_PENDING.labels("generation").set(generation_queue["pending"])
+
+    for lane, controller in getattr(state, "admission", {}).items():
+        stats = controller.get_stats()
+        ADMISSION_ACTIVE.labels(lane).set(stats["active"])
+        ADMISSION_QUEUED.labels(lane).set(stats["queued"])
+
+@router.get("/metrics")
+async def metrics(request: Request):
+    """Prometheus metrics in the text exposition format"""
+    try:
+        await _update_gauges(request.app.state)
+    except Exception as e:
+        # Still serve the histograms if a stats source is unavailable
+        logger.error(f"Error updating metrics gauges: {str(e)}", exc_info=True)
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,133 @@
+import os
+import sys
+import hmac
+import time
+import asyncio
+import logging
+import threading
+from collections import Counter
+from typing import Dict, Optional
+from fastapi import APIRouter, HTTPException, Header
+from fastapi.responses import PlainTextResponse
+
+from app.api.timing import add_completion_listener, remove_completion_listener
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+# The admin endpoints are disabled unless a token is configured
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+PROFILE_MAX_SECONDS = float(os.environ.get("PROFILE_MAX_SECONDS", "300"))
+
+def _frame_label(code) -> str:
+    """Function-level frame name, e.g. 'generate_response (app/api/rag_pipeline.py:58)'"""
+    filename = code.co_filename
+    if "site-packages/" in filename:
+        filename = filename.rsplit("site-packages/", 1)[1]
+    elif "/app/" in filename:
+        filename = "app/" + filename.rsplit("/app/", 1)[1]
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})"
+
+class SamplingProfiler:
+    """
+    Statistical profiler sampling the Python stacks of every thread.
+
+    A background thread walks sys._current_frames() at a fixed interval and
+    counts identical stacks, which are reported in the collapsed format
+    (``thread;outer;...;inner count``) read by flamegraph.pl and speedscope.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.samples = 0
+        self._stacks: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _sample(self):
+        own_id = threading.get_ident()
+        names: Dict[int, str] = {}
+        while not self._stop.is_set():
+            frames = sys._current_frames()
+            if len(names) != len(frames):
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in frames.items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame.f_code))
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)).replace(";", ":"))
+                self._stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+            self._stop.wait(self.interval)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._sample, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> str:
+        """Stop sampling and return the collapsed stacks"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        return "\n".join(f"{stack} {count}" for stack, count in self._stacks.most_common()) + "\n"
+
+_profile_lock = asyncio.Lock()
+
+@router.post("/admin/profile", response_class=PlainTextResponse)
+async def profile(
+    seconds: Optional[float] = None,
+    requests: Optional[int] = None,
+    interval_ms: float = 5.0,
+    x_admin_token: Optional[str] = Header(None)
+):
+    """
+    Profile the running server and return a flamegraph-compatible profile.
+
+    Samples for the given number of seconds, or until the given number of
+    chat requests have completed (default 10 seconds, capped at
+    PROFILE_MAX_SECONDS either way). Requires the X-Admin-Token header.
+    """
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not hmac.compare_digest((x_admin_token or "").encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+    if _profile_lock.locked():
+        raise HTTPException(status_code=409, detail="A profile is already running")
+
+    async with _profile_lock:
+        limit = min(seconds if seconds is not None else (PROFILE_MAX_SECONDS if requests else 10.0), PROFILE_MAX_SECONDS)
+        profiler = SamplingProfiler(max(interval_ms, 1.0) / 1000)
+        completed = {"count": 0}
+        done = asyncio.Event()
+
+        def on_request_completed(_):
+            completed["count"] += 1
+            if requests is not None and completed["count"] >= requests:
+                done.set()
+
+        logger.info(f"Starting sampling profile (seconds={limit}, requests={requests}, interval={interval_ms}ms)")
+        start = time.perf_counter()
+        add_completion_listener(on_request_completed)
+        profiler.start()
+        try:
+            await asyncio.wait_for(done.wait(), timeout=limit)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            remove_completion_listener(on_request_completed)
+            collapsed = await asyncio.get_event_loop().run_in_executor(None, profiler.stop)
+
+        duration = time.perf_counter() - start
+        logger.info(f"Sampling profile finished: {profiler.samples} samples, {completed['count']} requests")
+        return PlainTextResponse(
+            collapsed,
+            headers={
+                "X-Profile-Samples": str(profiler.samples),
+                "X-Profile-Requests": str(completed["count"]),
+                "X-Profile-Seconds": f"{duration:.3f}",
+            }
+        )
@@ -1,13 +1,82 @@
+import os
 import logging
-from typing import List, Dict, Any, Tuple, Optional
+from typing import List, Dict, Any, Tuple, Optional, AsyncIterator
 import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from app.api.response_cache import SemanticResponseCache
+from app.api.context_packing import ContextPacker, approximate_token_count
+from app.api.sessions import format_history
+from app.api.reranker import Reranker
+from app.api.metrics import observe_stage
+from app.api.timing import timed_step, current_timing
 
 logger = logging.getLogger(__name__)
 
+def reciprocal_rank_fusion(
+    rankings: List[List[Dict[str, Any]]],
+    n_results: int,
+    k: int = 60
+) -> List[Dict[str, Any]]:
+    """
+    Fuse ranked document lists with reciprocal rank fusion.
+    
+    Args:
+        rankings: Ranked document lists, each document with an 'id'
+        n_results: Number of fused documents to return
+        k: RRF damping constant
+        
+    Returns:
+        Documents ordered by fused score, with the score under 'rrf_score'
+    """
+    scores: Dict[str, float] = {}
+    merged: Dict[str, Dict[str, Any]] = {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking):
+            scores[doc["id"]] = scores.get(doc["id"], 0.0) + 1.0 / (k + rank + 1)
+            # Keep every field, e.g. the dense distance and the BM25 score
+            merged.setdefault(doc["id"], {}).update(doc)
+    
+    fused = sorted(scores, key=scores.get, reverse=True)[:n_results]
+    return [{**merged[doc_id], "rrf_score": scores[doc_id]} for doc_id in fused]
+
+RAG_SYSTEM_PROMPT = "You are a helpful assistant. Use the provided context to answer the question. If the context doesn't contain relevant information, say so and answer based on your knowledge."
+
+# Allowance for the chat template wrapped around the system prompt and user prompt
+PROMPT_TEMPLATE_TOKENS = 32
+
 class RAGPipeline:
-    def __init__(self, llm_service, vector_db_service):
+    def __init__(
+        self,
+        llm_service,
+        vector_db_service,
+        response_cache: Optional[SemanticResponseCache] = None,
+        reranker: Optional[Reranker] = None
+    ):
         self.llm_service = llm_service
         self.vector_db_service = vector_db_service
+        self.response_cache = response_cache or SemanticResponseCache()
+        # With a reranker, retrieval fetches this many candidates and the reranker keeps n_results
+        self.reranker = reranker
+        self.rerank_candidates = int(os.environ.get("RERANK_CANDIDATES", "20"))
+        # Each retriever contributes this many candidates per requested document to the fusion
+        self.hybrid_candidates = int(os.environ.get("HYBRID_CANDIDATE_FACTOR", "3"))
+        
+        # Context is packed into a token budget measured with the serving model's tokenizer
+        self.count_tokens = getattr(llm_service, "count_tokens", None) or approximate_token_count
+        self.context_packer = ContextPacker(self.count_tokens)
+        # Packing tokenizes every candidate chunk; with a real tokenizer that runs on
+        # its own thread instead of blocking the event loop
+        self.packing_executor = (
+            ThreadPoolExecutor(max_workers=1, thread_name_prefix="context-packing")
+            if hasattr(llm_service, "count_tokens") else None
+        )
+        self.context_token_budget = int(os.environ.get("CONTEXT_TOKEN_BUDGET", "3072"))
+        self.max_model_len = int(os.environ.get("MAX_MODEL_LEN", "8192"))
+        
+        # Conversation history included in prompts, and earlier user turns added to the retrieval query
+        self.history_token_budget = int(os.environ.get("HISTORY_TOKEN_BUDGET", "512"))
+        self.history_query_turns = int(os.environ.get("HISTORY_QUERY_TURNS", "1"))
         logger.info("RAG Pipeline initialized")
 
     async def generate_response(
@@ -15,7 +84,8 @@ class RAGPipeline:
         query: str, 
         temperature: float = 0.7,
         max_tokens: int = 1024,
-        n_results: int = 3
+        n_results: int = 3,
+        history: Optional[List[Dict[str, str]]] = None
     ) -> Tuple[str, List[Dict[str, Any]]]:
         """
         Generate a response using the RAG pipeline.
@@ -25,63 +95,240 @@ class RAGPipeline:
             temperature: Temperature for LLM generation
             max_tokens: Maximum tokens to generate
             n_results: Number of documents to retrieve
+            history: Earlier {"role", "content"} messages of the conversation, oldest first
             
         Returns:
             Tuple of (generated_response, retrieved_documents)
         """
         try:
-            # Step 1: Retrieve relevant documents
+            # Step 0: Serve near-identical low-temperature questions from the answer cache
+            query_embedding = None
+            cache_params = (max_tokens, n_results)
+            corpus_version = self.vector_db_service.corpus_version
+            # Follow-up turns depend on the conversation, so only standalone questions are cached
+            if not history and self.response_cache.is_cacheable(temperature):
+                with timed_step("cache_lookup"):
+                    query_embedding = await self.vector_db_service.embed_query(query)
+                    cached = self.response_cache.lookup(query_embedding, cache_params, corpus_version)
+                if cached is not None:
+                    logger.info(f"Serving cached RAG response for query: {query[:50]}...")
+                    return cached
+            
+            # Step 1: Retrieve relevant documents and pack them into the context budget
             logger.info(f"Retrieving documents for query: {query[:50]}...")
-            documents = await self.vector_db_service.query(query, n_results=n_results)
+            history_text = self._format_history(history)
+            documents = await self._retrieve(self._retrieval_query(query, history), n_results)
+            context, documents = await self._build_context(query, documents, max_tokens, history_text)
             
             if not documents:
                 logger.warning("No documents retrieved, falling back to direct LLM response")
-                response = await self.llm_service.generate(
-                    query, 
-                    temperature=temperature,
-                    max_tokens=max_tokens
-                )
+                with timed_step("generation"):
+                    response = await self.llm_service.generate(
+                        self._create_chat_prompt(query, history_text), 
+                        temperature=temperature,
+                        max_tokens=max_tokens
+                    )
+                if query_embedding is not None:
+                    self.response_cache.store(query_embedding, cache_params, corpus_version, response, [])
                 return response, []
             
-            # Step 2: Format the prompt with retrieved context
-            context = self._format_context(documents)
+            # Step 2: Format the prompt with the packed context
+            prompt = self._create_rag_prompt(query, context, history_text)
             
-            # Step 3: Generate response with context-enhanced prompt
-            prompt = self._create_rag_prompt(query, context)
-            
-            # Step 4: Generate the final response
-            response = await self.llm_service.generate(
-                prompt,
-                temperature=temperature,
-                max_tokens=max_tokens,
-                system_prompt="You are a helpful assistant. Use the provided context to answer the question. If the context doesn't contain relevant information, say so and answer based on your knowledge."
-            )
+            # Step 3: Generate the final response
+            with timed_step("generation"):
+                response = await self.llm_service.generate(
+                    prompt,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    system_prompt=RAG_SYSTEM_PROMPT
+                )
             
             logger.info(f"Generated RAG response for query: {query[:50]}...")
+            if query_embedding is not None:
+                self.response_cache.store(query_embedding, cache_params, corpus_version, response, documents)
             return response, documents
             
         except Exception as e:
             logger.error(f"Error in RAG pipeline: {str(e)}", exc_info=True)
             raise
 
-    def _format_context(self, documents: List[Dict[str, Any]]) -> str:
-        """Format retrieved documents into context string"""
-        context_parts = []
+    async def generate_response_stream(
+        self, 
+        query: str, 
+        temperature: float = 0.7,
+        max_tokens: int = 1024,
+        n_results: int = 3,
+        history: Optional[List[Dict[str, str]]] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Generate a response using the RAG pipeline, streaming it as events.
         
-        for i, doc in enumerate(documents):
-            # Extract document text and metadata
-            text = doc["text"]
-            metadata = doc.get("metadata", {})
-            source = metadata.get("source", f"Document {i+1}")
-            
-            # Format document with source
-            context_parts.append(f"[Document {i+1}] {source}:\n{text}\n")
+        The first event carries the retrieved documents, followed by one
+        event per generated text chunk and a final done event:
+            {"type": "documents", "documents": [...]}
+            {"type": "token", "content": "..."}
+            {"type": "done"}
+        
+        Args:
+            query: The user query
+            temperature: Temperature for LLM generation
+            max_tokens: Maximum tokens to generate
+            n_results: Number of documents to retrieve
+            history: Earlier {"role", "content"} messages of the conversation, oldest first
+        """
+        # Step 0: Serve near-identical low-temperature questions from the answer cache
+        query_embedding = None
+        cache_params = (max_tokens, n_results)
+        corpus_version = self.vector_db_service.corpus_version
+        # Follow-up turns depend on the conversation, so only standalone questions are cached
+        if not history and self.response_cache.is_cacheable(temperature):
+            with timed_step("cache_lookup"):
+                query_embedding = await self.vector_db_service.embed_query(query)
+                cached = self.response_cache.lookup(query_embedding, cache_params, corpus_version)
+            if cached is not None:
+                logger.info(f"Serving cached RAG response for query: {query[:50]}...")
+                response, documents = cached
+                yield {"type": "documents", "documents": documents}
+                yield {"type": "token", "content": response}
+                yield {"type": "done"}
+                return
+        
+        # Step 1: Retrieve relevant documents, pack them and send the ones used up front
+        logger.info(f"Retrieving documents for query: {query[:50]}...")
+        history_text = self._format_history(history)
+        documents = await self._retrieve(self._retrieval_query(query, history), n_results)
+        context, documents = await self._build_context(query, documents, max_tokens, history_text)
+        yield {"type": "documents", "documents": documents}
+        
+        # Step 2: Build the prompt, with retrieved context if there is any
+        if documents:
+            prompt = self._create_rag_prompt(query, context, history_text)
+            system_prompt = RAG_SYSTEM_PROMPT
+        else:
+            logger.warning("No documents retrieved, falling back to direct LLM response")
+            prompt = self._create_chat_prompt(query, history_text)
+            system_prompt = None
+        
+        # Step 3: Stream the response
+        chunks = []
+        timing = current_timing()
+        with timed_step("generation"):
+            async for chunk in self.llm_service.generate_stream(
+                prompt,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                system_prompt=system_prompt
+            ):
+                if not chunks and timing is not None:
+                    timing.mark("time_to_first_token")
+                chunks.append(chunk)
+                yield {"type": "token", "content": chunk}
         
-        return "\n".join(context_parts)
+        logger.info(f"Streamed RAG response for query: {query[:50]}...")
+        if query_embedding is not None:
+            response = "".join(chunks).strip()
+            self.response_cache.store(query_embedding, cache_params, corpus_version, response, documents)
+        yield {"type": "done"}
 
-    def _create_rag_prompt(self, query: str, context: str) -> str:
-        """Create a prompt that includes the retrieved context"""
+    async def _retrieve(self, query: str, n_results: int) -> List[Dict[str, Any]]:
+        """Retrieve documents, reranking a wider candidate set when a reranker is configured"""
+        if self.reranker is None:
+            with timed_step("retrieval"):
+                return await self._retrieve_candidates(query, n_results)
+        
+        with timed_step("retrieval"):
+            candidates = await self._retrieve_candidates(query, max(n_results, self.rerank_candidates))
+        with timed_step("rerank"):
+            return await self.reranker.rerank(query, candidates, n_results)
+
+    async def _retrieve_candidates(self, query: str, n_results: int) -> List[Dict[str, Any]]:
+        """Retrieve documents, fusing dense and BM25 rankings when hybrid retrieval is enabled"""
+        if self.vector_db_service.lexical_index is None:
+            return await self.vector_db_service.query(query, n_results=n_results)
+        
+        n_candidates = n_results * self.hybrid_candidates
+        dense, lexical = await asyncio.gather(
+            self.vector_db_service.query(query, n_results=n_candidates),
+            self.vector_db_service.lexical_query(query, n_results=n_candidates)
+        )
+        return reciprocal_rank_fusion([dense, lexical], n_results)
+
+    def _retrieval_query(self, query: str, history: Optional[List[Dict[str, str]]]) -> str:
+        """Add the previous user turns so follow-ups like "and the second one?" retrieve on topic"""
+        if not history or self.history_query_turns <= 0:
+            return query
+        previous = [message["content"] for message in history if message["role"] == "user"]
+        return "\n".join(previous[-self.history_query_turns:] + [query])
+
+    def _format_history(self, history: Optional[List[Dict[str, str]]]) -> str:
+        """Render the conversation so far within the history token budget"""
+        if not history:
+            return ""
+        return format_history(history, self.count_tokens, self.history_token_budget)
+
+    def _context_budget(self, query: str, max_tokens: int, history: str = "") -> int:
+        """Tokens left for context once the prompt scaffolding and the answer are reserved"""
+        overhead = (
+            self.count_tokens(RAG_SYSTEM_PROMPT)
+            + self.count_tokens(self._create_rag_prompt(query, "", history))
+            + PROMPT_TEMPLATE_TOKENS
+        )
+        return max(0, min(self.context_token_budget, self.max_model_len - max_tokens - overhead))
+
+    def _pack_context(
+        self,
+        query: str,
+        documents: List[Dict[str, Any]],
+        max_tokens: int,
+        history: str
+    ) -> Tuple[str, List[Dict[str, Any]]]:
+        return self.context_packer.pack(documents, self._context_budget(query, max_tokens, history))
+
+    async def _build_context(
+        self,
+        query: str,
+        documents: List[Dict[str, Any]],
+        max_tokens: int,
+        history: str = ""
+    ) -> Tuple[str, List[Dict[str, Any]]]:
+        """Pack retrieved documents into the context budget; returns (context, documents used)"""
+        if not documents:
+            return "", []
+        with observe_stage("prompt_build"), timed_step("prompt_build"):
+            if self.packing_executor is None:
+                return self._pack_context(query, documents, max_tokens, history)
+            loop = asyncio.get_event_loop()
+            return await loop.run_in_executor(
+                self.packing_executor, self._pack_context, query, documents, max_tokens, history
+            )
+
+    def shutdown(self):
+        """Stop the context packing thread"""
+        if self.packing_executor is not None:
+            self.packing_executor.shutdown(wait=False)
+
+    def direct_prompt(self, query: str, history: Optional[List[Dict[str, str]]] = None) -> str:
+        """Prompt for answering without retrieval, with the conversation so far"""
+        return self._create_chat_prompt(query, self._format_history(history))
+
+    def _create_chat_prompt(self, query: str, history: str = "") -> str:
+        """Create a prompt for a direct LLM answer, with the conversation so far if there is any"""
+        if not history:
+            return query
         return f"""
+Conversation so far:
+{history}
+
+User: {query}
+"""
+
+    def _create_rag_prompt(self, query: str, context: str, history: str = "") -> str:
+        """Create a prompt that includes the retrieved context"""
+        # The history goes right after the system prompt, so consecutive turns of a
+        # session share the longest possible prompt prefix
+        conversation = f"\nConversation so far:\n{history}\n" if history else ""
+        return f"""{conversation}
 Context information:
 {context}
 
@@ -0,0 +1,159 @@
+import os
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Tuple
+import asyncio
+import numpy as np
+from sentence_transformers import CrossEncoder
+
+from app.api.batching import MicroBatcher
+from app.api.embeddings import EmbeddingCache
+from app.api.metrics import observe_stage
+
+logger = logging.getLogger(__name__)
+
+class Reranker:
+    """
+    Cross-encoder reranking of retrieved candidates.
+
+    Each (query, document) pair is scored jointly by a small cross-encoder.
+    Pairs from concurrent requests are coalesced into one batched forward
+    pass, and scores are cached per (query, document) so repeated questions
+    only score documents they have not seen.
+    """
+
+    def __init__(self, model_name: Optional[str] = None):
+        self.model_name = model_name or os.environ.get(
+            "RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2"
+        )
+        self.batch_size = int(os.environ.get("RERANK_BATCH_SIZE", "32"))
+        self.device = os.environ.get("RERANK_DEVICE") or None
+        self.model = self._load_model()
+
+        self.cache_size = int(os.environ.get("RERANK_CACHE_SIZE", "50000"))
+        self._scores: "OrderedDict[Tuple[str, str, int], float]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        # One model, one thread; concurrency comes from batching requests together
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="reranker")
+        self.batcher = MicroBatcher(
+            self._score_batch,
+            max_batch_size=int(os.environ.get("RERANK_BATCH_MAX_REQUESTS", "16")),
+            max_wait=float(os.environ.get("RERANK_BATCH_WINDOW_MS", "5")) / 1000,
+            name="rerank",
+            max_concurrency=1
+        )
+        logger.info(f"Reranker initialized with model: {self.model_name} (batch_size={self.batch_size})")
+
+    def _load_model(self):
+        """Load the cross-encoder model"""
+        try:
+            logger.info(f"Loading reranking model: {self.model_name}")
+            return CrossEncoder(self.model_name, device=self.device)
+        except Exception as e:
+            logger.error(f"Failed to load reranking model: {str(e)}", exc_info=True)
+            raise
+
+    @staticmethod
+    def _cache_key(query: str, doc: Dict[str, Any]) -> Tuple[str, str, int]:
+        # The text hash guards against an id being reused for different content
+        return EmbeddingCache.normalize(query), doc["id"], hash(doc["text"])
+
+    def _predict(self, pairs: List[Tuple[str, str]]) -> np.ndarray:
+        """Score (query, text) pairs. This call is blocking and should be run off the event loop."""
+        return np.asarray(
+            self.model.predict(pairs, batch_size=self.batch_size, show_progress_bar=False),
+            dtype=np.float32
+        )
+
+    async def _score_batch(self, requests: List[Tuple[str, List[Dict[str, Any]]]]) -> List[List[float]]:
+        """Score the uncached pairs of several requests in one model call"""
+        results: List[List[Optional[float]]] = []
+        missing: List[Tuple[int, int, Tuple[str, str, int]]] = []
+        pairs: List[Tuple[str, str]] = []
+
+        with self._lock:
+            for request_index, (query, documents) in enumerate(requests):
+                scores = []
+                for doc_index, doc in enumerate(documents):
+                    key = self._cache_key(query, doc)
+                    score = self._scores.get(key)
+                    if score is None:
+                        self.misses += 1
+                        missing.append((request_index, doc_index, key))
+                        pairs.append((query, doc["text"]))
+                    else:
+                        self.hits += 1
+                        self._scores.move_to_end(key)
+                    scores.append(score)
+                results.append(scores)
+
+        if pairs:
+            loop = asyncio.get_event_loop()
+            predicted = await loop.run_in_executor(self.executor, self._predict, pairs)
+            with self._lock:
+                for (request_index, doc_index, key), score in zip(missing, predicted.tolist()):
+                    results[request_index][doc_index] = score
+                    self._scores[key] = score
+                while len(self._scores) > self.cache_size:
+                    self._scores.popitem(last=False)
+
+        return results
+
+    async def rerank(self, query: str, documents: List[Dict[str, Any]], top_k: int) -> List[Dict[str, Any]]:
+        """
+        Reorder documents by cross-encoder relevance to the query.
+
+        Args:
+            query: The user query
+            documents: Candidate documents, each with 'id' and 'text'
+            top_k: Number of documents to keep
+
+        Returns:
+            The top_k documents, best first, with the score under 'rerank_score'
+        """
+        if not documents:
+            return []
+
+        try:
+            with observe_stage("rerank"):
+                scores = await self.batcher.submit((query, documents))
+            # Stable sort, so ties keep the retrieval order
+            ranked = sorted(range(len(documents)), key=lambda index: scores[index], reverse=True)[:top_k]
+            return [{**documents[index], "rerank_score": scores[index]} for index in ranked]
+        except Exception as e:
+            logger.error(f"Error reranking documents: {str(e)}", exc_info=True)
+            raise
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return score cache and batching metrics"""
+        lookups = self.hits + self.misses
+        return {
+            "cache_size": len(self._scores),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "batcher": self.batcher.get_stats(),
+        }
+
+    def shutdown(self):
+        """Stop the scoring thread"""
+        self.executor.shutdown(wait=False)
+
+async def get_reranker() -> Optional[Reranker]:
+    """
+    Initialize the reranker if reranking is enabled.
+    """
+    if os.environ.get("RERANK_ENABLED", "false").lower() != "true":
+        return None
+    try:
+        logger.info("Initializing reranker")
+        return Reranker()
+
+    except Exception as e:
+        logger.error(f"Failed to initialize reranker: {str(e)}", exc_info=True)
+        raise
@@ -0,0 +1,176 @@
+import os
+import time
+import logging
+import threading
+from typing import List, Dict, Any, Optional, Tuple, Hashable
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+class SemanticResponseCache:
+    """
+    Cache of generated answers keyed on query embedding similarity.
+
+    A lookup hits when a stored query's embedding has cosine similarity of at
+    least similarity_threshold with the new query and was generated with the
+    same parameters. Only low-temperature requests are served or stored, and
+    the whole cache is dropped when a newer corpus version is seen; requests
+    still carrying an older version neither hit nor store.
+    """
+
+    def __init__(
+        self,
+        similarity_threshold: Optional[float] = None,
+        max_temperature: Optional[float] = None,
+        max_size: Optional[int] = None,
+        ttl_seconds: Optional[float] = None
+    ):
+        self.enabled = os.environ.get("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+        self.similarity_threshold = similarity_threshold if similarity_threshold is not None else float(
+            os.environ.get("RESPONSE_CACHE_THRESHOLD", "0.95")
+        )
+        self.max_temperature = max_temperature if max_temperature is not None else float(
+            os.environ.get("RESPONSE_CACHE_MAX_TEMPERATURE", "0.3")
+        )
+        self.max_size = max_size if max_size is not None else int(
+            os.environ.get("RESPONSE_CACHE_SIZE", "1000")
+        )
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else float(
+            os.environ.get("RESPONSE_CACHE_TTL", "3600")
+        )
+        
+        # Row i of the matrix belongs to entry i
+        self._matrix: Optional[np.ndarray] = None
+        self._entries: List[Dict[str, Any]] = []
+        self._corpus_version = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        logger.info(
+            f"Semantic response cache initialized (enabled={self.enabled}, "
+            f"threshold={self.similarity_threshold}, max_temperature={self.max_temperature})"
+        )
+
+    def is_cacheable(self, temperature: float) -> bool:
+        """Whether a request with this temperature may be served from or stored in the cache"""
+        return self.enabled and self.max_size > 0 and temperature <= self.max_temperature
+
+    @staticmethod
+    def _normalize(embedding: np.ndarray) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def _check_version(self, corpus_version: int) -> bool:
+        """
+        Drop every entry if the corpus changed since they were stored.
+        
+        Returns:
+            False if corpus_version is older than the cached entries, i.e. the
+            request started before a corpus update another request has seen
+        """
+        if self._corpus_version is not None and corpus_version < self._corpus_version:
+            return False
+        if corpus_version != self._corpus_version:
+            if self._entries:
+                self.invalidations += 1
+                logger.info(f"Corpus version changed to {corpus_version}, clearing response cache")
+            self._entries = []
+            self._matrix = None
+            self._corpus_version = corpus_version
+        return True
+
+    def _remove(self, rows: List[int]):
+        removed = set(rows)
+        keep = [i for i in range(len(self._entries)) if i not in removed]
+        self._entries = [self._entries[i] for i in keep]
+        self._matrix = self._matrix[keep] if keep else None
+
+    def lookup(
+        self,
+        embedding: np.ndarray,
+        params: Hashable,
+        corpus_version: int
+    ) -> Optional[Tuple[str, List[Dict[str, Any]]]]:
+        """
+        Find a cached answer for a semantically equivalent query.
+        
+        Args:
+            embedding: Query embedding
+            params: Generation parameters that must match exactly
+            corpus_version: Current version of the document corpus
+            
+        Returns:
+            Tuple of (response, retrieved_documents), or None on a miss
+        """
+        with self._lock:
+            if not self._check_version(corpus_version) or self._matrix is None:
+                self.misses += 1
+                return None
+            
+            now = time.monotonic()
+            expired = [i for i, entry in enumerate(self._entries) if entry["expires_at"] < now]
+            if expired:
+                self._remove(expired)
+                if self._matrix is None:
+                    self.misses += 1
+                    return None
+            
+            scores = self._matrix @ self._normalize(embedding)
+            for row in np.argsort(-scores):
+                if scores[row] < self.similarity_threshold:
+                    break
+                entry = self._entries[row]
+                if entry["params"] == params:
+                    self.hits += 1
+                    return entry["response"], list(entry["documents"])
+            
+            self.misses += 1
+            return None
+
+    def store(
+        self,
+        embedding: np.ndarray,
+        params: Hashable,
+        corpus_version: int,
+        response: str,
+        documents: List[Dict[str, Any]]
+    ):
+        """Store a generated answer for later semantically equivalent queries"""
+        with self._lock:
+            # An answer generated against an older corpus must not be served
+            if not self._check_version(corpus_version):
+                return
+            vector = self._normalize(embedding)[np.newaxis, :]
+            self._matrix = vector if self._matrix is None else np.vstack([self._matrix, vector])
+            self._entries.append({
+                "params": params,
+                "response": response,
+                "documents": list(documents),
+                "expires_at": time.monotonic() + self.ttl_seconds,
+            })
+            
+            # Entries are kept in insertion order, so the oldest are evicted first
+            if len(self._entries) > self.max_size:
+                self._remove(list(range(len(self._entries) - self.max_size)))
+
+    def invalidate(self):
+        """Drop all cached answers"""
+        with self._lock:
+            self._entries = []
+            self._matrix = None
+            self.invalidations += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return size and hit/miss counters"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,148 @@
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Any, Callable, Optional, AsyncIterator
+
+logger = logging.getLogger(__name__)
+
+class SessionStore:
+    """
+    In-memory conversation history keyed by session id.
+
+    Memory is bounded by the number of sessions (least recently used ones are
+    evicted first), the number of messages kept per session, and a TTL after
+    the last turn.
+
+    Sessions live in a single pod, so with several replicas a client's turns
+    must reach the same pod (the llm-service Service uses ClientIP session
+    affinity). A session is lost when its pod restarts or is scaled away;
+    clients that need to survive that should send the full history instead
+    of only a session_id.
+    """
+
+    def __init__(
+        self,
+        max_sessions: Optional[int] = None,
+        ttl_seconds: Optional[float] = None,
+        max_messages: Optional[int] = None
+    ):
+        self.max_sessions = max_sessions if max_sessions is not None else int(
+            os.environ.get("SESSION_MAX_COUNT", "10000")
+        )
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else float(
+            os.environ.get("SESSION_TTL", "1800")
+        )
+        self.max_messages = max_messages if max_messages is not None else int(
+            os.environ.get("SESSION_MAX_MESSAGES", "20")
+        )
+
+        # session_id -> (last update time, messages)
+        self._sessions: "OrderedDict[str, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        logger.info(
+            f"Session store initialized (max_sessions={self.max_sessions}, "
+            f"ttl={self.ttl_seconds}s, max_messages={self.max_messages})"
+        )
+
+    def get_history(self, session_id: str) -> List[Dict[str, str]]:
+        """
+        Return the stored messages of a session, oldest first.
+
+        Args:
+            session_id: The session id
+
+        Returns:
+            List of {"role", "content"} messages; empty for unknown or expired sessions
+        """
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                self.misses += 1
+                return []
+            updated_at, messages = entry
+            if time.monotonic() - updated_at > self.ttl_seconds:
+                del self._sessions[session_id]
+                self.expirations += 1
+                self.misses += 1
+                return []
+            self._sessions.move_to_end(session_id)
+            self.hits += 1
+            return list(messages)
+
+    def append(self, session_id: str, messages: List[Dict[str, str]]):
+        """Add messages to a session, creating it if needed"""
+        with self._lock:
+            entry = self._sessions.pop(session_id, None)
+            history = entry[1] if entry is not None else []
+            history = (history + messages)[-self.max_messages:]
+            self._sessions[session_id] = (time.monotonic(), history)
+
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, session_id: str) -> bool:
+        """Forget a session; returns whether it existed"""
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return session store metrics"""
+        lookups = self.hits + self.misses
+        return {
+            "sessions": len(self._sessions),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+def format_history(
+    history: List[Dict[str, str]],
+    count_tokens: Callable[[str], int],
+    max_tokens: int
+) -> str:
+    """
+    Render the most recent turns that fit in max_tokens, oldest first.
+
+    Args:
+        history: Earlier {"role", "content"} messages, oldest first
+        count_tokens: Token counter of the serving model
+        max_tokens: Token budget for the rendered history
+
+    Returns:
+        One "User: ..." / "Assistant: ..." line per turn
+    """
+    lines: List[str] = []
+    used = 0
+    for message in reversed(history):
+        role = "Assistant" if message["role"] == "assistant" else "User"
+        line = f"{role}: {message['content']}"
+        tokens = count_tokens(line)
+        if used + tokens > max_tokens:
+            break
+        lines.append(line)
+        used += tokens
+    return "\n".join(reversed(lines))
+
+async def record_streamed_turn(
+    events: AsyncIterator[Dict[str, Any]],
+    sessions: SessionStore,
+    session_id: str,
+    messages: List[Dict[str, str]]
+) -> AsyncIterator[Dict[str, Any]]:
+    """Pass stream events through and store the turn once the answer is complete"""
+    chunks = []
+    async for event in events:
+        if event["type"] == "token":
+            chunks.append(event["content"])
+        elif event["type"] == "done":
+            sessions.append(session_id, messages + [{"role": "assistant", "content": "".join(chunks).strip()}])
+        yield event
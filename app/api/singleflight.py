@@ -0,0 +1,191 @@
+import os
+import asyncio
+import logging
+from contextlib import nullcontext
+from typing import List, Dict, Any, Callable, Awaitable, Optional, Hashable, AsyncIterator
+
+from app.api.metrics import SINGLEFLIGHT_REQUESTS
+from app.api.timing import timed_step
+
+logger = logging.getLogger(__name__)
+
+def _forget(registry: Dict[Hashable, Any], key: Hashable, entry: Any):
+    # A newer entry may already be registered under the same key
+    if registry.get(key) is entry:
+        del registry[key]
+
+class _Flight:
+    """One shared computation and the requests waiting on it"""
+
+    def __init__(self, task: asyncio.Future):
+        self.task = task
+        self.waiters = 0
+
+class _Broadcast:
+    """
+    One shared event stream. Events are kept until the stream ends, so a
+    request joining late replays what it missed before following live.
+    """
+
+    def __init__(self):
+        self.events: List[Dict[str, Any]] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.task: Optional[asyncio.Future] = None
+        self._changed = asyncio.Event()
+
+    def _notify(self):
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def pump(self, events: AsyncIterator[Dict[str, Any]]):
+        try:
+            async for event in events:
+                self.events.append(event)
+                self._notify()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            self._notify()
+
+    async def subscribe(self) -> AsyncIterator[Dict[str, Any]]:
+        index = 0
+        while True:
+            while index < len(self.events):
+                yield self.events[index]
+                index += 1
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            await self._changed.wait()
+
+class SingleFlight:
+    """
+    Coalesces identical in-flight chat requests into one computation.
+
+    Requests with the same key (question, history, mode and generation
+    parameters) that arrive while the first one is still being answered wait
+    for its result instead of running retrieval and generation again; for
+    streams, every request receives the same events. Only deterministic
+    (low-temperature) requests are coalesced, since sampled answers are
+    expected to differ.
+    """
+
+    def __init__(self, max_temperature: Optional[float] = None):
+        self.enabled = os.environ.get("SINGLEFLIGHT_ENABLED", "true").lower() == "true"
+        self.max_temperature = max_temperature if max_temperature is not None else float(
+            os.environ.get("SINGLEFLIGHT_MAX_TEMPERATURE", "0")
+        )
+        self._flights: Dict[Hashable, _Flight] = {}
+        self._streams: Dict[Hashable, _Broadcast] = {}
+        self.executions = 0
+        self.coalesced = 0
+        self.stream_executions = 0
+        self.coalesced_streams = 0
+        logger.info(f"Single-flight coalescing initialized (enabled={self.enabled}, max_temperature={self.max_temperature})")
+
+    def key(
+        self,
+        mode: str,
+        query: str,
+        temperature: float,
+        max_tokens: int,
+        history: List[Dict[str, str]],
+        corpus_version: int
+    ) -> Optional[Hashable]:
+        """Coalescing key of a request, or None if it must run on its own"""
+        if not self.enabled or temperature > self.max_temperature:
+            return None
+        return (
+            mode,
+            query.strip(),
+            temperature,
+            max_tokens,
+            tuple((message["role"], message["content"]) for message in history),
+            corpus_version,
+        )
+
+    async def do(self, key: Optional[Hashable], compute: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Return the result of compute(), shared with identical in-flight requests.
+
+        The computation runs in its own task, so a request that goes away
+        does not cancel it for the others; it is cancelled once nobody waits.
+        """
+        if key is None:
+            return await compute()
+
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = _Flight(asyncio.ensure_future(compute()))
+            self._flights[key] = flight
+            flight.task.add_done_callback(lambda _: _forget(self._flights, key, flight))
+            self.executions += 1
+            SINGLEFLIGHT_REQUESTS.labels("response", "leader").inc()
+            wait_step = nullcontext()
+        else:
+            self.coalesced += 1
+            SINGLEFLIGHT_REQUESTS.labels("response", "follower").inc()
+            wait_step = timed_step("singleflight_wait")
+
+        flight.waiters += 1
+        try:
+            with wait_step:
+                return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                _forget(self._flights, key, flight)
+                flight.task.cancel()
+
+    async def stream(
+        self,
+        key: Optional[Hashable],
+        events: Callable[[], AsyncIterator[Dict[str, Any]]]
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Yield the events of events(), shared with identical in-flight streams"""
+        if key is None:
+            async for event in events():
+                yield event
+            return
+
+        broadcast = self._streams.get(key)
+        if broadcast is None:
+            broadcast = _Broadcast()
+            broadcast.task = asyncio.ensure_future(broadcast.pump(events()))
+            self._streams[key] = broadcast
+            broadcast.task.add_done_callback(lambda _: _forget(self._streams, key, broadcast))
+            self.stream_executions += 1
+            SINGLEFLIGHT_REQUESTS.labels("stream", "leader").inc()
+        else:
+            self.coalesced_streams += 1
+            SINGLEFLIGHT_REQUESTS.labels("stream", "follower").inc()
+
+        broadcast.subscribers += 1
+        try:
+            async for event in broadcast.subscribe():
+                yield event
+        finally:
+            broadcast.subscribers -= 1
+            if broadcast.subscribers == 0 and not broadcast.task.done():
+                _forget(self._streams, key, broadcast)
+                broadcast.task.cancel()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return how much work coalescing saved"""
+        requests = self.executions + self.coalesced
+        streams = self.stream_executions + self.coalesced_streams
+        return {
+            "enabled": self.enabled,
+            "max_temperature": self.max_temperature,
+            "in_flight": len(self._flights) + len(self._streams),
+            "executions": self.executions,
+            "coalesced": self.coalesced,
+            "coalesced_ratio": self.coalesced / requests if requests else 0.0,
+            "stream_executions": self.stream_executions,
+            "coalesced_streams": self.coalesced_streams,
+            "coalesced_stream_ratio": self.coalesced_streams / streams if streams else 0.0,
+        }
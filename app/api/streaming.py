@@ -0,0 +1,40 @@
+import json
+import logging
+from typing import Dict, Any, AsyncIterator
+
+logger = logging.getLogger(__name__)
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+async def direct_llm_events(
+    llm_service,
+    prompt: str,
+    temperature: float = 0.7,
+    max_tokens: int = 1024
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Stream a direct LLM response (without RAG) as chat events.
+    Uses the same event shapes as RAGPipeline.generate_response_stream.
+    """
+    yield {"type": "documents", "documents": []}
+    async for chunk in llm_service.generate_stream(
+        prompt,
+        temperature=temperature,
+        max_tokens=max_tokens
+    ):
+        yield {"type": "token", "content": chunk}
+    yield {"type": "done"}
+
+async def ndjson_events(events: AsyncIterator[Dict[str, Any]]) -> AsyncIterator[str]:
+    """
+    Serialize chat events as newline-delimited JSON.
+    
+    Headers are already sent once streaming starts, so errors are reported
+    as a final {"type": "error"} event instead of an HTTP status.
+    """
+    try:
+        async for event in events:
+            yield json.dumps(event) + "\n"
+    except Exception as e:
+        logger.error(f"Error streaming chat response: {str(e)}", exc_info=True)
+        yield json.dumps({"type": "error", "detail": f"Error processing request: {str(e)}"}) + "\n"
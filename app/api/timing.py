@@ -0,0 +1,108 @@
+import os
+import time
+import logging
+import functools
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import List, Dict, Any, Callable, Optional, AsyncIterator
+
+logger = logging.getLogger(__name__)
+
+# Send the Server-Timing header on every chat response, not only when a request asks for timing
+SERVER_TIMING_ENABLED = os.environ.get("SERVER_TIMING_ENABLED", "false").lower() == "true"
+
+class RequestTiming:
+    """Wall-clock duration of each step of one chat request"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        self.steps: Dict[str, float] = {}
+
+    def add(self, step: str, seconds: float):
+        """Add time spent in a step (repeated steps accumulate)"""
+        self.steps[step] = self.steps.get(step, 0.0) + seconds
+
+    def mark(self, step: str):
+        """Record the time elapsed since the request started, e.g. for the first token"""
+        self.steps.setdefault(step, time.perf_counter() - self.start)
+
+    def total(self) -> float:
+        return (self.end or time.perf_counter()) - self.start
+
+    def as_dict(self) -> Dict[str, float]:
+        """Step durations and the total so far, in milliseconds"""
+        timings = {step: round(seconds * 1000, 3) for step, seconds in self.steps.items()}
+        timings["total"] = round(self.total() * 1000, 3)
+        return timings
+
+    def server_timing_header(self) -> str:
+        """Format the timings as a Server-Timing header value"""
+        return ", ".join(f"{step};dur={ms}" for step, ms in self.as_dict().items())
+
+_current_timing: ContextVar[Optional[RequestTiming]] = ContextVar("request_timing", default=None)
+_completion_listeners: List[Callable[[RequestTiming], None]] = []
+
+def current_timing() -> Optional[RequestTiming]:
+    """Timing of the request being served, if any"""
+    return _current_timing.get()
+
+def add_completion_listener(listener: Callable[[RequestTiming], None]):
+    """Call listener with the timing of every chat request that completes"""
+    _completion_listeners.append(listener)
+
+def remove_completion_listener(listener: Callable[[RequestTiming], None]):
+    if listener in _completion_listeners:
+        _completion_listeners.remove(listener)
+
+@contextmanager
+def request_timing():
+    """Collect step timings for the enclosed request"""
+    timing = RequestTiming()
+    token = _current_timing.set(timing)
+    try:
+        yield timing
+    finally:
+        try:
+            _current_timing.reset(token)
+        except ValueError:
+            # A stream closed after the client went away exits from another context
+            pass
+        timing.end = time.perf_counter()
+        for listener in list(_completion_listeners):
+            try:
+                listener(timing)
+            except Exception as e:
+                logger.error(f"Error in request completion listener: {str(e)}", exc_info=True)
+
+@contextmanager
+def timed_step(step: str):
+    """Time the enclosed block as a step of the current request; a no-op outside a request"""
+    timing = _current_timing.get()
+    if timing is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timing.add(step, time.perf_counter() - start)
+
+def timed_request(endpoint):
+    """Decorator collecting step timings for every call of an endpoint"""
+    @functools.wraps(endpoint)
+    async def wrapper(*args, **kwargs):
+        with request_timing():
+            return await endpoint(*args, **kwargs)
+    return wrapper
+
+async def timed_events(events: AsyncIterator[Dict[str, Any]], include_timing: bool) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Collect step timings while a response streams, and add them to the done
+    event when requested (headers are already sent by then).
+    """
+    with request_timing() as timing:
+        async for event in events:
+            if event["type"] == "done" and include_timing:
+                event = {**event, "timing": timing.as_dict()}
+            yield event
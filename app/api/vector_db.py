@@ -1,53 +1,92 @@
 import os
+import time
 import logging
 import asyncio
-from typing import List, Dict, Any, Optional
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Callable, Tuple
 import httpx
-from sentence_transformers import SentenceTransformer
+import numpy as np
 import chromadb
 from chromadb.config import Settings
-from chromadb.utils import embedding_functions
+
+from app.api.embeddings import EmbeddingService, EmbeddingCache
+from app.api.batching import MicroBatcher
+from app.api.metrics import observe_stage
+from app.api.bm25 import BM25Index
+from app.api.vector_store_numpy import NumpyCollection, NumpyVectorClient
+from app.api.vector_store_ann import IVFCollection
 
 logger = logging.getLogger(__name__)
 
+# Collection metadata key holding the corpus version shared by all replicas
+CORPUS_VERSION_KEY = "corpus_version"
+
 class VectorDBService:
-    def __init__(self, client):
+    def __init__(self, client, embedding_service: Optional[EmbeddingService] = None):
         self.client = client
         self.collection_name = "documents"
+        # One embedding model per process, used for both documents and queries
+        self.embedding_service = embedding_service or EmbeddingService()
+        self.query_cache = EmbeddingCache()
         self.collection = self._get_or_create_collection()
-        self.embedding_model = self._load_embedding_model()
-        logger.info(f"Vector DB Service initialized with collection: {self.collection_name}")
+        # Bumped on every change to the corpus so dependent caches can invalidate.
+        # In-process collections belong to this replica, but a Chroma server is
+        # shared by every replica, so its version lives in the collection
+        # metadata and is polled to pick up changes made through other replicas.
+        self.shared_corpus_version = not isinstance(self.collection, NumpyCollection)
+        self.version_refresh_interval = float(os.environ.get("CORPUS_VERSION_REFRESH_SECONDS", "5"))
+        self.corpus_version = self._read_shared_version() if self.shared_corpus_version else 0
+        self._version_sync_task: Optional[asyncio.Task] = None
+        
+        # Lexical index kept alongside the collection for hybrid retrieval
+        self.lexical_index = None
+        if os.environ.get("HYBRID_RETRIEVAL", "false").lower() == "true":
+            self.lexical_index = BM25Index()
+            self._rebuild_lexical_index()
 
-    def _load_embedding_model(self):
-        """Load the embedding model for text embeddings"""
-        try:
-            # Using sentence-transformers for embeddings
-            model_name = "sentence-transformers/all-MiniLM-L6-v2"
-            logger.info(f"Loading embedding model: {model_name}")
-            return SentenceTransformer(model_name)
-        except Exception as e:
-            logger.error(f"Failed to load embedding model: {str(e)}", exc_info=True)
-            raise
+        # Chroma and embedding calls are blocking, so they run on a dedicated
+        # pool instead of the event loop (and instead of the shared default pool)
+        self.max_workers = int(os.environ.get("VECTOR_DB_MAX_WORKERS", "4"))
+        self.timeout = float(os.environ.get("VECTOR_DB_TIMEOUT", "30"))
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.max_workers,
+            thread_name_prefix="vector-db"
+        )
+        self._stats_lock = threading.Lock()
+        self._queued = 0
+        self._active = 0
+        self._completed = 0
+        self._timeouts = 0
+
+        # Concurrent queries arriving within the window share one embedding
+        # forward pass and one multi-query collection call
+        self.query_batcher = MicroBatcher(
+            self._query_batch,
+            max_batch_size=int(os.environ.get("RETRIEVAL_BATCH_MAX_SIZE", "16")),
+            max_wait=float(os.environ.get("RETRIEVAL_BATCH_WINDOW_MS", "5")) / 1000,
+            name="retrieval"
+        )
+        logger.info(f"Vector DB Service initialized with collection: {self.collection_name}")
 
     def _get_or_create_collection(self):
         """Get or create the document collection"""
         try:
-            # Create embedding function
-            sentence_transformer_ef = embedding_functions.SentenceTransformerEmbeddingFunction(
-                model_name="sentence-transformers/all-MiniLM-L6-v2"
-            )
+            # Embeddings are passed explicitly, but the collection shares our model
+            # for any call that only provides text
+            embedding_function = self.embedding_service
             
             # Get or create collection
             try:
                 collection = self.client.get_collection(
                     name=self.collection_name,
-                    embedding_function=sentence_transformer_ef
+                    embedding_function=embedding_function
                 )
                 logger.info(f"Retrieved existing collection: {self.collection_name}")
             except Exception:
                 collection = self.client.create_collection(
                     name=self.collection_name,
-                    embedding_function=sentence_transformer_ef
+                    embedding_function=embedding_function
                 )
                 logger.info(f"Created new collection: {self.collection_name}")
             
@@ -56,12 +95,166 @@ class VectorDBService:
             logger.error(f"Failed to get or create collection: {str(e)}", exc_info=True)
             raise
 
-    async def add_documents(self, documents: List[Dict[str, str]]):
+    def _rebuild_lexical_index(self, page_size: int = 1000):
+        """Index the documents already stored in the collection"""
+        try:
+            offset = 0
+            while True:
+                page = self.collection.get(limit=page_size, offset=offset, include=["documents"])
+                if not page["ids"]:
+                    break
+                self.lexical_index.add(page["ids"], page["documents"])
+                offset += len(page["ids"])
+            logger.info(f"Built lexical index for {len(self.lexical_index)} documents")
+        except Exception as e:
+            logger.error(f"Failed to build lexical index: {str(e)}", exc_info=True)
+            raise
+
+    def _shared_collection(self):
+        # A fresh handle, since collection objects keep the metadata they were fetched with
+        return self.client.get_collection(name=self.collection_name, embedding_function=self.embedding_service)
+
+    def _read_shared_version(self) -> int:
+        """Read the corpus version stored in the collection metadata"""
+        metadata = self._shared_collection().metadata or {}
+        return int(metadata.get(CORPUS_VERSION_KEY, 0))
+
+    def _bump_shared_version(self) -> int:
+        """Advance the corpus version stored in the collection metadata"""
+        collection = self._shared_collection()
+        # Chroma rejects any attempt to set the distance function again
+        metadata = {key: value for key, value in (collection.metadata or {}).items() if not key.startswith("hnsw:")}
+        # A microsecond timestamp keeps bumps from different replicas distinct,
+        # even if two of them read the same previous version
+        version = max(int(metadata.get(CORPUS_VERSION_KEY, 0)) + 1, time.time_ns() // 1000)
+        metadata[CORPUS_VERSION_KEY] = version
+        collection.modify(metadata=metadata)
+        return version
+
+    async def _corpus_changed(self):
+        """Advance the corpus version after a write"""
+        if self.shared_corpus_version:
+            version = await self._run("corpus_version", self._bump_shared_version)
+            self.corpus_version = max(self.corpus_version, version)
+        else:
+            self.corpus_version += 1
+
+    def start_version_sync(self):
+        """Start polling the shared corpus version; a no-op for in-process collections"""
+        if self.shared_corpus_version and self._version_sync_task is None:
+            self._version_sync_task = asyncio.ensure_future(self._sync_corpus_version())
+
+    async def _sync_corpus_version(self):
+        """Pick up corpus changes made through other replicas"""
+        while True:
+            await asyncio.sleep(self.version_refresh_interval)
+            try:
+                version = await self._run("corpus_version", self._read_shared_version)
+            except Exception as e:
+                logger.warning(f"Failed to refresh corpus version: {str(e)}")
+                continue
+            if version > self.corpus_version:
+                logger.info(f"Corpus changed on another replica, version {self.corpus_version} -> {version}")
+                self.corpus_version = version
+
+    async def _run(self, operation: str, func: Callable, *args, **kwargs):
+        """
+        Run a blocking vector DB call on the dedicated executor.
+
+        Args:
+            operation: Name of the operation, used for logging
+            func: Blocking callable to run
+            
+        Returns:
+            The return value of func
+        """
+        def _task():
+            with self._stats_lock:
+                self._queued -= 1
+                self._active += 1
+            try:
+                return func(*args, **kwargs)
+            finally:
+                with self._stats_lock:
+                    self._active -= 1
+                    self._completed += 1
+
+        def _done(pool_future):
+            # Cancelled while still waiting in the pool, so _task never ran
+            if pool_future.cancelled():
+                with self._stats_lock:
+                    self._queued -= 1
+
+        with self._stats_lock:
+            self._queued += 1
+
+        pool_future = self.executor.submit(_task)
+        pool_future.add_done_callback(_done)
+        try:
+            # Timing out or being cancelled also cancels the pool future if it has not started
+            return await asyncio.wait_for(asyncio.wrap_future(pool_future), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            # The worker thread cannot be interrupted; it finishes in the background
+            with self._stats_lock:
+                self._timeouts += 1
+            raise TimeoutError(f"Vector DB operation '{operation}' timed out after {self.timeout}s")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return executor utilisation and queue depth"""
+        with self._stats_lock:
+            return {
+                "max_workers": self.max_workers,
+                "queue_depth": self._queued,
+                "active": self._active,
+                "completed": self._completed,
+                "timeouts": self._timeouts,
+                "query_cache": self.query_cache.get_stats(),
+                "retrieval_batcher": self.query_batcher.get_stats(),
+            }
+
+    async def embed_queries(self, query_texts: List[str]) -> List[np.ndarray]:
+        """
+        Embed queries, serving repeated questions from the query cache and
+        embedding all misses in a single forward pass.
+        
+        Args:
+            query_texts: The texts to embed
+            
+        Returns:
+            float32 embedding vectors, one per query
+        """
+        keys = [self.query_cache.normalize(text) for text in query_texts]
+        vectors = {}
+        for key in keys:
+            if key not in vectors:
+                vectors[key] = self.query_cache.get(key)
+        
+        missing = [key for key, vector in vectors.items() if vector is None]
+        if missing:
+            embeddings = await self._run("embed", self.embedding_service.embed, missing)
+            for key, vector in zip(missing, embeddings):
+                self.query_cache.put(key, vector)
+                vectors[key] = vector
+        
+        return [vectors[key] for key in keys]
+
+    async def embed_query(self, query_text: str) -> np.ndarray:
+        """Embed a single query, using the query cache"""
+        return (await self.embed_queries([query_text]))[0]
+
+    def _embeddings_arg(self, embeddings: np.ndarray):
+        """In-process collections take arrays as-is; Chroma expects nested lists"""
+        if isinstance(self.collection, NumpyCollection):
+            return embeddings
+        return embeddings.tolist()
+
+    async def add_documents(self, documents: List[Dict[str, str]], embeddings: Optional[np.ndarray] = None):
         """
         Add documents to the vector database.
         
         Args:
             documents: List of document dictionaries with 'id', 'text', and 'metadata' keys
+            embeddings: Optional precomputed float32 embeddings, one row per document
         """
         try:
             # Prepare documents for insertion
@@ -69,12 +262,27 @@ class VectorDBService:
             texts = [doc["text"] for doc in documents]
             metadatas = [doc.get("metadata", {}) for doc in documents]
             
-            # Add documents to collection
-            self.collection.add(
+            if embeddings is None:
+                # Embed in batches with the shared model
+                embeddings = await self._run("embed", self.embedding_service.embed, texts)
+            elif embeddings.shape != (len(documents), self.embedding_service.dimension):
+                raise ValueError(
+                    f"Expected embeddings of shape ({len(documents)}, {self.embedding_service.dimension}), "
+                    f"got {embeddings.shape}"
+                )
+            
+            # Upsert, so re-ingesting a chunk with the same ID replaces it
+            await self._run(
+                "add",
+                self.collection.upsert,
                 ids=ids,
+                embeddings=self._embeddings_arg(embeddings),
                 documents=texts,
                 metadatas=metadatas
             )
+            if self.lexical_index is not None:
+                await self._run("index", self.lexical_index.add, ids, texts)
+            await self._corpus_changed()
             logger.info(f"Added {len(documents)} documents to vector database")
             
         except Exception as e:
@@ -93,40 +301,156 @@ class VectorDBService:
             List of document dictionaries with text and metadata
         """
         try:
-            # Query the collection
-            results = self.collection.query(
-                query_texts=[query_text],
-                n_results=n_results
+            # Coalesced with other in-flight queries by the retrieval batcher
+            documents = await self.query_batcher.submit((query_text, n_results))
+            
+            logger.info(f"Retrieved {len(documents)} documents for query: {query_text[:50]}...")
+            return documents
+            
+        except Exception as e:
+            logger.error(f"Error querying vector database: {str(e)}", exc_info=True)
+            raise
+
+    async def _query_batch(self, queries: List[Tuple[str, int]]) -> List[List[Dict[str, Any]]]:
+        """
+        Run a batch of (query_text, n_results) queries with one embedding pass
+        and one collection call.
+        """
+        # Identical questions in the same batch share a row in the collection query
+        keys = [self.query_cache.normalize(text) for text, _ in queries]
+        unique_keys = list(dict.fromkeys(keys))
+        row_of = {key: row for row, key in enumerate(unique_keys)}
+        
+        # Embed the queries, skipping the model for cached questions
+        with observe_stage("query_embedding", count=len(queries)):
+            query_embeddings = await self.embed_queries(unique_keys)
+        
+        # Query the collection once, for the largest n_results in the batch
+        max_results = max(n_results for _, n_results in queries)
+        with observe_stage("vector_query", count=len(queries)):
+            results = await self._run(
+                "query",
+                self.collection.query,
+                query_embeddings=self._embeddings_arg(np.stack(query_embeddings)),
+                n_results=max_results
+            )
+        
+        return [
+            self._format_results(results, row_of[key], n_results)
+            for key, (_, n_results) in zip(keys, queries)
+        ]
+
+    def _format_results(self, results: Dict[str, Any], row: int, n_results: int) -> List[Dict[str, Any]]:
+        """Format one row of a collection query result"""
+        documents = []
+        if results and results["documents"]:
+            for i, doc in enumerate(results["documents"][row][:n_results]):
+                documents.append({
+                    "text": doc,
+                    "metadata": results["metadatas"][row][i] if results["metadatas"] else {},
+                    "id": results["ids"][row][i] if results["ids"] else f"doc_{i}",
+                    "distance": results["distances"][row][i] if "distances" in results and results["distances"] else None
+                })
+        return documents
+
+    async def lexical_query(self, query_text: str, n_results: int = 3) -> List[Dict[str, Any]]:
+        """
+        Query the BM25 index for documents matching the query terms.
+        
+        Args:
+            query_text: The text to search for
+            n_results: Number of results to return
+            
+        Returns:
+            List of document dictionaries with text, metadata and BM25 score
+        """
+        if self.lexical_index is None:
+            return []
+        
+        try:
+            with observe_stage("lexical_query"):
+                hits = await self._run("lexical_query", self.lexical_index.search, query_text, n_results)
+            if not hits:
+                return []
+            
+            # Texts live in the collection, not in the lexical index
+            stored = await self._run(
+                "get",
+                self.collection.get,
+                ids=[doc_id for doc_id, _ in hits],
+                include=["documents", "metadatas"]
             )
+            by_id = {
+                doc_id: (text, metadata)
+                for doc_id, text, metadata in zip(stored["ids"], stored["documents"], stored["metadatas"])
+            }
             
-            # Format results
             documents = []
-            if results and results["documents"]:
-                for i, doc in enumerate(results["documents"][0]):
+            for doc_id, score in hits:
+                if doc_id in by_id:
+                    text, metadata = by_id[doc_id]
                     documents.append({
-                        "text": doc,
-                        "metadata": results["metadatas"][0][i] if results["metadatas"] else {},
-                        "id": results["ids"][0][i] if results["ids"] else f"doc_{i}",
-                        "distance": results["distances"][0][i] if "distances" in results and results["distances"] else None
+                        "text": text,
+                        "metadata": metadata or {},
+                        "id": doc_id,
+                        "bm25_score": score
                     })
-            
-            logger.info(f"Retrieved {len(documents)} documents for query: {query_text[:50]}...")
             return documents
             
         except Exception as e:
-            logger.error(f"Error querying vector database: {str(e)}", exc_info=True)
+            logger.error(f"Error querying lexical index: {str(e)}", exc_info=True)
             raise
 
+    async def count(self) -> int:
+        """Return the number of documents in the collection"""
+        return await self._run("count", self.collection.count)
+
+    async def delete_documents(self, ids: List[str]):
+        """Delete documents by ID"""
+        if not ids:
+            return
+        await self._run("delete", self.collection.delete, ids=ids)
+        if self.lexical_index is not None:
+            self.lexical_index.delete(ids)
+        await self._corpus_changed()
+        logger.info(f"Deleted {len(ids)} documents from vector database")
+
+    async def delete_all_documents(self):
+        """Delete all documents from the collection"""
+        await self._run("delete", self.collection.delete, where={})
+        if self.lexical_index is not None:
+            self.lexical_index.clear()
+        await self._corpus_changed()
+        logger.info("Deleted all documents from vector database")
+
     async def shutdown(self):
         """Clean up resources"""
         logger.info("Shutting down vector database service")
-        # ChromaDB client doesn't require explicit cleanup
+        if self._version_sync_task is not None:
+            self._version_sync_task.cancel()
+        # ChromaDB client doesn't require explicit cleanup, only our executor does
+        self.executor.shutdown(wait=False, cancel_futures=True)
 
 async def get_vector_db():
     """
     Initialize and return the vector database service.
     """
     try:
+        # Select the storage backend
+        backend = os.environ.get("VECTOR_DB_BACKEND", "chroma").lower()
+        if backend == "numpy":
+            # In-process index, no network hop to a vector DB server
+            index_directory = os.environ.get("NUMPY_INDEX_DIRECTORY", "./vector_db/numpy")
+            logger.info(f"Using in-process NumPy vector index with directory: {index_directory}")
+            return VectorDBService(NumpyVectorClient(index_directory))
+        elif backend == "ann":
+            # In-process IVF index with compressed codes for very large corpora
+            index_directory = os.environ.get("ANN_INDEX_DIRECTORY", "./vector_db/ann")
+            logger.info(f"Using in-process IVF vector index with directory: {index_directory}")
+            return VectorDBService(NumpyVectorClient(index_directory, collection_cls=IVFCollection))
+        elif backend != "chroma":
+            raise ValueError(f"Unknown VECTOR_DB_BACKEND: {backend}")
+        
         # Get connection details from environment variables
         host = os.environ.get("VECTOR_DB_HOST", "localhost")
         port = os.environ.get("VECTOR_DB_PORT", "8080")
@@ -150,7 +474,9 @@ async def get_vector_db():
             client = chromadb.PersistentClient(path=persist_directory)
             logger.info(f"Using persistent ChromaDB client with directory: {persist_directory}")
         
-        return VectorDBService(client)
+        service = VectorDBService(client)
+        service.start_version_sync()
+        return service
         
     except Exception as e:
         logger.error(f"Failed to initialize vector database: {str(e)}", exc_info=True)
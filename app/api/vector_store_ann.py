@@ -0,0 +1,407 @@
+import os
+import logging
+from typing import List, Dict, Any, Optional
+import numpy as np
+
+from app.api.vector_store_numpy import NumpyCollection, DiskPayloads
+
+logger = logging.getLogger(__name__)
+
+# Roughly this many training points per list keeps k-means meaningful
+TRAIN_POINTS_PER_LIST = 39
+
+def kmeans(
+    vectors: np.ndarray,
+    n_clusters: int,
+    n_iter: int = 10,
+    seed: int = 0,
+    chunk_size: int = 8192
+) -> np.ndarray:
+    """
+    Lloyd's k-means with chunked distance computation.
+
+    Args:
+        vectors: float32 training vectors of shape (n, d)
+        n_clusters: Number of centroids
+        n_iter: Number of iterations
+        seed: Random seed for the initial centroids
+        chunk_size: Rows per distance computation, bounds peak memory
+
+    Returns:
+        float32 centroids of shape (n_clusters, d)
+    """
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+
+    for _ in range(n_iter):
+        assignments = assign_nearest(vectors, centroids, chunk_size)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, vectors)
+        counts = np.bincount(assignments, minlength=n_clusters)
+
+        # Re-seed empty clusters from random points so every centroid stays useful
+        empty = counts == 0
+        if empty.any():
+            sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()))]
+            counts[empty] = 1
+        centroids = (sums / counts[:, np.newaxis]).astype(np.float32)
+
+    return centroids
+
+def assign_nearest(vectors: np.ndarray, centroids: np.ndarray, chunk_size: int = 8192) -> np.ndarray:
+    """Return the index of the nearest centroid (squared L2) for each vector"""
+    centroid_norms = (centroids ** 2).sum(axis=1)
+    assignments = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), chunk_size):
+        chunk = vectors[start:start + chunk_size]
+        # ||x - c||^2 without the ||x||^2 term, which does not change the argmin
+        distances = centroid_norms[np.newaxis, :] - 2.0 * chunk @ centroids.T
+        assignments[start:start + chunk_size] = distances.argmin(axis=1)
+    return assignments
+
+class ProductQuantizer:
+    """Splits vectors into m sub-vectors and encodes each as one byte"""
+
+    def __init__(self, dimension: int, m: int):
+        if dimension % m != 0:
+            raise ValueError(f"PQ sub-quantizers ({m}) must divide the dimension ({dimension})")
+        self.dimension = dimension
+        self.m = m
+        self.sub_dimension = dimension // m
+        self.codebooks: Optional[np.ndarray] = None  # (m, 256, sub_dimension)
+
+    @property
+    def code_size(self) -> int:
+        return self.m
+
+    def train(self, vectors: np.ndarray):
+        n_centroids = min(256, len(vectors))
+        self.codebooks = np.zeros((self.m, 256, self.sub_dimension), dtype=np.float32)
+        for j in range(self.m):
+            sub = np.ascontiguousarray(vectors[:, j * self.sub_dimension:(j + 1) * self.sub_dimension])
+            self.codebooks[j, :n_centroids] = kmeans(sub, n_centroids, seed=j)
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        codes = np.empty((len(vectors), self.m), dtype=np.uint8)
+        for j in range(self.m):
+            sub = vectors[:, j * self.sub_dimension:(j + 1) * self.sub_dimension]
+            codes[:, j] = assign_nearest(sub, self.codebooks[j])
+        return codes
+
+    def distances(self, query: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        """Asymmetric squared L2 distances from a full-precision query to encoded vectors"""
+        sub_queries = query.reshape(self.m, 1, self.sub_dimension)
+        tables = ((self.codebooks - sub_queries) ** 2).sum(axis=2)  # (m, 256)
+        return tables[np.arange(self.m), codes].sum(axis=1)
+
+    def state(self) -> Dict[str, np.ndarray]:
+        return {"codebooks": self.codebooks}
+
+    def load_state(self, state: Dict[str, np.ndarray]):
+        self.codebooks = state["codebooks"]
+
+class ScalarQuantizer:
+    """Encodes every dimension as one byte between the trained min and max"""
+
+    def __init__(self, dimension: int):
+        self.dimension = dimension
+        self.minimum: Optional[np.ndarray] = None
+        self.scale: Optional[np.ndarray] = None
+
+    @property
+    def code_size(self) -> int:
+        return self.dimension
+
+    def train(self, vectors: np.ndarray):
+        self.minimum = vectors.min(axis=0)
+        self.scale = np.maximum(vectors.max(axis=0) - self.minimum, 1e-12) / 255.0
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        return np.clip(np.rint((vectors - self.minimum) / self.scale), 0, 255).astype(np.uint8)
+
+    def distances(self, query: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        decoded = codes.astype(np.float32) * self.scale + self.minimum
+        return ((decoded - query) ** 2).sum(axis=1)
+
+    def state(self) -> Dict[str, np.ndarray]:
+        return {"minimum": self.minimum, "scale": self.scale}
+
+    def load_state(self, state: Dict[str, np.ndarray]):
+        self.minimum = state["minimum"]
+        self.scale = state["scale"]
+
+class IVFCollection(NumpyCollection):
+    """
+    NumpyCollection with an inverted-file (IVF) approximate index.
+
+    A coarse k-means quantizer splits the corpus into up to ANN_NLIST lists.
+    A query scans the ANN_NPROBE nearest lists using compressed residual codes
+    (ANN_QUANTIZATION=pq or sq8), then re-scores the best
+    ANN_RERANK_CANDIDATES with the full-precision vectors.
+
+    The number of lists is bounded by the training sample (39 points per
+    list), so the index is retrained with more lists whenever the corpus has
+    grown enough to double them, until ANN_NLIST is reached. Query cost grows
+    with the list size (corpus size / ANN_NLIST), so large corpora need a
+    larger ANN_NLIST and ANN_TRAIN_SAMPLE (e.g. 16384 lists and a sample of
+    at least 39 x 16384 for tens of millions of vectors).
+
+    The full-precision matrix stays memory-mapped and is read just for the
+    re-scored candidates; search itself touches only the codes, list
+    assignments and inverted lists. Texts and metadata live on disk
+    (DiskPayloads) and are read only for returned results; ids and their row
+    lookup stay in memory, about a hundred bytes per document. Until ANN_MIN_TRAIN_POINTS documents exist, queries fall
+    back to exact search.
+    """
+
+    payload_cls = DiskPayloads
+
+    def __init__(self, path: str, name: str, dimension: int):
+        self._ann_ready = False
+        self.nlist = int(os.environ.get("ANN_NLIST", "1024"))
+        self.nprobe = int(os.environ.get("ANN_NPROBE", "16"))
+        self.rerank_candidates = int(os.environ.get("ANN_RERANK_CANDIDATES", "100"))
+        self.min_train_points = int(os.environ.get("ANN_MIN_TRAIN_POINTS", "10000"))
+        self.train_sample = int(os.environ.get("ANN_TRAIN_SAMPLE", "100000"))
+        # Retraining re-encodes every row, so it waits until the list count can grow this much
+        self.retrain_growth = float(os.environ.get("ANN_RETRAIN_GROWTH", "2"))
+        self.quantization = os.environ.get("ANN_QUANTIZATION", "pq").lower()
+
+        if self.quantization == "pq":
+            self.quantizer = ProductQuantizer(dimension, int(os.environ.get("ANN_PQ_M", "48")))
+        elif self.quantization == "sq8":
+            self.quantizer = ScalarQuantizer(dimension)
+        else:
+            raise ValueError(f"Unknown ANN_QUANTIZATION: {self.quantization}")
+
+        self.centroids: Optional[np.ndarray] = None
+        self._centroid_norms: Optional[np.ndarray] = None
+        self._codes: Optional[np.memmap] = None
+        self._assignments: Optional[np.memmap] = None
+        self._lists: List[np.ndarray] = []
+
+        super().__init__(path, name, dimension)
+
+        self._model_path = os.path.join(path, "ann_model.npz")
+        self._codes_path = os.path.join(path, "ann_codes.u8")
+        self._assignments_path = os.path.join(path, "ann_assignments.i32")
+        self._load_ann()
+        self._ann_ready = True
+
+    @property
+    def trained(self) -> bool:
+        return self.centroids is not None
+
+    # ANN storage
+
+    def _open_ann_arrays(self):
+        """Map codes and list assignments with the same capacity as the vector matrix"""
+        for attr, file_path, dtype, width in (
+            ("_codes", self._codes_path, np.uint8, self.quantizer.code_size),
+            ("_assignments", self._assignments_path, np.int32, 1),
+        ):
+            size = self._capacity * width * np.dtype(dtype).itemsize
+            if not os.path.exists(file_path) or os.path.getsize(file_path) < size:
+                with open(file_path, "ab") as f:
+                    f.truncate(size)
+            if getattr(self, attr) is not None:
+                getattr(self, attr).flush()
+            shape = (self._capacity, width) if width > 1 else (self._capacity,)
+            setattr(self, attr, np.memmap(file_path, dtype=dtype, mode="r+", shape=shape))
+
+    def _load_ann(self):
+        """Load a previously trained model, or train now if there is enough data"""
+        if os.path.exists(self._model_path):
+            state = dict(np.load(self._model_path))
+            if str(state.pop("quantization")) != self.quantization:
+                logger.warning(f"ANN index at {self.path} uses different quantization, retraining")
+            else:
+                self._set_centroids(state.pop("centroids"))
+                self.quantizer.load_state(state)
+                self._open_ann_arrays()
+                self._rebuild_lists()
+                logger.info(f"Loaded IVF index with {len(self.centroids)} lists for {len(self._ids)} documents")
+        self._maybe_train()
+
+    def _set_centroids(self, centroids: np.ndarray):
+        self.centroids = centroids
+        # Squared norms for L2 probing, as in assign_nearest
+        self._centroid_norms = (centroids ** 2).sum(axis=1)
+
+    def _rebuild_lists(self):
+        """Rebuild the inverted lists from the persisted assignments"""
+        count = len(self._ids)
+        assignments = np.asarray(self._assignments[:count])
+        order = np.argsort(assignments, kind="stable")
+        bounds = np.searchsorted(assignments[order], np.arange(len(self.centroids) + 1))
+        self._lists = [order[bounds[i]:bounds[i + 1]].astype(np.int64) for i in range(len(self.centroids))]
+
+    def _target_nlist(self, count: int) -> int:
+        """Number of lists a training sample drawn from count vectors supports"""
+        return max(1, min(self.nlist, min(count, self.train_sample) // TRAIN_POINTS_PER_LIST))
+
+    def _maybe_train(self):
+        """
+        Train the coarse quantizer and the code quantizer once enough vectors
+        exist, and retrain them with more lists as the corpus grows.
+        """
+        count = len(self._ids)
+        if count < self.min_train_points:
+            return
+
+        nlist = self._target_nlist(count)
+        if self.trained:
+            current = len(self.centroids)
+            if nlist <= current or (nlist < self.retrain_growth * current and nlist < self.nlist):
+                return
+            logger.info(f"Corpus grew to {count} vectors, retraining IVF index with {nlist} instead of {current} lists")
+
+        logger.info(f"Training IVF index on {min(count, self.train_sample)} of {count} vectors")
+        rng = np.random.default_rng(0)
+        sample_rows = np.sort(rng.choice(count, min(count, self.train_sample), replace=False))
+        sample = np.asarray(self._matrix[sample_rows])
+        self._set_centroids(kmeans(sample, nlist))
+        residuals = sample - self.centroids[assign_nearest(sample, self.centroids)]
+        self.quantizer.train(residuals)
+        np.savez(
+            self._model_path,
+            quantization=np.array(self.quantization),
+            centroids=self.centroids,
+            **self.quantizer.state()
+        )
+
+        self._open_ann_arrays()
+        self._encode_rows(np.arange(count))
+        self._rebuild_lists()
+        logger.info(f"Trained IVF index with {nlist} lists ({self.quantization} codes)")
+
+    def _encode_rows(self, rows: np.ndarray, chunk_size: int = 65536):
+        """Assign rows to lists and write their residual codes"""
+        for start in range(0, len(rows), chunk_size):
+            chunk_rows = rows[start:start + chunk_size]
+            vectors = np.asarray(self._matrix[chunk_rows])
+            assignments = assign_nearest(vectors, self.centroids)
+            self._assignments[chunk_rows] = assignments
+            self._codes[chunk_rows] = self.quantizer.encode(vectors - self.centroids[assignments])
+        self._codes.flush()
+        self._assignments.flush()
+
+    # Storage hooks
+
+    def _ensure_capacity(self, rows: int):
+        capacity = self._capacity
+        super()._ensure_capacity(rows)
+        if self._capacity != capacity and self._codes is not None:
+            self._open_ann_arrays()
+
+    def _delete_row(self, doc_id: str, move_vector: bool = True):
+        if not (self._ann_ready and self.trained) or doc_id not in self._rows:
+            return super()._delete_row(doc_id, move_vector)
+
+        row = self._rows[doc_id]
+        last = len(self._ids) - 1
+        row_list = self._assignments[row]
+        self._lists[row_list] = self._lists[row_list][self._lists[row_list] != row]
+        if row != last and move_vector:
+            # The last row moves into the freed slot, along with its code
+            last_list = self._assignments[last]
+            self._lists[last_list][self._lists[last_list] == last] = row
+            self._codes[row] = self._codes[last]
+            self._assignments[row] = last_list
+        super()._delete_row(doc_id, move_vector)
+
+    def _clear(self):
+        super()._clear()
+        if self.trained:
+            self._lists = [np.empty(0, dtype=np.int64) for _ in range(len(self.centroids))]
+
+    # Collection API
+
+    def add(
+        self,
+        ids: List[str],
+        embeddings,
+        documents: Optional[List[str]] = None,
+        metadatas: Optional[List[Dict[str, Any]]] = None
+    ):
+        """Add or replace documents with precomputed embeddings"""
+        with self._lock:
+            if not self.trained:
+                super().add(ids, embeddings, documents, metadatas)
+                self._maybe_train()
+                return
+
+            # Replaced rows leave their old list before being re-assigned
+            for doc_id in ids:
+                row = self._rows.get(doc_id)
+                if row is not None:
+                    row_list = self._assignments[row]
+                    self._lists[row_list] = self._lists[row_list][self._lists[row_list] != row]
+
+            super().add(ids, embeddings, documents, metadatas)
+            rows = np.unique([self._rows[doc_id] for doc_id in ids])
+            self._encode_rows(rows)
+            for row_list in np.unique(self._assignments[rows]):
+                members = rows[self._assignments[rows] == row_list]
+                self._lists[row_list] = np.concatenate([self._lists[row_list], members])
+            self._maybe_train()
+
+    upsert = add
+
+    def query(
+        self,
+        query_embeddings,
+        n_results: int = 10,
+        include: Optional[List[str]] = None
+    ) -> Dict[str, List[List[Any]]]:
+        """Approximate top-k search for each query embedding"""
+        with self._lock:
+            if not self.trained:
+                return super().query(query_embeddings, n_results, include)
+
+            queries = self._normalize(query_embeddings)
+            results = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+            nprobe = min(self.nprobe, len(self.centroids))
+
+            # Nearest lists (squared L2, like the list assignment) for every query in one matmul.
+            # Centroids are not unit vectors, so ranking them by dot product would differ.
+            coarse = self._centroid_norms[np.newaxis, :] - 2.0 * queries @ self.centroids.T
+            probes = np.argpartition(coarse, nprobe - 1, axis=1)[:, :nprobe]
+
+            for query, query_probes in zip(queries, probes):
+                # Approximate distances from the compressed residuals of each probed list
+                candidate_rows = []
+                candidate_distances = []
+                for row_list in query_probes:
+                    members = self._lists[row_list]
+                    if len(members) == 0:
+                        continue
+                    candidate_rows.append(members)
+                    candidate_distances.append(
+                        self.quantizer.distances(query - self.centroids[row_list], self._codes[members])
+                    )
+
+                if candidate_rows:
+                    rows = np.concatenate(candidate_rows)
+                    distances = np.concatenate(candidate_distances)
+                    n_candidates = min(max(self.rerank_candidates, n_results), len(rows))
+                    if n_candidates < len(rows):
+                        keep = np.argpartition(distances, n_candidates - 1)[:n_candidates]
+                        rows = rows[keep]
+
+                    # Re-score the candidates with full-precision vectors, read in row order
+                    rows = np.sort(rows)
+                    scores = np.asarray(self._matrix[rows]) @ query
+                    ranked = np.argsort(-scores)[:n_results]
+                    rows, scores = rows[ranked], scores[ranked]
+                else:
+                    rows, scores = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+                documents, metadatas = self._payloads.read(rows)
+                results["ids"].append([self._ids[i] for i in rows])
+                results["documents"].append(documents)
+                results["metadatas"].append(metadatas)
+                # Squared L2 distance between unit vectors
+                results["distances"].append([float(2.0 - 2.0 * score) for score in scores])
+
+            return results
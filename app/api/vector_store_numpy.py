@@ -0,0 +1,467 @@
+import os
+import json
+import logging
+import threading
+from typing import List, Dict, Any, Optional, Tuple, Iterable
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+class InMemoryPayloads:
+    """Texts and metadata held in Python lists and stored in the JSON snapshot"""
+
+    def __init__(self, path: str):
+        self._documents: List[str] = []
+        self._metadatas: List[Dict[str, Any]] = []
+
+    def put(self, row: int, document: str, metadata: Dict[str, Any]):
+        """Store a row's payload; row may be one past the last row to append"""
+        if row == len(self._documents):
+            self._documents.append(document)
+            self._metadatas.append(metadata)
+        else:
+            self._documents[row] = document
+            self._metadatas[row] = metadata
+
+    def move(self, source: int, target: int):
+        self._documents[target] = self._documents[source]
+        self._metadatas[target] = self._metadatas[source]
+
+    def pop(self):
+        self._documents.pop()
+        self._metadatas.pop()
+
+    def clear(self):
+        self._documents = []
+        self._metadatas = []
+
+    def read(self, rows: Iterable[int]) -> Tuple[List[str], List[Dict[str, Any]]]:
+        rows = list(rows)
+        return [self._documents[row] for row in rows], [self._metadatas[row] for row in rows]
+
+    def restore(self, snapshot: Dict[str, Any]) -> bool:
+        """Load payloads from a snapshot; returns True if it should be rewritten"""
+        self._documents = snapshot.get("documents", [])
+        self._metadatas = snapshot.get("metadatas", [])
+        return False
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Fields to store in the snapshot"""
+        return {"documents": self._documents, "metadatas": self._metadatas}
+
+    def discard_unreferenced(self):
+        """Remove files the current snapshot no longer references"""
+
+class DiskPayloads:
+    """
+    Texts and metadata in an append-only file, read back with pread.
+
+    Only an (offset, length) pair per row stays in memory. Overwritten and
+    deleted rows leave dead records behind; when a snapshot is written and
+    more than half of the file is dead, the live records are copied into a
+    new file.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._index = np.zeros((1024, 2), dtype=np.int64)
+        self._count = 0
+        self._live_bytes = 0
+        self._generation = 0
+        self._sequence = 0
+        self._fd: Optional[int] = None
+        self._end = 0
+
+    def _data_path(self, generation: int) -> str:
+        return os.path.join(self.path, f"payloads.{generation}.jsonl")
+
+    def _index_path(self, sequence: int) -> str:
+        return os.path.join(self.path, f"payload_index.{sequence}.npy")
+
+    def _open_data(self, generation: int):
+        if self._fd is not None:
+            os.close(self._fd)
+        self._generation = generation
+        self._fd = os.open(self._data_path(generation), os.O_RDWR | os.O_CREAT)
+        self._end = os.fstat(self._fd).st_size
+
+    def put(self, row: int, document: str, metadata: Dict[str, Any]):
+        """Append a row's payload record; row may be one past the last row to append"""
+        if row == self._count:
+            if row == len(self._index):
+                self._index = np.concatenate([self._index, np.zeros_like(self._index)])
+            self._count += 1
+        record = (json.dumps([document, metadata]) + "\n").encode()
+        os.pwrite(self._fd, record, self._end)
+        self._live_bytes += len(record) - int(self._index[row, 1])
+        self._index[row] = (self._end, len(record))
+        self._end += len(record)
+
+    def move(self, source: int, target: int):
+        self._live_bytes += int(self._index[source, 1] - self._index[target, 1])
+        self._index[target] = self._index[source]
+
+    def pop(self):
+        self._count -= 1
+        self._live_bytes -= int(self._index[self._count, 1])
+        self._index[self._count] = 0
+
+    def clear(self):
+        self._index[:self._count] = 0
+        self._count = 0
+        self._live_bytes = 0
+
+    def read(self, rows: Iterable[int]) -> Tuple[List[str], List[Dict[str, Any]]]:
+        documents, metadatas = [], []
+        for offset, length in self._index[np.fromiter(rows, dtype=np.int64)]:
+            document, metadata = json.loads(os.pread(self._fd, int(length), int(offset)))
+            documents.append(document)
+            metadatas.append(metadata)
+        return documents, metadatas
+
+    def restore(self, snapshot: Dict[str, Any]) -> bool:
+        """Load the index a snapshot references; returns True if it should be rewritten"""
+        self._open_data(snapshot.get("payload_generation", 0))
+        if "payload_index" in snapshot:
+            self._sequence = snapshot["payload_index"]
+            index = np.load(self._index_path(self._sequence))
+            self._index = np.zeros((max(len(index), 1024), 2), dtype=np.int64)
+            self._index[:len(index)] = index
+            self._count = len(index)
+            self._live_bytes = int(index[:, 1].sum())
+        
+        # Snapshots from the in-memory store carry the payloads inline
+        for row, (document, metadata) in enumerate(zip(snapshot.get("documents", []), snapshot.get("metadatas", []))):
+            self.put(row, document, metadata)
+        return "documents" in snapshot or self._end > 2 * self._live_bytes
+
+    def _compact(self):
+        """Copy the live records, in row order, into the next data file"""
+        generation = self._generation + 1
+        index = np.zeros_like(self._index)
+        with open(self._data_path(generation), "wb") as f:
+            offset = 0
+            for row, (start, length) in enumerate(self._index[:self._count]):
+                f.write(os.pread(self._fd, int(length), int(start)))
+                index[row] = (offset, length)
+                offset += length
+        self._open_data(generation)
+        self._index = index
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Write the row index to a new file and return the fields that reference it"""
+        if self._end > 2 * self._live_bytes:
+            self._compact()
+        self._sequence += 1
+        np.save(self._index_path(self._sequence), self._index[:self._count])
+        return {"payload_generation": self._generation, "payload_index": self._sequence}
+
+    def discard_unreferenced(self):
+        """Remove data and index files left behind by earlier snapshots"""
+        current = {os.path.basename(self._data_path(self._generation)), os.path.basename(self._index_path(self._sequence))}
+        for file_name in os.listdir(self.path):
+            if file_name.startswith(("payloads.", "payload_index.")) and file_name not in current:
+                os.remove(os.path.join(self.path, file_name))
+
+class NumpyCollection:
+    """
+    In-process vector collection backed by a contiguous float32 matrix.
+
+    Embeddings are L2-normalized and stored in a memory-mapped file, so the
+    corpus is persisted without a separate server. Search is an exact
+    vectorized matmul followed by an argpartition top-k. The methods mirror
+    the subset of the Chroma collection API that VectorDBService uses, and
+    distances are squared L2 like Chroma's default space.
+
+    Ids, texts and metadata are kept in a JSON snapshot plus an append-only
+    journal that is compacted into the snapshot when the collection is opened.
+    Texts and metadata are stored by payload_cls: in memory by default, or on
+    disk with DiskPayloads.
+    """
+
+    payload_cls: type = InMemoryPayloads
+
+    def __init__(self, path: str, name: str, dimension: int):
+        self.path = path
+        self.name = name
+        self.dimension = dimension
+        os.makedirs(path, exist_ok=True)
+        
+        self._matrix_path = os.path.join(path, "embeddings.f32")
+        self._snapshot_path = os.path.join(path, "store.json")
+        self._journal_path = os.path.join(path, "journal.jsonl")
+        self._lock = threading.RLock()
+        
+        self._ids: List[str] = []
+        self._payloads = self.payload_cls(path)
+        self._rows: Dict[str, int] = {}
+        self._matrix: Optional[np.memmap] = None
+        self._capacity = 0
+        self._load()
+
+    # Storage
+
+    def _open_matrix(self, capacity: int):
+        """Map the embedding file with room for capacity rows"""
+        size = capacity * self.dimension * 4
+        if not os.path.exists(self._matrix_path) or os.path.getsize(self._matrix_path) < size:
+            with open(self._matrix_path, "ab") as f:
+                f.truncate(size)
+        
+        if self._matrix is not None:
+            self._matrix.flush()
+        self._matrix = np.memmap(
+            self._matrix_path, dtype=np.float32, mode="r+", shape=(capacity, self.dimension)
+        )
+        self._capacity = capacity
+
+    def _ensure_capacity(self, rows: int):
+        """Grow the mapped matrix geometrically so appends stay amortized O(1)"""
+        if rows > self._capacity:
+            self._open_matrix(max(rows, self._capacity * 2, 1024))
+
+    def _load(self):
+        """Load the snapshot, replay the journal and compact both"""
+        existing_rows = 0
+        if os.path.exists(self._matrix_path):
+            existing_rows = os.path.getsize(self._matrix_path) // (self.dimension * 4)
+        self._open_matrix(max(existing_rows, 1024))
+        
+        snapshot = {}
+        if os.path.exists(self._snapshot_path):
+            with open(self._snapshot_path) as f:
+                snapshot = json.load(f)
+            if snapshot["dimension"] != self.dimension:
+                raise ValueError(
+                    f"Index at {self.path} has dimension {snapshot['dimension']}, "
+                    f"embedding model has {self.dimension}"
+                )
+            self._ids = snapshot["ids"]
+            self._rows = {doc_id: row for row, doc_id in enumerate(self._ids)}
+        rewrite = self._payloads.restore(snapshot)
+        
+        if os.path.exists(self._journal_path):
+            with open(self._journal_path) as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    entry = json.loads(line)
+                    if entry["op"] == "put":
+                        self._put_row(entry["id"], entry["document"], entry["metadata"], entry["row"])
+                    elif entry["op"] == "delete":
+                        # The mapped file already holds the moved vectors
+                        self._delete_row(entry["id"], move_vector=False)
+        
+        if rewrite or os.path.exists(self._journal_path) or not os.path.exists(self._snapshot_path):
+            self._write_snapshot()
+        
+        logger.info(f"Opened NumPy collection '{self.name}' at {self.path} with {len(self._ids)} documents")
+
+    def _write_snapshot(self):
+        """Atomically replace the snapshot and truncate the journal"""
+        self._matrix.flush()
+        tmp_path = self._snapshot_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({
+                "dimension": self.dimension,
+                "ids": self._ids,
+                **self._payloads.snapshot(),
+            }, f)
+        os.replace(tmp_path, self._snapshot_path)
+        open(self._journal_path, "w").close()
+        self._payloads.discard_unreferenced()
+
+    def _append_journal(self, entries: List[Dict[str, Any]]):
+        # Rows are flushed first so the journal never references unwritten vectors
+        self._matrix.flush()
+        with open(self._journal_path, "a") as f:
+            for entry in entries:
+                f.write(json.dumps(entry) + "\n")
+
+    def _put_row(self, doc_id: str, document: str, metadata: Dict[str, Any], row: int):
+        """Record an id at a row; an existing id is overwritten in place"""
+        if row == len(self._ids):
+            self._ids.append(doc_id)
+        self._payloads.put(row, document, metadata)
+        self._rows[doc_id] = row
+
+    def _delete_row(self, doc_id: str, move_vector: bool = True):
+        """Remove an id by moving the last row into its slot"""
+        row = self._rows.pop(doc_id, None)
+        if row is None:
+            return
+        last = len(self._ids) - 1
+        if row != last:
+            moved_id = self._ids[last]
+            if move_vector:
+                self._matrix[row] = self._matrix[last]
+            self._ids[row] = moved_id
+            self._payloads.move(last, row)
+            self._rows[moved_id] = row
+        self._ids.pop()
+        self._payloads.pop()
+
+    def _clear(self):
+        """Drop every row; the mapped file is reused for new vectors"""
+        self._ids = []
+        self._payloads.clear()
+        self._rows = {}
+
+    @staticmethod
+    def _normalize(vectors) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.ndim == 1:
+            vectors = vectors[np.newaxis, :]
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    @staticmethod
+    def _matches(metadata: Dict[str, Any], where: Optional[Dict[str, Any]]) -> bool:
+        """Flat equality filter; an empty filter matches everything"""
+        return not where or all(metadata.get(key) == value for key, value in where.items())
+
+    def _filter_rows(self, rows: List[int], where: Optional[Dict[str, Any]]) -> List[int]:
+        """Keep the rows whose metadata matches the filter"""
+        if not where:
+            return rows
+        metadatas = self._payloads.read(rows)[1]
+        return [row for row, metadata in zip(rows, metadatas) if self._matches(metadata, where)]
+
+    # Collection API
+
+    def add(
+        self,
+        ids: List[str],
+        embeddings,
+        documents: Optional[List[str]] = None,
+        metadatas: Optional[List[Dict[str, Any]]] = None
+    ):
+        """Add or replace documents with precomputed embeddings"""
+        vectors = self._normalize(embeddings)
+        if vectors.shape != (len(ids), self.dimension):
+            raise ValueError(f"Expected embeddings of shape ({len(ids)}, {self.dimension}), got {vectors.shape}")
+        documents = documents or [""] * len(ids)
+        metadatas = metadatas or [{}] * len(ids)
+        
+        with self._lock:
+            self._ensure_capacity(len(self._ids) + len(ids))
+            journal = []
+            for doc_id, vector, document, metadata in zip(ids, vectors, documents, metadatas):
+                row = self._rows.get(doc_id, len(self._ids))
+                self._matrix[row] = vector
+                self._put_row(doc_id, document, metadata or {}, row)
+                journal.append({"op": "put", "id": doc_id, "row": row, "document": document, "metadata": metadata or {}})
+            self._append_journal(journal)
+
+    upsert = add
+
+    def query(
+        self,
+        query_embeddings,
+        n_results: int = 10,
+        include: Optional[List[str]] = None
+    ) -> Dict[str, List[List[Any]]]:
+        """Exact top-k search for each query embedding"""
+        queries = self._normalize(query_embeddings)
+        results = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        
+        with self._lock:
+            count = len(self._ids)
+            k = min(n_results, count)
+            if k == 0:
+                for key in results:
+                    results[key] = [[] for _ in range(len(queries))]
+                return results
+            
+            scores = queries @ self._matrix[:count].T
+            if k < count:
+                top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            else:
+                top = np.tile(np.arange(count), (len(queries), 1))
+            
+            for q, candidates in enumerate(top):
+                ranked = candidates[np.argsort(-scores[q, candidates])]
+                documents, metadatas = self._payloads.read(ranked)
+                results["ids"].append([self._ids[i] for i in ranked])
+                results["documents"].append(documents)
+                results["metadatas"].append(metadatas)
+                # Squared L2 distance between unit vectors
+                results["distances"].append([float(2.0 - 2.0 * scores[q, i]) for i in ranked])
+        
+        return results
+
+    def get(
+        self,
+        ids: Optional[List[str]] = None,
+        where: Optional[Dict[str, Any]] = None,
+        limit: Optional[int] = None,
+        offset: Optional[int] = None,
+        include: Optional[List[str]] = None
+    ) -> Dict[str, List[Any]]:
+        """Return stored documents, optionally filtered by id or metadata"""
+        with self._lock:
+            if ids is not None:
+                rows = [self._rows[doc_id] for doc_id in ids if doc_id in self._rows]
+            else:
+                rows = range(len(self._ids))
+            rows = self._filter_rows(list(rows), where)
+            rows = rows[offset or 0:]
+            if limit is not None:
+                rows = rows[:limit]
+            documents, metadatas = self._payloads.read(rows)
+            return {
+                "ids": [self._ids[row] for row in rows],
+                "documents": documents,
+                "metadatas": metadatas,
+            }
+
+    def count(self) -> int:
+        """Return the number of documents"""
+        with self._lock:
+            return len(self._ids)
+
+    def delete(self, ids: Optional[List[str]] = None, where: Optional[Dict[str, Any]] = None):
+        """Delete documents by id and/or metadata filter; an empty filter deletes everything"""
+        with self._lock:
+            targets = ids if ids is not None else list(self._ids)
+            rows = self._filter_rows([self._rows[doc_id] for doc_id in dict.fromkeys(targets) if doc_id in self._rows], where)
+            targets = [self._ids[row] for row in rows]
+            if len(targets) == len(self._ids):
+                self._clear()
+            else:
+                for doc_id in targets:
+                    self._delete_row(doc_id)
+            
+            if len(self._ids) == 0:
+                # Nothing left to replay, start from a clean snapshot
+                self._write_snapshot()
+            else:
+                self._append_journal([{"op": "delete", "id": doc_id} for doc_id in targets])
+
+class NumpyVectorClient:
+    """
+    Minimal client exposing the Chroma client calls VectorDBService makes,
+    backed by NumpyCollection directories under a root path.
+    """
+
+    def __init__(self, path: str, collection_cls: type = NumpyCollection):
+        self.path = path
+        self.collection_cls = collection_cls
+        self._collections: Dict[str, NumpyCollection] = {}
+        os.makedirs(path, exist_ok=True)
+
+    def _open(self, name: str, embedding_function) -> NumpyCollection:
+        if name not in self._collections:
+            self._collections[name] = self.collection_cls(
+                os.path.join(self.path, name), name, embedding_function.dimension
+            )
+        return self._collections[name]
+
+    def get_collection(self, name: str, embedding_function=None) -> NumpyCollection:
+        if name not in self._collections and not os.path.exists(os.path.join(self.path, name, "store.json")):
+            raise ValueError(f"Collection {name} does not exist.")
+        return self._open(name, embedding_function)
+
+    def create_collection(self, name: str, embedding_function=None) -> NumpyCollection:
+        return self._open(name, embedding_function)
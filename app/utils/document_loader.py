@@ -1,13 +1,15 @@
 import os
+import time
 import logging
 import argparse
-import uuid
-from typing import List, Dict, Any, Optional
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import List, Dict, Any, Optional, Iterator, Iterable, AsyncIterator, Callable, Set, Tuple
 import asyncio
 import httpx
 import json
 from langchain_community.document_loaders import (
-    DirectoryLoader,
     TextLoader,
     PyPDFLoader,
     CSVLoader,
@@ -22,62 +24,485 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Loader class per supported file extension
+LOADER_CLASSES = {
+    ".txt": TextLoader,
+    ".pdf": PyPDFLoader,
+    ".csv": CSVLoader,
+    ".md": UnstructuredMarkdownLoader,
+}
+
 # Document processing
-def load_documents(directory_path: str) -> List[Dict[str, Any]]:
+def iter_document_files(directory_path: str) -> Iterator[str]:
     """
-    Load documents from a directory.
+    Walk a directory and yield the paths of supported document files.
     
     Args:
         directory_path: Path to the directory containing documents
+    """
+    for root, _, files in os.walk(directory_path):
+        for name in sorted(files):
+            if os.path.splitext(name)[1].lower() in LOADER_CLASSES:
+                yield os.path.join(root, name)
+
+def chunk_id(source: str, text: str) -> str:
+    """Deterministic chunk ID derived from the source file and the chunk content"""
+    return hashlib.sha256(f"{source}\n{text}".encode("utf-8")).hexdigest()[:32]
+
+def file_sha256(file_path: str) -> str:
+    """Hash a file's contents in fixed-size blocks"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def parse_file(
+    file_path: str,
+    source_id: Optional[str] = None,
+    chunk_size: int = 1000,
+    chunk_overlap: int = 200
+) -> List[Dict[str, Any]]:
+    """
+    Load a single file and split it into chunks formatted for the vector database.
+    Runs in a worker process, so it only takes and returns picklable values.
+    
+    Args:
+        file_path: Path to the document
+        source_id: Stable name of the file used for chunk IDs (defaults to file_path)
+        chunk_size: Maximum characters per chunk
+        chunk_overlap: Characters shared by adjacent chunks
         
     Returns:
         List of document dictionaries
     """
-    logger.info(f"Loading documents from {directory_path}")
-    
-    # Configure loaders for different file types
-    loaders = {
-        ".txt": DirectoryLoader(directory_path, glob="**/*.txt", loader_cls=TextLoader),
-        ".pdf": DirectoryLoader(directory_path, glob="**/*.pdf", loader_cls=PyPDFLoader),
-        ".csv": DirectoryLoader(directory_path, glob="**/*.csv", loader_cls=CSVLoader),
-        ".md": DirectoryLoader(directory_path, glob="**/*.md", loader_cls=UnstructuredMarkdownLoader)
-    }
-    
-    # Load documents
-    all_docs = []
-    for ext, loader in loaders.items():
-        try:
-            docs = loader.load()
-            logger.info(f"Loaded {len(docs)} documents with extension {ext}")
-            all_docs.extend(docs)
-        except Exception as e:
-            logger.error(f"Error loading documents with extension {ext}: {str(e)}")
+    loader_cls = LOADER_CLASSES[os.path.splitext(file_path)[1].lower()]
+    pages = loader_cls(file_path).load()
     
-    # Split documents into chunks
     text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=1000,
-        chunk_overlap=200,
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
         length_function=len,
     )
+    chunks = text_splitter.split_documents(pages)
     
-    chunks = text_splitter.split_documents(all_docs)
-    logger.info(f"Split {len(all_docs)} documents into {len(chunks)} chunks")
-    
-    # Format chunks for vector database
-    formatted_docs = []
+    # Format chunks for vector database; identical chunks of a file collapse into one
+    formatted_docs = {}
     for i, chunk in enumerate(chunks):
-        doc_id = str(uuid.uuid4())
-        formatted_docs.append({
+        doc_id = chunk_id(source_id or file_path, chunk.page_content)
+        if doc_id in formatted_docs:
+            continue
+        formatted_docs[doc_id] = {
             "id": doc_id,
             "text": chunk.page_content,
             "metadata": {
                 "source": chunk.metadata.get("source", f"chunk_{i}"),
                 "page": chunk.metadata.get("page", None)
             }
-        })
+        }
     
+    return list(formatted_docs.values())
+
+def parse_and_hash_file(file_path: str, source_id: str) -> Tuple[str, List[Dict[str, Any]]]:
+    """Parse a file and hash its contents in the same worker call"""
+    return file_sha256(file_path), parse_file(file_path, source_id)
+
+async def iter_parsed_files(
+    files: Iterable[Tuple[str, str]],
+    workers: Optional[int] = None,
+    stats: Optional["IngestionStats"] = None,
+    parser: Callable = parse_file
+) -> AsyncIterator[Tuple[str, Any]]:
+    """
+    Parse files in a process pool and yield each result as soon as it is ready.
+    At most two files per worker are in flight, so memory stays bounded
+    regardless of the number of files.
+    
+    Args:
+        files: (file_path, source_id) pairs
+        workers: Number of parser processes (defaults to the CPU count)
+        stats: Optional counters updated as files are parsed
+        parser: Picklable function called as parser(file_path, source_id)
+        
+    Yields:
+        (file_path, parser result) pairs; files that fail to parse are logged and skipped
+    """
+    workers = workers or os.cpu_count() or 1
+    loop = asyncio.get_event_loop()
+    files = iter(files)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = {}
+        
+        def submit_next() -> bool:
+            item = next(files, None)
+            if item is None:
+                return False
+            file_path, source_id = item
+            pending[loop.run_in_executor(pool, parser, file_path, source_id)] = file_path
+            return True
+        
+        for _ in range(workers * 2):
+            if not submit_next():
+                break
+        
+        while pending:
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                file_path = pending.pop(future)
+                submit_next()
+                try:
+                    result = future.result()
+                except Exception as e:
+                    logger.error(f"Error loading {file_path}: {str(e)}")
+                    if stats is not None:
+                        stats.files_failed += 1
+                    continue
+                
+                if stats is not None:
+                    stats.files += 1
+                yield file_path, result
+
+async def iter_document_chunks(
+    directory_path: str,
+    workers: Optional[int] = None,
+    stats: Optional["IngestionStats"] = None
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Parse every document of a directory in a process pool and yield chunks
+    as each file finishes.
+    
+    Args:
+        directory_path: Path to the directory containing documents
+        workers: Number of parser processes (defaults to the CPU count)
+        stats: Optional counters updated as files are parsed
+    """
+    logger.info(f"Loading documents from {directory_path}")
+    files = (
+        (file_path, os.path.relpath(file_path, directory_path))
+        for file_path in iter_document_files(directory_path)
+    )
+    async for _, chunks in iter_parsed_files(files, workers, stats):
+        if stats is not None:
+            stats.chunks += len(chunks)
+        for chunk in chunks:
+            yield chunk
+
+# Incremental ingestion
+class IngestionManifest:
+    """
+    Persisted record of what was ingested from each file:
+    relative path -> {"mtime_ns", "size", "sha256", "chunk_ids"}, plus the
+    IDs of stale chunks that still have to be deleted from the database.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.files: Dict[str, Dict[str, Any]] = {}
+        self.pending_deletes: List[str] = []
+        if os.path.exists(path):
+            with open(path) as f:
+                data = json.load(f)
+            self.files = data.get("files", {})
+            self.pending_deletes = data.get("pending_deletes", [])
+            logger.info(f"Loaded manifest with {len(self.files)} files from {path}")
+
+    def save(self):
+        """Atomically write the manifest"""
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"version": 1, "files": self.files, "pending_deletes": self.pending_deletes}, f)
+        os.replace(tmp_path, self.path)
+
+def plan_ingestion(
+    directory_path: str,
+    manifest: IngestionManifest
+) -> Tuple[List[Tuple[str, str]], List[str]]:
+    """
+    Compare a directory against the manifest.
+    
+    Files whose size and mtime match the manifest are skipped without being
+    read. Files whose stat changed but whose content hash did not are only
+    re-stamped in the manifest.
+    
+    Returns:
+        Tuple of (changed or new (file_path, source_id) pairs, removed source_ids)
+    """
+    changed = []
+    seen = set()
+    for file_path in iter_document_files(directory_path):
+        source_id = os.path.relpath(file_path, directory_path)
+        seen.add(source_id)
+        stat = os.stat(file_path)
+        entry = manifest.files.get(source_id)
+        
+        if entry is not None:
+            if entry["mtime_ns"] == stat.st_mtime_ns and entry["size"] == stat.st_size:
+                continue
+            if entry["size"] == stat.st_size and entry["sha256"] == file_sha256(file_path):
+                entry["mtime_ns"] = stat.st_mtime_ns
+                continue
+        changed.append((file_path, source_id))
+    
+    removed = [source_id for source_id in manifest.files if source_id not in seen]
+    return changed, removed
+
+async def delete_from_vector_db(
+    ids: List[str],
+    api_url: str,
+    batch_size: int = 500,
+    max_retries: int = 3
+) -> bool:
+    """
+    Delete documents by ID via the API.
+    
+    Returns:
+        True if every batch was deleted
+    """
+    success = True
+    async with httpx.AsyncClient(timeout=60.0) as client:
+        for i in range(0, len(ids), batch_size):
+            batch = ids[i:i + batch_size]
+            for attempt in range(max_retries + 1):
+                try:
+                    response = await client.post(f"{api_url}/documents/delete", json={"ids": batch})
+                    response.raise_for_status()
+                    break
+                except Exception as e:
+                    if attempt == max_retries:
+                        logger.error(f"Error deleting {len(batch)} documents: {str(e)}")
+                        success = False
+                    else:
+                        await asyncio.sleep(2 ** attempt)
+    return success
+
+async def sync_directory(
+    directory_path: str,
+    api_url: str,
+    manifest_path: str,
+    workers: Optional[int] = None,
+    batch_size: int = 50,
+    concurrency: int = 4,
+    max_retries: int = 3
+) -> "IngestionStats":
+    """
+    Incrementally bring the vector database in line with a directory.
+    
+    Only new or modified files are parsed. Of their chunks, only the ones not
+    already ingested are uploaded; chunks that disappeared from a modified
+    file, and all chunks of removed files, are deleted. A file's manifest
+    entry is only updated once all of its chunks were uploaded, and chunks
+    to delete are recorded in the manifest until the deletion succeeded, so
+    failures of either are retried on the next run.
+    """
+    manifest = IngestionManifest(manifest_path)
+    changed, removed = plan_ingestion(directory_path, manifest)
+    logger.info(f"{len(changed)} new or modified files, {len(removed)} removed files")
+    
+    stats = IngestionStats()
+    parsed: Dict[str, Dict[str, Any]] = {}
+    
+    async def new_chunks() -> AsyncIterator[Dict[str, Any]]:
+        async for file_path, (sha256, chunks) in iter_parsed_files(
+            changed, workers, stats, parser=parse_and_hash_file
+        ):
+            source_id = os.path.relpath(file_path, directory_path)
+            stat = os.stat(file_path)
+            old_ids = set(manifest.files.get(source_id, {}).get("chunk_ids", []))
+            new_ids = [chunk["id"] for chunk in chunks]
+            parsed[source_id] = {
+                "entry": {
+                    "mtime_ns": stat.st_mtime_ns,
+                    "size": stat.st_size,
+                    "sha256": sha256,
+                    "chunk_ids": new_ids,
+                },
+                "stale_ids": sorted(old_ids - set(new_ids)),
+            }
+            
+            # Unchanged chunks keep their IDs and are already embedded
+            fresh = [chunk for chunk in chunks if chunk["id"] not in old_ids]
+            stats.chunks += len(fresh)
+            for chunk in fresh:
+                yield chunk
+    
+    await upload_documents(
+        new_chunks(),
+        api_url,
+        batch_size=batch_size,
+        concurrency=concurrency,
+        max_retries=max_retries,
+        stats=stats
+    )
+    
+    # Step 1: Commit files whose chunks all made it, queueing their stale chunks and
+    # those of removed files for deletion. The queue is saved before deleting, so
+    # no chunk is forgotten if the deletion fails or the run is interrupted.
+    pending = dict.fromkeys(manifest.pending_deletes)
+    for source_id, result in parsed.items():
+        if stats.failed_ids.isdisjoint(result["entry"]["chunk_ids"]):
+            manifest.files[source_id] = result["entry"]
+            pending.update(dict.fromkeys(result["stale_ids"]))
+    for source_id in removed:
+        pending.update(dict.fromkeys(manifest.files.pop(source_id)["chunk_ids"]))
+    
+    # A chunk that came back (e.g. a reverted edit) is live again
+    live_ids = {chunk_id for entry in manifest.files.values() for chunk_id in entry["chunk_ids"]}
+    manifest.pending_deletes = [chunk_id for chunk_id in pending if chunk_id not in live_ids]
+    manifest.save()
+    
+    # Step 2: Delete the queued chunks, keeping them queued for the next run on failure
+    if manifest.pending_deletes:
+        if await delete_from_vector_db(manifest.pending_deletes, api_url, max_retries=max_retries):
+            stats.documents_deleted += len(manifest.pending_deletes)
+            manifest.pending_deletes = []
+            manifest.save()
+        else:
+            logger.warning(f"{len(manifest.pending_deletes)} stale chunks could not be deleted, retrying on the next sync")
+    return stats
+
+def load_documents(directory_path: str) -> List[Dict[str, Any]]:
+    """
+    Load documents from a directory.
+    
+    Args:
+        directory_path: Path to the directory containing documents
+        
+    Returns:
+        List of document dictionaries
+    """
+    logger.info(f"Loading documents from {directory_path}")
+    
+    formatted_docs = []
+    for file_path in iter_document_files(directory_path):
+        try:
+            formatted_docs.extend(parse_file(file_path, os.path.relpath(file_path, directory_path)))
+        except Exception as e:
+            logger.error(f"Error loading {file_path}: {str(e)}")
+    
+    logger.info(f"Loaded {len(formatted_docs)} chunks")
     return formatted_docs
 
+# Upload
+@dataclass
+class IngestionStats:
+    """Progress and throughput counters for an ingestion run"""
+    files: int = 0
+    files_failed: int = 0
+    chunks: int = 0
+    batches: int = 0
+    batches_failed: int = 0
+    documents_uploaded: int = 0
+    documents_deleted: int = 0
+    retries: int = 0
+    failed_ids: Set[str] = field(default_factory=set)
+    started_at: float = field(default_factory=time.monotonic)
+
+    def report(self) -> Dict[str, Any]:
+        elapsed = time.monotonic() - self.started_at
+        return {
+            "files": self.files,
+            "files_failed": self.files_failed,
+            "chunks": self.chunks,
+            "batches": self.batches,
+            "batches_failed": self.batches_failed,
+            "documents_uploaded": self.documents_uploaded,
+            "documents_deleted": self.documents_deleted,
+            "retries": self.retries,
+            "elapsed_seconds": round(elapsed, 2),
+            "documents_per_second": round(self.documents_uploaded / elapsed, 2) if elapsed > 0 else 0.0,
+        }
+
+async def _post_batch(
+    client: httpx.AsyncClient,
+    url: str,
+    batch: List[Dict[str, Any]],
+    batch_number: int,
+    max_retries: int,
+    stats: IngestionStats
+):
+    """Upload one batch, retrying transport errors, 429 and 5xx responses with backoff"""
+    for attempt in range(max_retries + 1):
+        try:
+            response = await client.post(url, json={"documents": batch})
+            response.raise_for_status()
+            stats.documents_uploaded += len(batch)
+            logger.info(f"Successfully uploaded batch {batch_number} ({len(batch)} documents)")
+            return
+        except Exception as e:
+            retryable = not isinstance(e, httpx.HTTPStatusError) or (
+                e.response.status_code == 429 or e.response.status_code >= 500
+            )
+            if not retryable or attempt == max_retries:
+                stats.batches_failed += 1
+                stats.failed_ids.update(doc["id"] for doc in batch)
+                logger.error(f"Error uploading batch {batch_number}: {str(e)}")
+                return
+            
+            stats.retries += 1
+            delay = 2 ** attempt
+            logger.warning(f"Retrying batch {batch_number} in {delay}s after error: {str(e)}")
+            await asyncio.sleep(delay)
+
+async def upload_documents(
+    documents: AsyncIterator[Dict[str, Any]],
+    api_url: str,
+    batch_size: int = 50,
+    concurrency: int = 4,
+    max_retries: int = 3,
+    stats: Optional[IngestionStats] = None
+) -> IngestionStats:
+    """
+    Upload a stream of documents to the vector database via the API.
+    
+    Batches are posted concurrently over a pooled client. Once `concurrency`
+    batches are in flight, reading from the stream pauses until one finishes.
+    
+    Args:
+        documents: Async iterator of document dictionaries
+        api_url: URL of the API
+        batch_size: Documents per request
+        concurrency: Maximum number of requests in flight
+        max_retries: Attempts per batch after the first failure
+        stats: Counters to update, created if not given
+        
+    Returns:
+        The ingestion counters
+    """
+    stats = stats or IngestionStats()
+    slots = asyncio.Semaphore(concurrency)
+    tasks = set()
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    
+    async with httpx.AsyncClient(timeout=60.0, limits=limits) as client:
+        async def send(batch: List[Dict[str, Any]], batch_number: int):
+            try:
+                await _post_batch(client, f"{api_url}/documents", batch, batch_number, max_retries, stats)
+            finally:
+                slots.release()
+        
+        async def dispatch(batch: List[Dict[str, Any]]):
+            # Backpressure: wait for a free slot before taking more input
+            await slots.acquire()
+            stats.batches += 1
+            logger.info(f"Uploading batch {stats.batches} ({len(batch)} documents)")
+            task = asyncio.ensure_future(send(batch, stats.batches))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        
+        batch = []
+        async for document in documents:
+            batch.append(document)
+            if len(batch) >= batch_size:
+                await dispatch(batch)
+                batch = []
+        if batch:
+            await dispatch(batch)
+        
+        if tasks:
+            await asyncio.gather(*tasks)
+    
+    return stats
+
 async def upload_to_vector_db(documents: List[Dict[str, Any]], api_url: str) -> None:
     """
     Upload documents to the vector database via the API.
@@ -88,36 +513,52 @@ async def upload_to_vector_db(documents: List[Dict[str, Any]], api_url: str) ->
     """
     logger.info(f"Uploading {len(documents)} documents to vector database")
     
-    # Split into batches to avoid large requests
-    batch_size = 50
-    batches = [documents[i:i + batch_size] for i in range(0, len(documents), batch_size)]
+    async def iterate():
+        for document in documents:
+            yield document
     
-    async with httpx.AsyncClient(timeout=60.0) as client:
-        for i, batch in enumerate(batches):
-            try:
-                logger.info(f"Uploading batch {i+1}/{len(batches)} ({len(batch)} documents)")
-                response = await client.post(
-                    f"{api_url}/documents",
-                    json={"documents": batch}
-                )
-                response.raise_for_status()
-                logger.info(f"Successfully uploaded batch {i+1}")
-            except Exception as e:
-                logger.error(f"Error uploading batch {i+1}: {str(e)}")
+    stats = await upload_documents(iterate(), api_url)
+    logger.info(f"Upload report: {json.dumps(stats.report())}")
 
 async def main():
     parser = argparse.ArgumentParser(description="Load documents into the vector database")
     parser.add_argument("--dir", type=str, required=True, help="Directory containing documents")
     parser.add_argument("--api-url", type=str, default="http://localhost:8000", help="API URL")
+    parser.add_argument("--workers", type=int, default=None, help="Parser processes (default: CPU count)")
+    parser.add_argument("--batch-size", type=int, default=50, help="Documents per upload request")
+    parser.add_argument("--concurrency", type=int, default=4, help="Upload requests in flight")
+    parser.add_argument("--max-retries", type=int, default=3, help="Retries per failed batch")
+    parser.add_argument("--manifest", type=str, default=None,
+                        help="Ingestion manifest path (default: <dir>/.ingest_manifest.json)")
+    parser.add_argument("--full", action="store_true",
+                        help="Upload every file without reading or updating the manifest")
     args = parser.parse_args()
     
-    # Load documents
-    documents = load_documents(args.dir)
-    
-    # Upload to vector database
-    await upload_to_vector_db(documents, args.api_url)
+    if args.full:
+        # Parse, chunk and upload everything as a single stream
+        stats = IngestionStats()
+        chunks = iter_document_chunks(args.dir, workers=args.workers, stats=stats)
+        await upload_documents(
+            chunks,
+            args.api_url,
+            batch_size=args.batch_size,
+            concurrency=args.concurrency,
+            max_retries=args.max_retries,
+            stats=stats
+        )
+    else:
+        # Only changed files are parsed, embedded and uploaded
+        stats = await sync_directory(
+            args.dir,
+            args.api_url,
+            args.manifest or os.path.join(args.dir, ".ingest_manifest.json"),
+            workers=args.workers,
+            batch_size=args.batch_size,
+            concurrency=args.concurrency,
+            max_retries=args.max_retries
+        )
     
-    logger.info("Document loading complete")
+    logger.info(f"Document loading complete: {json.dumps(stats.report())}")
 
 if __name__ == "__main__":
-    asyncio.run(main()) 
\ No newline at end of file
+    asyncio.run(main())
@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+"""
+Offline benchmarks for the RAG hot path.
+
+Builds synthetic corpora of increasing size and drives the API in-process
+through an ASGI transport, with the numpy vector store and the Simple LLM
+service, so no GPU, Chroma server or network is needed. Results are written
+as JSON and compared against a saved baseline.
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import platform
+import argparse
+import tempfile
+from datetime import datetime
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Benchmark the uncached hot path against the in-process backends
+os.environ["VECTOR_DB_BACKEND"] = "numpy"
+os.environ.setdefault("SIMPLE_LLM_DELAY", "0")
+os.environ.setdefault("RESPONSE_CACHE_ENABLED", "false")
+
+import httpx
+
+from app.api.main_local import app
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+def percentile(values, q):
+    """q-th percentile of a list of latencies, in the same unit"""
+    return float(np.percentile(values, q)) if values else 0.0
+
+class SyntheticCorpus:
+    """Deterministic documents and queries over a Zipf-distributed vocabulary"""
+
+    def __init__(self, seed=42, vocabulary_size=5000):
+        self.rng = np.random.default_rng(seed)
+        syllables = ["ka", "lo", "mi", "ren", "tu", "sa", "vel", "or", "pi", "dan", "qua", "ex"]
+        self.vocabulary = [
+            "".join(self.rng.choice(syllables, size=self.rng.integers(2, 5)))
+            for _ in range(vocabulary_size)
+        ]
+        weights = 1.0 / np.arange(1, vocabulary_size + 1)
+        self.weights = weights / weights.sum()
+
+    def _text(self, min_words, max_words):
+        words = self.rng.choice(self.vocabulary, size=self.rng.integers(min_words, max_words), p=self.weights)
+        return " ".join(words)
+
+    def documents(self, count, offset=0):
+        return [
+            {"id": f"doc-{offset + i}", "text": self._text(60, 160), "metadata": {"source": "synthetic"}}
+            for i in range(count)
+        ]
+
+    def queries(self, count):
+        # Unique queries, so the query embedding cache does not hide embedding cost
+        return [f"{self._text(4, 10)} {i}" for i in range(count)]
+
+async def benchmark_embedding(vector_db, corpus, count, batch_size):
+    """Document embedding throughput, outside of the vector store"""
+    texts = [doc["text"] for doc in corpus.documents(count)]
+    vector_db.embedding_service.embed(texts[:batch_size])  # warm up
+
+    start = time.perf_counter()
+    for i in range(0, len(texts), batch_size):
+        vector_db.embedding_service.embed(texts[i:i + batch_size])
+    seconds = time.perf_counter() - start
+    return {"embedding.docs_per_sec": count / seconds}
+
+async def benchmark_ingestion(client, corpus, size, chunk_docs=1000):
+    """End-to-end ingestion rate through the streamed bulk endpoint"""
+    async def body():
+        for offset in range(0, size, chunk_docs):
+            documents = corpus.documents(min(chunk_docs, size - offset), offset)
+            yield "".join(json.dumps(doc) + "\n" for doc in documents).encode()
+
+    start = time.perf_counter()
+    response = await client.post(
+        "/documents/bulk", content=body(), headers={"Content-Type": "application/x-ndjson"}
+    )
+    seconds = time.perf_counter() - start
+    response.raise_for_status()
+    return {f"ingest.{size}.docs_per_sec": size / seconds}
+
+async def benchmark_retrieval(vector_db, corpus, size, queries, concurrency, n_results):
+    """Retrieval latency one query at a time, and throughput with concurrent queries"""
+    await vector_db.query(corpus.queries(1)[0], n_results)  # warm up
+
+    latencies = []
+    for query in corpus.queries(queries):
+        start = time.perf_counter()
+        await vector_db.query(query, n_results)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    pending = corpus.queries(queries)
+    async def worker():
+        while pending:
+            await vector_db.query(pending.pop(), n_results)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    seconds = time.perf_counter() - start
+
+    return {
+        f"retrieval.{size}.p50_ms": percentile(latencies, 50),
+        f"retrieval.{size}.p99_ms": percentile(latencies, 99),
+        f"retrieval.{size}.concurrent_queries_per_sec": queries / seconds,
+    }
+
+async def benchmark_chat(client, corpus, size, requests):
+    """
+    /chat latency with an instant LLM, and the server overhead around the
+    timed steps (routing, validation, middleware, serialization).
+    """
+    latencies = []
+    overheads = []
+    for query in corpus.queries(requests):
+        start = time.perf_counter()
+        response = await client.post(
+            "/chat",
+            json={"messages": [{"role": "user", "content": query}], "include_timing": True}
+        )
+        latency = (time.perf_counter() - start) * 1000
+        response.raise_for_status()
+
+        timing = response.json()["timing"]
+        steps = sum(ms for step, ms in timing.items() if step not in ("total", "time_to_first_token"))
+        latencies.append(latency)
+        overheads.append(latency - steps)
+
+    return {
+        f"chat.{size}.p50_ms": percentile(latencies, 50),
+        f"chat.{size}.p99_ms": percentile(latencies, 99),
+        f"chat.{size}.overhead_p50_ms": percentile(overheads, 50),
+        f"chat.{size}.overhead_p99_ms": percentile(overheads, 99),
+    }
+
+async def run_size(args, corpus, size, results):
+    """Run the benchmarks against a fresh index of the given size"""
+    print(f"Corpus size {size}...")
+    with tempfile.TemporaryDirectory() as index_directory:
+        os.environ["NUMPY_INDEX_DIRECTORY"] = index_directory
+        async with app.router.lifespan_context(app):
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+                vector_db = app.state.vector_db
+                if "embedding.docs_per_sec" not in results:
+                    results.update(await benchmark_embedding(
+                        vector_db, corpus, args.embedding_docs, args.embedding_batch_size
+                    ))
+                results.update(await benchmark_ingestion(client, corpus, size))
+                results.update(await benchmark_retrieval(
+                    vector_db, corpus, size, args.queries, args.concurrency, args.n_results
+                ))
+                results.update(await benchmark_chat(client, corpus, size, args.chat_requests))
+
+def direction(metric):
+    """+1 when higher is better, -1 when lower is better"""
+    return 1 if metric.endswith("_per_sec") else -1
+
+def compare(results, baseline, max_regression):
+    """
+    Print the change of every metric against the baseline.
+
+    Returns:
+        The metrics that regressed by more than max_regression (a fraction)
+    """
+    regressions = []
+    print(f"\n{'metric':<42} {'baseline':>12} {'current':>12} {'change':>9}")
+    for metric, value in sorted(results.items()):
+        if metric not in baseline:
+            print(f"{metric:<42} {'-':>12} {value:>12.3f} {'new':>9}")
+            continue
+        previous = baseline[metric]
+        change = (value - previous) / previous if previous else 0.0
+        regressed = direction(metric) * change < -max_regression
+        if regressed:
+            regressions.append(metric)
+        print(f"{metric:<42} {previous:>12.3f} {value:>12.3f} {change:>+8.1%}{' !' if regressed else ''}")
+    return regressions
+
+async def main_async(args):
+    corpus = SyntheticCorpus(seed=args.seed)
+    results = {}
+    for size in args.sizes:
+        await run_size(args, corpus, size, results)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the RAG hot path in-process")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000],
+                        help="Corpus sizes to benchmark")
+    parser.add_argument("--queries", type=int, default=200, help="Retrieval queries per corpus size")
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent retrieval queries")
+    parser.add_argument("--n-results", type=int, default=3, help="Documents retrieved per query")
+    parser.add_argument("--chat-requests", type=int, default=100, help="/chat requests per corpus size")
+    parser.add_argument("--embedding-docs", type=int, default=2000, help="Documents for the embedding benchmark")
+    parser.add_argument("--embedding-batch-size", type=int, default=64, help="Embedding batch size")
+    parser.add_argument("--seed", type=int, default=42, help="Seed of the synthetic corpus")
+    parser.add_argument("--output", default="benchmark_results.json", help="Where to write the results")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Baseline results to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="Save these results as the new baseline")
+    parser.add_argument("--max-regression", type=float, default=0.15,
+                        help="Fail when a metric is worse than the baseline by more than this fraction")
+    args = parser.parse_args()
+
+    # The app logs every request at INFO, which would dominate the timings
+    logging.getLogger().setLevel(logging.WARNING)
+    results = asyncio.run(main_async(args))
+
+    report = {
+        "metadata": {
+            "timestamp": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "embedding_model": os.environ.get("EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2"),
+            "sizes": args.sizes,
+        },
+        "metrics": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Saved benchmark results to {args.output}")
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved baseline to {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; run with --save-baseline to create one")
+        return
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)["metrics"]
+    regressions = compare(results, baseline, args.max_regression)
+    if regressions:
+        print(f"\n{len(regressions)} metric(s) regressed by more than {args.max_regression:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+    print("\nNo regressions against the baseline")
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
 import time
 import json
+import uuid
 import random
 from locust import HttpUser, task, between
 
@@ -31,7 +32,8 @@ class ChatbotUser(HttpUser):
         Initialize the user session.
         """
         self.client.headers = {'Content-Type': 'application/json'}
-        self.conversation_history = []
+        # The server keeps the conversation history for this session
+        self.session_id = uuid.uuid4().hex
     
     @task(10)
     def ask_question(self):
@@ -42,16 +44,10 @@ class ChatbotUser(HttpUser):
         # Select a random question
         question = random.choice(SAMPLE_QUESTIONS)
         
-        # Add to conversation history
-        self.conversation_history.append({"role": "user", "content": question})
-        
-        # Keep only the last 5 messages to avoid large payloads
-        if len(self.conversation_history) > 5:
-            self.conversation_history = self.conversation_history[-5:]
-        
-        # Prepare request payload
+        # Prepare request payload; only the new message is sent
         payload = {
-            "messages": self.conversation_history,
+            "messages": [{"role": "user", "content": question}],
+            "session_id": self.session_id,
             "use_rag": True,
             "temperature": 0.7,
             "max_tokens": 1024
@@ -69,9 +65,6 @@ class ChatbotUser(HttpUser):
                     
                     # Check if response contains expected fields
                     if "response" in data:
-                        # Add assistant response to conversation history
-                        self.conversation_history.append({"role": "assistant", "content": data["response"]})
-                        
                         # No need to manually track response time, Locust does this automatically
                         
                         # Mark as success
@@ -0,0 +1,266 @@
+"""
+Open-loop, corpus-driven workload for the chatbot API.
+
+Unlike locustfile.py, where each user waits for its answer before asking
+again, requests arrive at a fixed (or ramped) rate regardless of how fast the
+server answers, so overload shows up as growing latency and dropped arrivals
+instead of a silently lower request rate. Questions are drawn from the loaded
+corpus with a Zipf skew, so caches see a realistic mix of repeated and unique
+queries.
+
+Example:
+    locust -f locust/locustfile_open_loop.py --host=http://localhost:8000 --headless \\
+        -u 1 -r 1 -t 5m --corpus=corpus.jsonl --arrival-rate=20 --stream-ratio=0.5
+"""
+
+import os
+import re
+import json
+import time
+import random
+import logging
+from typing import List, Tuple
+
+from gevent.pool import Pool
+from locust import HttpUser, task, constant, events
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+@events.init_command_line_parser.add_listener
+def add_arguments(parser):
+    group = parser.add_argument_group("Open-loop workload")
+    group.add_argument("--corpus", type=str, env_var="LOCUST_CORPUS", default="",
+                       help="Documents to draw questions from: NDJSON/JSON as accepted by /documents, or a directory of .txt/.md files")
+    group.add_argument("--zipf-skew", type=float, env_var="LOCUST_ZIPF_SKEW", default=1.0,
+                       help="Zipf exponent of question popularity (0 = uniform)")
+    group.add_argument("--query-words", type=int, env_var="LOCUST_QUERY_WORDS", default=12,
+                       help="Maximum words per question")
+    group.add_argument("--arrival-rate", type=float, env_var="LOCUST_ARRIVAL_RATE", default=5.0,
+                       help="Requests per second across all users (the rate reached after the ramp)")
+    group.add_argument("--arrival-rate-start", type=float, env_var="LOCUST_ARRIVAL_RATE_START", default=None,
+                       help="Requests per second at the start of the ramp (defaults to --arrival-rate)")
+    group.add_argument("--ramp-seconds", type=float, env_var="LOCUST_RAMP_SECONDS", default=0.0,
+                       help="Seconds to ramp linearly from --arrival-rate-start to --arrival-rate")
+    group.add_argument("--arrival-process", choices=["poisson", "constant"], env_var="LOCUST_ARRIVAL_PROCESS",
+                       default="poisson", help="Exponential or fixed gaps between arrivals")
+    group.add_argument("--max-in-flight", type=int, env_var="LOCUST_MAX_IN_FLIGHT", default=500,
+                       help="Requests in flight per user; arrivals beyond it are recorded as dropped")
+    group.add_argument("--history-turns", type=str, env_var="LOCUST_HISTORY_TURNS", default="0",
+                       help="Earlier turns sent with each question, N or MIN-MAX")
+    group.add_argument("--max-tokens", type=str, env_var="LOCUST_MAX_TOKENS", default="1024",
+                       help="max_tokens of each request, N or MIN-MAX")
+    group.add_argument("--temperature", type=float, env_var="LOCUST_TEMPERATURE", default=0.7,
+                       help="Sampling temperature of each request")
+    group.add_argument("--stream-ratio", type=float, env_var="LOCUST_STREAM_RATIO", default=0.0,
+                       help="Fraction of requests sent to /chat/stream")
+    group.add_argument("--seed", type=int, env_var="LOCUST_SEED", default=42,
+                       help="Seed for deriving questions from the corpus")
+
+def parse_range(value: str) -> Tuple[int, int]:
+    """Parse "N" or "MIN-MAX" into an inclusive (min, max) range"""
+    low, _, high = value.partition("-")
+    return int(low), int(high or low)
+
+def load_corpus(path: str) -> List[str]:
+    """Load document texts from an NDJSON/JSON file or a directory of text files"""
+    if os.path.isdir(path):
+        texts = []
+        for root, _, files in os.walk(path):
+            for name in sorted(files):
+                if os.path.splitext(name)[1].lower() in (".txt", ".md"):
+                    with open(os.path.join(root, name), encoding="utf-8", errors="ignore") as f:
+                        texts.extend(p.strip() for p in f.read().split("\n\n") if p.strip())
+        return texts
+
+    with open(path, encoding="utf-8") as f:
+        content = f.read()
+    if path.endswith((".jsonl", ".ndjson")):
+        documents = [json.loads(line) for line in content.splitlines() if line.strip()]
+    else:
+        documents = json.loads(content)
+        if isinstance(documents, dict):
+            documents = documents["documents"]
+    return [doc["text"] for doc in documents if doc.get("text")]
+
+class Workload:
+    """Questions derived from the corpus, ranked by popularity"""
+
+    def __init__(self, texts: List[str], query_words: int, zipf_skew: float, seed: int):
+        rng = random.Random(seed)
+        self.questions = []
+        self.answers = []
+        for text in texts:
+            sentences = [s.split() for s in re.split(r"(?<=[.!?])\s+", text) if len(s.split()) >= 4]
+            if not sentences:
+                continue
+            self.questions.append(" ".join(rng.choice(sentences)[:query_words]))
+            self.answers.append(" ".join(text.split()[:60]))
+        if not self.questions:
+            raise ValueError("The corpus has no text to derive questions from")
+
+        # Popularity rank is independent of the corpus order
+        order = list(range(len(self.questions)))
+        rng.shuffle(order)
+        self.questions = [self.questions[i] for i in order]
+        self.answers = [self.answers[i] for i in order]
+
+        weights = [1.0 / (rank ** zipf_skew) for rank in range(1, len(self.questions) + 1)]
+        self.cum_weights = []
+        total = 0.0
+        for weight in weights:
+            total += weight
+            self.cum_weights.append(total)
+        self.population = list(range(len(self.questions)))
+
+    def sample(self) -> int:
+        return random.choices(self.population, cum_weights=self.cum_weights)[0]
+
+    def messages(self, history_turns: int) -> List[dict]:
+        """Earlier turns followed by the new question"""
+        messages = []
+        for _ in range(history_turns):
+            index = self.sample()
+            messages.append({"role": "user", "content": self.questions[index]})
+            messages.append({"role": "assistant", "content": self.answers[index]})
+        messages.append({"role": "user", "content": self.questions[self.sample()]})
+        return messages
+
+workload = None
+
+@events.init.add_listener
+def on_init(environment, **kwargs):
+    global workload
+    options = environment.parsed_options
+    if options is None or not options.corpus:
+        logger.error("The open-loop workload needs a corpus: pass --corpus")
+        return
+    workload = Workload(load_corpus(options.corpus), options.query_words, options.zipf_skew, options.seed)
+    logger.info(f"Loaded {len(workload.questions)} questions from {options.corpus}")
+
+def fire_metric(environment, name: str, value: float, exception=None):
+    """Record a custom measurement; the value shows up in the response time columns"""
+    environment.events.request.fire(
+        request_type="METRIC",
+        name=name,
+        response_time=value,
+        response_length=0,
+        exception=exception,
+        context={},
+    )
+
+class OpenLoopUser(HttpUser):
+    """
+    Issues requests at the configured arrival rate, each in its own greenlet,
+    without waiting for earlier answers. The rate is shared across users, so
+    -u only spreads the load (e.g. across workers).
+    """
+    wait_time = constant(0)
+
+    def on_start(self):
+        options = self.environment.parsed_options
+        if workload is None:
+            raise RuntimeError("The open-loop workload needs a corpus: pass --corpus")
+        self.client.headers = {"Content-Type": "application/json"}
+        # Allow one pooled connection per in-flight request
+        self.client.mount(self.host, HTTPAdapter(pool_connections=1, pool_maxsize=options.max_in_flight))
+        self.pool = Pool(options.max_in_flight)
+        self.started = time.monotonic()
+        self.users = max(getattr(options, "num_users", None) or 1, 1)
+
+    def on_stop(self):
+        self.pool.kill(block=False)
+
+    def arrival_rate(self) -> float:
+        """Requests per second of this user at the current time"""
+        options = self.environment.parsed_options
+        start_rate = options.arrival_rate_start if options.arrival_rate_start is not None else options.arrival_rate
+        elapsed = time.monotonic() - self.started
+        if options.ramp_seconds > 0 and elapsed < options.ramp_seconds:
+            rate = start_rate + (options.arrival_rate - start_rate) * elapsed / options.ramp_seconds
+        else:
+            rate = options.arrival_rate
+        return rate / self.users
+
+    @task
+    def arrivals(self):
+        options = self.environment.parsed_options
+        next_arrival = time.monotonic()
+        while True:
+            rate = max(self.arrival_rate(), 1e-3)
+            gap = random.expovariate(rate) if options.arrival_process == "poisson" else 1.0 / rate
+            # Schedule from the previous arrival, so a late wakeup does not lower the rate
+            next_arrival += gap
+            time.sleep(max(next_arrival - time.monotonic(), 0))
+
+            if self.pool.full():
+                fire_metric(self.environment, "arrival_dropped", 0, Exception("Too many requests in flight"))
+                continue
+            self.pool.spawn(self.send_request)
+
+    def payload(self) -> dict:
+        options = self.environment.parsed_options
+        return {
+            "messages": workload.messages(random.randint(*parse_range(options.history_turns))),
+            "use_rag": True,
+            "temperature": options.temperature,
+            "max_tokens": random.randint(*parse_range(options.max_tokens)),
+        }
+
+    def send_request(self):
+        if random.random() < self.environment.parsed_options.stream_ratio:
+            self.stream_chat()
+        else:
+            self.chat()
+
+    def chat(self):
+        with self.client.post("/chat", json=self.payload(), catch_response=True) as response:
+            if response.status_code != 200:
+                response.failure(f"Request failed with status code: {response.status_code}")
+                return
+            try:
+                if "response" in response.json():
+                    response.success()
+                else:
+                    response.failure(f"Invalid response format: {response.text[:200]}")
+            except json.JSONDecodeError:
+                response.failure("Response could not be decoded as JSON")
+
+    def stream_chat(self):
+        """
+        Stream a response and record time to first token and tokens/sec.
+        Tokens are counted as streamed chunks.
+        """
+        start = time.perf_counter()
+        with self.client.post("/chat/stream", json=self.payload(), stream=True, catch_response=True) as response:
+            if response.status_code != 200:
+                response.failure(f"Request failed with status code: {response.status_code}")
+                return
+
+            first_token = None
+            tokens = 0
+            try:
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    event = json.loads(line)
+                    if event["type"] == "token":
+                        if first_token is None:
+                            first_token = time.perf_counter()
+                        tokens += 1
+                    elif event["type"] == "error":
+                        response.failure(f"Stream error: {event.get('detail')}")
+                        return
+            except (json.JSONDecodeError, KeyError) as e:
+                response.failure(f"Invalid stream event: {str(e)}")
+                return
+
+            end = time.perf_counter()
+            # Record the whole stream, not just the time to the response headers
+            response.request_meta["response_time"] = (end - start) * 1000
+            response.success()
+
+        if first_token is not None:
+            fire_metric(self.environment, "time_to_first_token", (first_token - start) * 1000)
+            if tokens > 1 and end > first_token:
+                fire_metric(self.environment, "tokens_per_second", (tokens - 1) / (end - first_token))
@@ -9,6 +9,9 @@ import matplotlib.pyplot as plt
 import seaborn as sns
 import glob
 import os
+import sys
+import json
+import math
 import argparse
 from datetime import datetime
 
@@ -213,12 +216,254 @@ def generate_comparison_chart(test_dirs, output_dir):
     print(f"Saved test comparison chart to {output_file}")
     plt.close()
 
+# Run-over-run comparison
+COMPARE_COLUMNS = ['User Count', 'Name', 'Requests/s', '50%', '95%', '99%']
+COMPARE_PERCENTILES = ['50%', '95%', '99%']
+
+def find_run(results_dir, run):
+    """Resolve a run name (e.g. medium_load) or a path to its stats_history.csv"""
+    if os.path.exists(run):
+        return run
+    return os.path.join(results_dir, f"{run}_stats_history.csv")
+
+def run_name(file_path):
+    return os.path.basename(file_path).replace("_stats_history.csv", "")
+
+def load_run(file_path, endpoint, align_by, rps_bin, window_rows=10):
+    """
+    Load the per-interval percentiles of one endpoint, reading only the
+    columns the comparison needs, with an alignment level per row.
+
+    Locust writes a row every second, but its percentiles cover a rolling
+    window of several seconds, so consecutive rows share most of their
+    requests. Only every window_rows-th row is marked 'independent' and used
+    by the significance test.
+    """
+    df = pd.read_csv(file_path, usecols=COMPARE_COLUMNS, na_values=['N/A'])
+    df = df[df['Name'] == endpoint].dropna(subset=COMPARE_PERCENTILES)
+    df['independent'] = [i % max(window_rows, 1) == 0 for i in range(len(df))]
+    # Skip intervals before the first response
+    df = df[df['Requests/s'] > 0].copy()
+
+    if align_by == 'users':
+        df['level'] = df['User Count']
+    else:
+        df['level'] = (df['Requests/s'] / rps_bin).round() * rps_bin
+    return df
+
+def mann_whitney_greater(baseline, candidate):
+    """
+    One-sided Mann-Whitney U test that candidate values tend to be larger
+    than baseline values (normal approximation with tie correction).
+
+    Returns:
+        The p-value
+    """
+    n1, n2 = len(baseline), len(candidate)
+    n = n1 + n2
+    ranks = pd.concat([baseline, candidate], ignore_index=True).rank(method='average')
+    u = ranks.iloc[n1:].sum() - n2 * (n2 + 1) / 2
+
+    ties = ranks.value_counts()
+    tie_term = ((ties ** 3 - ties).sum()) / (n * (n - 1))
+    sigma = math.sqrt(n1 * n2 / 12 * ((n + 1) - tie_term))
+    if sigma == 0:
+        return 1.0
+    z = (u - n1 * n2 / 2 - 0.5) / sigma
+    return 0.5 * math.erfc(z / math.sqrt(2))
+
+def throughput_at_slo(df, slo_column, slo_ms):
+    """Highest median Requests/s over the levels whose median latency meets the SLO"""
+    levels = df.groupby('level')[[slo_column, 'Requests/s']].median()
+    within = levels[levels[slo_column] <= slo_ms]
+    return float(within['Requests/s'].max()) if not within.empty else 0.0
+
+def compare_run(baseline_df, candidate_df, args):
+    """Compare one candidate run against the baseline, level by level"""
+    slo_column = f"{args.slo_percentile}%"
+    levels = []
+    regressions = []
+    improvements = []
+    tested = False
+
+    for level in sorted(set(baseline_df['level']) & set(candidate_df['level'])):
+        base = baseline_df[baseline_df['level'] == level]
+        cand = candidate_df[candidate_df['level'] == level]
+        # Medians use every interval; the test only non-overlapping windows
+        base_test = base[base['independent']]
+        cand_test = cand[cand['independent']]
+        entry = {
+            'level': float(level),
+            'intervals': {'baseline': len(base), 'candidate': len(cand)},
+            'samples': {'baseline': len(base_test), 'candidate': len(cand_test)},
+        }
+
+        for column in COMPARE_PERCENTILES:
+            base_ms = float(base[column].median())
+            cand_ms = float(cand[column].median())
+            delta_pct = (cand_ms - base_ms) / base_ms if base_ms else 0.0
+            enough = min(len(base_test), len(cand_test)) >= args.min_samples
+            tested = tested or enough
+            p_slower = mann_whitney_greater(base_test[column], cand_test[column]) if enough else None
+            p_faster = mann_whitney_greater(cand_test[column], base_test[column]) if enough else None
+
+            regression = p_slower is not None and p_slower < args.alpha and delta_pct > args.min_effect
+            if regression:
+                regressions.append(f"p{column[:-1]}@{level:g}")
+            elif p_faster is not None and p_faster < args.alpha and delta_pct < -args.min_effect:
+                improvements.append(f"p{column[:-1]}@{level:g}")
+
+            entry[f"p{column[:-1]}"] = {
+                'baseline_ms': base_ms,
+                'candidate_ms': cand_ms,
+                'delta_ms': cand_ms - base_ms,
+                'delta_pct': delta_pct,
+                'p_value': p_slower,
+                'regression': regression,
+            }
+        levels.append(entry)
+
+    base_throughput = throughput_at_slo(baseline_df, slo_column, args.slo_ms)
+    cand_throughput = throughput_at_slo(candidate_df, slo_column, args.slo_ms)
+    throughput_delta = (cand_throughput - base_throughput) / base_throughput if base_throughput else 0.0
+    if throughput_delta < -args.min_effect:
+        regressions.append('throughput_at_slo')
+    elif throughput_delta > args.min_effect:
+        improvements.append('throughput_at_slo')
+
+    if regressions:
+        verdict = 'regression'
+    elif not tested:
+        # Too short to tell latency changes from noise
+        verdict = 'inconclusive'
+    elif improvements:
+        verdict = 'improvement'
+    else:
+        verdict = 'no_change'
+
+    return {
+        'verdict': verdict,
+        'regressions': regressions,
+        'improvements': improvements,
+        'throughput_at_slo': {
+            'baseline_rps': base_throughput,
+            'candidate_rps': cand_throughput,
+            'delta_pct': throughput_delta,
+        },
+        'levels': levels,
+    }
+
+def generate_level_comparison_chart(runs, column, output_dir, align_by):
+    """Plot a latency percentile against the alignment level for every run"""
+    plt.figure()
+    for name, df in runs.items():
+        levels = df.groupby('level')[column].median()
+        plt.plot(levels.index, levels.values, marker='o', label=name)
+
+    plt.title(f"p{column[:-1]} Response Time by {'User Count' if align_by == 'users' else 'Requests/s'}")
+    plt.xlabel('Users' if align_by == 'users' else 'Requests/s')
+    plt.ylabel('Response Time (ms)')
+    plt.legend()
+    plt.grid(True)
+    plt.tight_layout()
+
+    output_file = os.path.join(output_dir, f"comparison_p{column[:-1]}_by_{align_by}.png")
+    plt.savefig(output_file, dpi=300)
+    print(f"Saved level comparison chart to {output_file}")
+    plt.close()
+
+def compare_results(args):
+    """
+    Compare runs against a baseline run and write a machine-readable verdict.
+
+    Returns:
+        True if any run regressed
+    """
+    baseline_file = find_run(args.results_dir, args.baseline)
+    if args.runs:
+        candidate_files = [find_run(args.results_dir, run) for run in args.runs]
+    else:
+        candidate_files = [
+            f for f in sorted(glob.glob(f"{args.results_dir}/*_stats_history.csv"))
+            if os.path.abspath(f) != os.path.abspath(baseline_file)
+        ]
+
+    baseline_df = load_run(baseline_file, args.endpoint, args.align_by, args.rps_bin, args.window_rows)
+    runs = {run_name(baseline_file): baseline_df}
+    results = {}
+    for candidate_file in candidate_files:
+        name = run_name(candidate_file)
+        runs[name] = load_run(candidate_file, args.endpoint, args.align_by, args.rps_bin, args.window_rows)
+        results[name] = compare_run(baseline_df, runs[name], args)
+
+        result = results[name]
+        throughput = result['throughput_at_slo']
+        print(f"\n{name} vs {run_name(baseline_file)}: {result['verdict'].upper()}")
+        print(f"  Throughput at p{args.slo_percentile} <= {args.slo_ms:g}ms: "
+              f"{throughput['baseline_rps']:.2f} -> {throughput['candidate_rps']:.2f} req/s "
+              f"({throughput['delta_pct']:+.1%})")
+        for entry in result['levels']:
+            deltas = ", ".join(
+                f"p{column[:-1]} {entry[f'p{column[:-1]}']['delta_pct']:+.1%}"
+                f"{' !' if entry[f'p{column[:-1]}']['regression'] else ''}"
+                for column in COMPARE_PERCENTILES
+            )
+            print(f"  {args.align_by}={entry['level']:g} (n={entry['samples']['candidate']}): {deltas}")
+
+    regressed = any(result['verdict'] == 'regression' for result in results.values())
+    verdict = {
+        'generated_at': datetime.now().isoformat(),
+        'baseline': run_name(baseline_file),
+        'endpoint': args.endpoint,
+        'align_by': args.align_by,
+        'slo': {'percentile': args.slo_percentile, 'ms': args.slo_ms},
+        'alpha': args.alpha,
+        'min_effect': args.min_effect,
+        'window_rows': args.window_rows,
+        'verdict': 'regression' if regressed else 'pass',
+        'runs': results,
+    }
+    with open(args.verdict_file, 'w') as f:
+        json.dump(verdict, f, indent=2)
+    print(f"\nSaved verdict to {args.verdict_file}")
+
+    for column in COMPARE_PERCENTILES:
+        generate_level_comparison_chart(runs, column, args.output_dir, args.align_by)
+    return regressed
+
 def main():
     parser = argparse.ArgumentParser(description="Generate charts from Locust test results")
     parser.add_argument('--results-dir', default='load_test_reports',
                         help='Directory containing load test results')
     parser.add_argument('--output-dir', default='load_test_charts',
                         help='Directory to save charts')
+
+    # Comparison mode
+    parser.add_argument('--compare', action='store_true',
+                        help='Compare runs against a baseline run instead of charting each run')
+    parser.add_argument('--baseline',
+                        help='Baseline run name (e.g. medium_load) or path to its stats_history.csv')
+    parser.add_argument('--runs', nargs='+',
+                        help='Runs to compare (default: every other run in the results directory)')
+    parser.add_argument('--endpoint', default='/chat', help='Endpoint to compare')
+    parser.add_argument('--align-by', choices=['users', 'rps'], default='users',
+                        help='Align runs on user count or on achieved requests/s')
+    parser.add_argument('--rps-bin', type=float, default=1.0,
+                        help='Width of the requests/s bins when aligning by rps')
+    parser.add_argument('--slo-percentile', type=int, choices=[50, 95, 99], default=95,
+                        help='Latency percentile of the SLO')
+    parser.add_argument('--slo-ms', type=float, default=1000,
+                        help='Latency SLO in milliseconds')
+    parser.add_argument('--alpha', type=float, default=0.05,
+                        help='Significance level of the regression test')
+    parser.add_argument('--min-effect', type=float, default=0.05,
+                        help='Smallest relative change reported as a regression')
+    parser.add_argument('--min-samples', type=int, default=5,
+                        help='Non-overlapping windows per run and level needed to test a level')
+    parser.add_argument('--window-rows', type=int, default=10,
+                        help='Rows per percentile window; only every N-th row is tested (Locust: 10)')
+    parser.add_argument('--verdict-file', default='load_test_reports/verdict.json',
+                        help='Where to write the comparison verdict')
     args = parser.parse_args()
 
     # Create output directory
@@ -227,6 +472,12 @@ def main():
     # Setup plot styling
     setup_styling()
 
+    if args.compare:
+        if not args.baseline:
+            parser.error('--compare requires --baseline')
+        regressed = compare_results(args)
+        sys.exit(1 if regressed else 0)
+
     # Find all stats_history.csv files directly
     csv_files = glob.glob(f"{args.results_dir}/*_stats_history.csv")
 
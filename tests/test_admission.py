@@ -0,0 +1,37 @@
+import asyncio
+
+import pytest
+
+from app.api.admission import AdmissionController, AdmissionRejected
+
+def test_queues_when_service_time_is_just_above_the_deadline():
+    async def scenario():
+        controller = AdmissionController("chat", max_concurrency=4, max_queue=4, queue_timeout=1.0)
+        controller._service_time = 1.2
+        for _ in range(4):
+            await controller.acquire()
+
+        # All slots are busy, but one of four frees up well within the deadline
+        waiter = asyncio.ensure_future(controller.acquire())
+        await asyncio.sleep(0.05)
+        assert not waiter.done()
+        assert controller.get_stats()["queued"] == 1
+
+        controller.release(1.2)
+        await asyncio.wait_for(waiter, timeout=1.0)
+        assert controller.get_stats()["rejected"]["predicted_timeout"] == 0
+
+    asyncio.run(scenario())
+
+def test_rejects_when_the_queue_cannot_drain_in_time():
+    async def scenario():
+        controller = AdmissionController("chat", max_concurrency=1, max_queue=4, queue_timeout=1.0)
+        controller._service_time = 1.2
+        await controller.acquire()
+
+        with pytest.raises(AdmissionRejected) as rejected:
+            await controller.acquire()
+        assert rejected.value.status_code == 503
+        assert rejected.value.reason == "predicted_timeout"
+
+    asyncio.run(scenario())
@@ -0,0 +1,69 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("langchain_community.document_loaders")
+pytest.importorskip("langchain.text_splitter")
+
+from app.utils import document_loader
+from app.utils.document_loader import IngestionManifest, sync_directory
+
+class FakeVectorDB:
+    """Stands in for the API; deletions fail while fail_deletes is set"""
+
+    def __init__(self):
+        self.ids = set()
+        self.fail_deletes = False
+
+    async def upload_documents(self, documents, api_url, batch_size=50, concurrency=4, max_retries=3, stats=None):
+        async for document in documents:
+            self.ids.add(document["id"])
+            stats.documents_uploaded += 1
+        return stats
+
+    async def delete_from_vector_db(self, ids, api_url, batch_size=500, max_retries=3):
+        if self.fail_deletes:
+            return False
+        self.ids.difference_update(ids)
+        return True
+
+@pytest.fixture
+def vector_db(monkeypatch):
+    db = FakeVectorDB()
+    monkeypatch.setattr(document_loader, "upload_documents", db.upload_documents)
+    monkeypatch.setattr(document_loader, "delete_from_vector_db", db.delete_from_vector_db)
+    return db
+
+def sync(directory, manifest_path):
+    return asyncio.run(sync_directory(str(directory), "http://api", str(manifest_path), workers=1))
+
+def manifest_chunk_ids(manifest_path):
+    manifest = IngestionManifest(str(manifest_path))
+    return {chunk_id for entry in manifest.files.values() for chunk_id in entry["chunk_ids"]}
+
+def test_failed_deletes_are_retried_on_the_next_sync(tmp_path, vector_db):
+    documents = tmp_path / "docs"
+    documents.mkdir()
+    manifest_path = tmp_path / "manifest.json"
+    (documents / "kept.txt").write_text("The first version of a document that will be edited.")
+    (documents / "removed.txt").write_text("A document that will be removed.")
+    sync(documents, manifest_path)
+    assert vector_db.ids == manifest_chunk_ids(manifest_path)
+
+    # Edit one file and remove the other while the database rejects deletions
+    (documents / "kept.txt").write_text("The second version of the document, with different content.")
+    (documents / "removed.txt").unlink()
+    vector_db.fail_deletes = True
+    sync(documents, manifest_path)
+
+    stale_ids = vector_db.ids - manifest_chunk_ids(manifest_path)
+    assert stale_ids
+    assert set(IngestionManifest(str(manifest_path)).pending_deletes) == stale_ids
+
+    # Nothing changed on disk, but the stale chunks are still deleted
+    vector_db.fail_deletes = False
+    stats = sync(documents, manifest_path)
+
+    assert stats.documents_deleted == len(stale_ids)
+    assert vector_db.ids == manifest_chunk_ids(manifest_path)
+    assert IngestionManifest(str(manifest_path)).pending_deletes == []
@@ -0,0 +1,87 @@
+import asyncio
+import threading
+
+import pytest
+
+pytest.importorskip("chromadb")
+pytest.importorskip("sentence_transformers")
+
+from app.api.vector_db import VectorDBService
+from app.api.vector_store_numpy import NumpyVectorClient
+
+class FakeEmbeddingService:
+    dimension = 8
+
+def test_timed_out_calls_leave_the_queue(tmp_path, monkeypatch):
+    monkeypatch.setenv("VECTOR_DB_MAX_WORKERS", "1")
+    monkeypatch.setenv("VECTOR_DB_TIMEOUT", "0.1")
+    service = VectorDBService(NumpyVectorClient(str(tmp_path)), embedding_service=FakeEmbeddingService())
+    release = threading.Event()
+
+    async def scenario():
+        # The first call occupies the only worker, the second times out while still queued
+        results = await asyncio.gather(
+            service._run("blocking", release.wait, 5),
+            service._run("queued", lambda: None),
+            return_exceptions=True
+        )
+        assert all(isinstance(result, TimeoutError) for result in results)
+        assert service.get_stats()["queue_depth"] == 0
+
+        release.set()
+        assert await service._run("after", lambda: "done") == "done"
+        stats = service.get_stats()
+        assert stats["queue_depth"] == 0
+        assert stats["active"] == 0
+        assert stats["timeouts"] == 2
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        release.set()
+        service.executor.shutdown(wait=True)
+
+class SharedCollection:
+    """The parts of a Chroma collection that the corpus version touches"""
+
+    def __init__(self):
+        self.metadata = None
+
+    def delete(self, ids=None, where=None):
+        pass
+
+    def modify(self, metadata=None):
+        self.metadata = dict(metadata)
+
+class SharedClient:
+    """Stands in for a Chroma server that several replicas connect to"""
+
+    def __init__(self):
+        self.collection = SharedCollection()
+
+    def get_collection(self, name, embedding_function=None):
+        return self.collection
+
+def test_corpus_changes_reach_other_replicas(monkeypatch):
+    monkeypatch.setenv("CORPUS_VERSION_REFRESH_SECONDS", "0.01")
+    client = SharedClient()
+    writer = VectorDBService(client, embedding_service=FakeEmbeddingService())
+    reader = VectorDBService(client, embedding_service=FakeEmbeddingService())
+
+    async def scenario():
+        reader.start_version_sync()
+        before = reader.corpus_version
+        await writer.delete_documents(["doc1"])
+        assert writer.corpus_version > before
+
+        await asyncio.sleep(0.1)
+        assert reader.corpus_version == writer.corpus_version
+
+        # A replica started later begins at the shared version
+        assert VectorDBService(client, embedding_service=FakeEmbeddingService()).corpus_version == writer.corpus_version
+        await reader.shutdown()
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        writer.executor.shutdown(wait=True)
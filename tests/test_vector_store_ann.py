@@ -0,0 +1,123 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from app.api.vector_store_ann import IVFCollection, kmeans, assign_nearest
+from app.api.vector_store_numpy import NumpyCollection
+
+DIMENSION = 32
+N_DOCUMENTS = 4000
+
+def clustered_vectors(n: int, seed: int = 0) -> np.ndarray:
+    """Vectors around 40 random centers, like embeddings of a topical corpus"""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((40, DIMENSION))
+    vectors = centers[rng.integers(0, len(centers), n)] + 0.4 * rng.standard_normal((n, DIMENSION))
+    return vectors.astype(np.float32)
+
+def build_collection(tmp_path, monkeypatch, quantization: str, nprobe: int = 8) -> IVFCollection:
+    monkeypatch.setenv("ANN_QUANTIZATION", quantization)
+    monkeypatch.setenv("ANN_NLIST", "32")
+    monkeypatch.setenv("ANN_NPROBE", str(nprobe))
+    monkeypatch.setenv("ANN_PQ_M", "8")
+    monkeypatch.setenv("ANN_RERANK_CANDIDATES", "50")
+    monkeypatch.setenv("ANN_MIN_TRAIN_POINTS", "2000")
+
+    collection = IVFCollection(str(tmp_path / quantization), "documents", DIMENSION)
+    vectors = clustered_vectors(N_DOCUMENTS)
+    for start in range(0, N_DOCUMENTS, 1000):
+        ids = [f"doc{i}" for i in range(start, start + 1000)]
+        texts = [f"text {i}" for i in range(start, start + 1000)]
+        collection.add(ids, vectors[start:start + 1000], texts, [{} for _ in ids])
+    assert collection.trained
+    return collection
+
+def test_kmeans_recovers_separated_clusters():
+    rng = np.random.default_rng(1)
+    centers = np.eye(4, DIMENSION, dtype=np.float32) * 10
+    vectors = (centers[np.repeat(np.arange(4), 100)] + rng.standard_normal((400, DIMENSION))).astype(np.float32)
+
+    centroids = kmeans(vectors, 4)
+    labels = assign_nearest(vectors, centroids)
+
+    # Every true cluster maps to exactly one centroid
+    for cluster in range(4):
+        assert len(set(labels[cluster * 100:(cluster + 1) * 100])) == 1
+    assert len(set(labels)) == 4
+
+@pytest.mark.parametrize("quantization", ["pq", "sq8"])
+def test_recall_against_exact_search(tmp_path, monkeypatch, quantization):
+    collection = build_collection(tmp_path, monkeypatch, quantization)
+    rng = np.random.default_rng(2)
+    queries = clustered_vectors(N_DOCUMENTS)[rng.integers(0, N_DOCUMENTS, 100)]
+    queries += 0.1 * rng.standard_normal(queries.shape).astype(np.float32)
+
+    approximate = collection.query(queries, n_results=10)
+    exact = NumpyCollection.query(collection, queries, n_results=10)
+
+    recall = np.mean([len(set(a) & set(e)) / 10 for a, e in zip(approximate["ids"], exact["ids"])])
+    assert recall >= 0.9
+
+@pytest.mark.parametrize("quantization", ["pq", "sq8"])
+def test_probes_the_list_a_vector_was_assigned_to(tmp_path, monkeypatch, quantization):
+    # With a single probe, a stored vector is only found if the query probes
+    # the list it was assigned to, i.e. probing uses the assignment's metric
+    collection = build_collection(tmp_path, monkeypatch, quantization, nprobe=1)
+    rows = np.arange(0, N_DOCUMENTS, 40)
+
+    results = collection.query(np.asarray(collection._matrix[rows]), n_results=1)
+
+    assert [ids[0] for ids in results["ids"]] == [f"doc{row}" for row in rows]
+
+def test_retrains_with_more_lists_as_the_corpus_grows(tmp_path, monkeypatch):
+    monkeypatch.setenv("ANN_NLIST", "64")
+    monkeypatch.setenv("ANN_NPROBE", "1")
+    monkeypatch.setenv("ANN_PQ_M", "8")
+    monkeypatch.setenv("ANN_MIN_TRAIN_POINTS", "500")
+    path = str(tmp_path / "growing")
+
+    collection = IVFCollection(path, "documents", DIMENSION)
+    vectors = clustered_vectors(N_DOCUMENTS)
+    list_counts = []
+    for start in range(0, N_DOCUMENTS, 500):
+        ids = [f"doc{i}" for i in range(start, start + 500)]
+        collection.add(ids, vectors[start:start + 500], [f"text {i}" for i in ids], [{} for _ in ids])
+        list_counts.append(len(collection.centroids))
+
+    # Lists double with the corpus, then stop at the configured ANN_NLIST
+    assert list_counts[0] == 500 // 39
+    assert list_counts[-1] == 64
+    assert sorted(list_counts) == list_counts
+
+    # Every row is encoded and listed under the final quantizer, also after reopening
+    reopened = IVFCollection(path, "documents", DIMENSION)
+    assert len(reopened.centroids) == 64
+    rows = np.arange(0, N_DOCUMENTS, 40)
+    results = reopened.query(np.asarray(reopened._matrix[rows]), n_results=1)
+    assert [ids[0] for ids in results["ids"]] == [f"doc{row}" for row in rows]
+
+def test_payloads_are_stored_on_disk_and_survive_reopening(tmp_path, monkeypatch):
+    monkeypatch.setenv("ANN_PQ_M", "8")
+    monkeypatch.setenv("ANN_MIN_TRAIN_POINTS", "2000")
+    path = str(tmp_path / "payloads")
+    vectors = clustered_vectors(300)
+    collection = IVFCollection(path, "documents", DIMENSION)
+    collection.add([f"doc{i}" for i in range(300)], vectors, [f"text {i}" for i in range(300)], [{"n": i} for i in range(300)])
+    collection.add(["doc5"], vectors[5:6], ["edited"], [{"n": -5}])
+    collection.delete(ids=[f"doc{i}" for i in range(100, 300)])
+
+    reopened = IVFCollection(path, "documents", DIMENSION)
+    with open(os.path.join(path, "store.json")) as f:
+        assert "documents" not in json.load(f)
+    stored = reopened.get(ids=["doc5", "doc7", "doc150"])
+    assert stored == {"ids": ["doc5", "doc7"], "documents": ["edited", "text 7"], "metadatas": [{"n": -5}, {"n": 7}]}
+    assert reopened.get(where={"n": 42})["documents"] == ["text 42"]
+    assert reopened.query(vectors[7:8], n_results=1)["documents"] == [["text 7"]]
+
+    # Two thirds of the records were dead, so reopening compacted them away
+    payload_files = [name for name in os.listdir(path) if name.startswith("payloads.")]
+    assert len(payload_files) == 1
+    live_bytes = sum(len(json.dumps([document, metadata])) + 1 for document, metadata in zip(*reopened._payloads.read(range(100))))
+    assert os.path.getsize(os.path.join(path, payload_files[0])) == live_bytes